@@ -0,0 +1,145 @@
+"""
+
+This module converts whole RGB planes into YUV planes and back, using NumPy.
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import numpy as np
+import instrument
+
+# ----------------#
+# COLOR CONVERTER #
+# ----------------#
+
+# BT.601 coefficients as integers, so every component is computed with integer arithmetic.
+# Meaning: (constant, coefficient of the 1st, 2nd and 3rd input plane, scale)
+# The 2nd and 3rd input planes of the YUV to RGB formulas are centered (cb - 128, cr - 128).
+Y_COEFS = (0, 299, 587, 114, 1000) # y = 0.299 * r + 0.587 * g + 0.114 * b
+CB_COEFS = (128000000, -168736, -331364, 500000, 1000000) # cb = 128 - 0.168736 * r - 0.331364 * g + 0.5 * b
+CR_COEFS = (128000000, 500000, -418688, -81312, 1000000) # cr = 128 + 0.5 * r - 0.418688 * g - 0.081312 * b
+R_COEFS = (0, 10000, 0, 14075, 10000) # r = y + 1.4075 * (cr - 128)
+G_COEFS = (0, 10000, -3455, -7169, 10000) # g = y - .3455 * (cb - 128) - .7169 * (cr - 128)
+B_COEFS = (0, 1000, 1779, 0, 1000) # b = y + 1.779 * (cb - 128)
+
+# The same formulas with floats, exactly as the original per pixel code wrote them
+_FLOAT_FORMULAS = {
+	Y_COEFS: lambda r, g, b: 0.299 * r + 0.587 * g + 0.114 * b,
+	CB_COEFS: lambda r, g, b: 128 - 0.168736 * r - 0.331364 * g + 0.5 * b,
+	CR_COEFS: lambda r, g, b: 128 + 0.5 * r - 0.418688 * g - 0.081312 * b,
+	R_COEFS: lambda y, cb, cr: y + 1.4075 * cr,
+	G_COEFS: lambda y, cb, cr: y - .3455 * cb - .7169 * cr,
+	B_COEFS: lambda y, cb, cr: y + 1.779 * cb,
+}
+
+
+#*******************************************************************************#
+#	Function _component: This computes one output plane given three int32      #
+#	input planes and the fixed-point coefficients of its formula. The integer   #
+#	result is floor(n / scale), which is the same as the old int() truncation   #
+#	once values are clipped to 0..255. The only pixels where they can differ    #
+#	are the ones with an exact integer result, since the float formula might    #
+#	give 254.99999 instead of 255; those few pixels are computed again with     #
+#	the float formula, so the result matches the original code bit for bit.    #
+#	Input: three input planes (int32), coefficients, output plane (uint8)       #
+#	Output: output plane                                                        #
+#*******************************************************************************#
+
+def _component(p0, p1, p2, coefs, out):
+	constant, c0, c1, c2, scale = coefs
+
+	n = p0 * c0
+	if c1:
+		n += p1 * c1
+	if c2:
+		n += p2 * c2
+	if constant:
+		n += constant
+
+	result = n // scale
+
+	# Exact integer results: we use the float formula for them
+	boundary = np.flatnonzero(n % scale == 0)
+	if len(boundary):
+		formula = _FLOAT_FORMULAS[coefs]
+		values = formula(p0.flat[boundary].astype(np.float64),
+						 p1.flat[boundary].astype(np.float64),
+						 p2.flat[boundary].astype(np.float64))
+		result.flat[boundary] = np.trunc(values)
+
+	np.clip(result, 0, 255, out=result)
+	out[...] = result
+
+	return out
+
+
+def _outputs(shape, out):
+	if out is None:
+		return tuple(np.empty(shape, dtype=np.uint8) for _ in range(3))
+	return out
+
+
+#*******************************************************************#
+#	Function RGBtoYUV: This converts three RGB planes in their      #
+#	equivalent YUV planes.                                          #
+#	Input: r, g, b (arrays or lists, values from 0 to 255),         #
+#	optional output planes                                          #
+#	Output: y, cb, cr (uint8 arrays with the shape of r)            #
+#*******************************************************************#
+
+@instrument.timed("RGBtoYUV")
+def RGBtoYUV(r, g, b, out=None):
+	"""Transforms whole R, G and B planes into Y, Cb and Cr planes.
+
+	Parameters: R, G and B planes (arrays or lists of integers from 0 to 255,
+	all of them with the same shape), output planes (tuple of three uint8
+	arrays with that shape, optional).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	r = np.asarray(r, dtype=np.int32)
+	g = np.asarray(g, dtype=np.int32)
+	b = np.asarray(b, dtype=np.int32)
+
+	y, cb, cr = _outputs(r.shape, out)
+
+	_component(r, g, b, Y_COEFS, y)
+	_component(r, g, b, CB_COEFS, cb)
+	_component(r, g, b, CR_COEFS, cr)
+
+	return y, cb, cr
+
+
+#*******************************************************************#
+#	Function YUVtoRGB: This converts three YUV planes in their      #
+#	equivalent RGB planes, clipped to 0..255.                       #
+#	Input: y, cb, cr (arrays or lists, values from 0 to 255),       #
+#	optional output planes                                          #
+#	Output: r, g, b (uint8 arrays with the shape of y)              #
+#*******************************************************************#
+
+@instrument.timed("YUVtoRGB")
+def YUVtoRGB(y, cb, cr, out=None):
+	"""Transforms whole Y, Cb and Cr planes into R, G and B planes.
+
+	Parameters: Y, Cb and Cr planes (arrays or lists of integers from 0 to
+	255, all of them with the same shape), output planes (tuple of three uint8
+	arrays with that shape, optional). An interleaved RGB buffer can be
+	filled by giving its rgb[..., 0], rgb[..., 1] and rgb[..., 2] views.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	y = np.asarray(y, dtype=np.int32)
+	cb = np.asarray(cb, dtype=np.int32) - 128
+	cr = np.asarray(cr, dtype=np.int32) - 128
+
+	r, g, b = _outputs(y.shape, out)
+
+	_component(y, cb, cr, R_COEFS, r)
+	_component(y, cb, cr, G_COEFS, g)
+	_component(y, cb, cr, B_COEFS, b)
+
+	return r, g, b
@@ -7,6 +7,8 @@ import os
 import marshal
 import cPickle
 import array
+import numpy as np
+import instrument
 
 
 
@@ -65,6 +67,47 @@ def _gen_huffman_code(node, dict_codes, buffer_stack=[]):
     _gen_huffman_code(node.R, dict_codes, buffer_stack)
     buffer_stack.pop()
 
+def _tree_codes(node, code, codes):
+    # Codes {symbol: '0101'} of a tree that may have nodes with a single
+    # child, as the trees of canonical codes of a single symbol
+    if node is None:
+        return codes
+    if node.c:
+        codes[node.c] = code
+        return codes
+    _tree_codes(node.L, code + '0', codes)
+    return _tree_codes(node.R, code + '1', codes)
+
+def canonical_codes(code_lengths):
+    """Returns the canonical Huffman codes {symbol: '0101'} of some lengths.
+
+    Symbols are sorted by code length and then by value, so the lengths are
+    everything a decoder needs to rebuild the same codes.
+    """
+    codes = {}
+    code, prev_length = 0, 0
+    for length, ch in sorted((l, c) for c, l in code_lengths.iteritems() if l):
+        code <<= length - prev_length
+        codes[ch] = bin(code)[2:].zfill(length)
+        code, prev_length = code + 1, length
+    return codes
+
+def _tree_from_codes(codes):
+    root = HuffmanNode()
+    for ch, code in codes.iteritems():
+        node = root
+        for bit in code:
+            if bit == '1':
+                if not node.R:
+                    node.R = HuffmanNode(parent=node)
+                node = node.R
+            else:
+                if not node.L:
+                    node.L = HuffmanNode(parent=node)
+                node = node.L
+        node.c = ch
+    return root
+
 def _cal_freq(long_str):
     from collections import defaultdict
     d = defaultdict(int)
@@ -74,6 +117,15 @@ def _cal_freq(long_str):
 
 MAX_BITS = 8
 
+# Bits read at once by the decoder; codes up to this length are decoded with a
+# single table lookup, and every lookup may give several symbols
+TABLE_BITS = 11
+# Bits whose windows are computed at once, so the decoder memory does not grow with the stream
+WINDOWS_CHUNK = 1 << 16
+# Decoding tables already built, keyed by the codes they decode (at most TABLES_CACHE of them)
+TABLES_CACHE = 256
+_tables = {}
+
 class Encoder(object):
     bitslen=0
     
@@ -140,70 +192,197 @@ class Encoder(object):
         self.long_str = fp.read()
         fp.close()
 
-    def write(self, filename):
+    def encode_to_bytes(self, long_str=None):
+        """Returns the codified string (header with the tree and codes) as bytes."""
+        if long_str is not None:
+            self.long_str = long_str
+        # la cabecera con la tabla de codigos ocupa. no es gratis
+        return marshal.dumps(
+            (cPickle.dumps(self.root), self.code_length, self.array_codes))
+
+    def code_lengths(self):
+        """Returns the length of the code of every symbol {symbol: length}."""
+        # A single symbol gets a 1 bit code instead of an empty one
+        return dict((ch, len(code) or 1) for ch, code in self.code_map.iteritems())
+
+    def encode_canonical(self, long_str=None):
+        """Codifies the string with canonical codes of the same lengths.
+
+        Returns the code lengths, the number of bits and the codified bytes.
+        """
+        # The long_str setter would also encode with the codes of the tree, we
+        # only need their lengths
+        if long_str is not None:
+            self._long_str = long_str
+        self.root = self._get_tree_root()
+        self.code_map = self._get_code_map()
+        lengths = self.code_lengths()
+        self.code_map = canonical_codes(lengths)
+        self.array_codes, self.code_length = self._encode()
+        if instrument.enabled:
+            instrument.count("huffman_bits", self.code_length)
+            instrument.count("huffman_symbols", len(self.long_str))
+        return lengths, self.code_length, self.array_codes.tostring()
+
+    def write(self, filename_or_fp):
+        """Writes the codified string in a file (name or file-like object)."""
         if self._long_str:
-            fcompressed = open(filename, 'wb')
-            # la cabecera con la tabla de codigos ocupa. no es gratis
-            marshal.dump(
-                (cPickle.dumps(self.root), self.code_length, self.array_codes),
-                fcompressed)
-            #marshal.dump(
-            #    ( self.array_codes),
-            #    fcompressed)
-            
-            fcompressed.close()
+            data = self.encode_to_bytes()
+            if hasattr(filename_or_fp, 'write'):
+                filename_or_fp.write(data)
+            else:
+                fcompressed = open(filename_or_fp, 'wb')
+                fcompressed.write(data)
+                fcompressed.close()
         else:
             print "You haven't set 'long_str' attribute."
 
 class Decoder(object):
     def __init__(self, filename_or_raw_str=None):
         if filename_or_raw_str:
-            if os.path.exists(filename_or_raw_str):
-                filename = filename_or_raw_str
-                self.read(filename)            
+            if hasattr(filename_or_raw_str, 'read') or \
+               os.path.exists(filename_or_raw_str):
+                self.read(filename_or_raw_str)
             else:
-                print '[Decoder] take \'%s\' as raw string' % filename_or_raw_str
-                raw_string = filename_or_raw_str
-                unpickled_root, length, array_codes = marshal.loads(raw_string)
-                self.root = cPickle.loads(unpickled_root)
-                self.code_length = length        
-                self.array_codes = array.array('B', array_codes)
+                print '[Decoder] take the argument as raw string'
+                self.loads(filename_or_raw_str)
 
-    def _decode(self):
-        string_buf = []
-        total_length = 0    
-        node = self.root
-        for code in self.array_codes:
-            buf_length = 0
-            while (buf_length < MAX_BITS and total_length != self.code_length):
-                buf_length += 1
-                total_length += 1            
-                if code >> (MAX_BITS - buf_length) & 1:
+    def _get_table(self):
+        # Every plane and block with the same codes uses the same table, so it
+        # is only built once
+        key = tuple(sorted(_tree_codes(self.root, '', {}).iteritems()))
+        table = _tables.get(key)
+        if table is None:
+            if len(_tables) >= TABLES_CACHE:
+                _tables.clear()
+            table = _tables[key] = self._build_table()
+        return table
+
+    def _build_table(self):
+        # For every TABLE_BITS window: symbols fully decoded in it and the bits
+        # each one ends at. Windows starting with a longer code get nothing
+        syms_table, bits_table, ends_table = [], [], []
+        for window in xrange(1 << TABLE_BITS):
+            syms, ends = [], []
+            node = self.root
+            for bit in xrange(TABLE_BITS):
+                if window >> (TABLE_BITS - 1 - bit) & 1:
                     node = node.R
-                    if node.c:
-                        string_buf.append(node.c)
-                        node = self.root
                 else:
                     node = node.L
-                    if node.c:
-                        string_buf.append(node.c)
-                        node = self.root
+                if node is None: # Not a code of this tree
+                    break
+                if node.c:
+                    syms.append(node.c)
+                    ends.append(bit + 1)
+                    node = self.root
+            syms_table.append(''.join(syms))
+            bits_table.append(ends[-1] if ends else 0)
+            ends_table.append(ends)
+        return syms_table, bits_table, ends_table
 
-        return ''.join(string_buf)        
+    def _get_windows(self, codes, start):
+        # Value of the TABLE_BITS bits starting at every bit from start, for
+        # WINDOWS_CHUNK bits at most. Bits after the stream are zero
+        count = min(WINDOWS_CHUNK, self.code_length - start)
+        first = start >> 3
+        bits = np.unpackbits(codes[first:(start + count + TABLE_BITS + 7) >> 3])
+        bits = bits[start - (first << 3):][:min(count + TABLE_BITS, self.code_length - start)]
+        bits = np.concatenate((bits, np.zeros(count + TABLE_BITS - len(bits), dtype=np.uint8)))
+        windows = np.zeros(count, dtype=np.uint16)
+        for bit in xrange(TABLE_BITS):
+            windows |= bits[bit:bit + count].astype(np.uint16) << (TABLE_BITS - 1 - bit)
+        return windows.tolist()
 
-    def read(self, filename):
-        fp = open(filename, 'rb')
-        unpickled_root, length, array_codes = marshal.load(fp)        
+    def _decode_long(self, codes, pos):
+        # Codes longer than TABLE_BITS are followed bit by bit in the tree
+        node = self.root
+        while not node.c:
+            node = node.R if codes[pos >> 3] >> (7 - (pos & 7)) & 1 else node.L
+            pos += 1
+        return node.c, pos
+
+    def _decode(self):
+        # A tree with a single symbol has no code at all
+        if self.root.c or self.code_length == 0:
+            return ''
+
+        syms_table, bits_table, ends_table = self._get_table()
+        codes = np.frombuffer(self.array_codes, dtype=np.uint8)
+
+        string_buf = []
+        append = string_buf.append
+        pos = 0
+        start = end = 0 # Bits of the windows computed now
+        fast_end = self.code_length - TABLE_BITS
+        while pos < self.code_length:
+            if pos >= end:
+                windows = self._get_windows(codes, pos)
+                start, end = pos, pos + len(windows)
+            window = windows[pos - start]
+            if pos <= fast_end:
+                length = bits_table[window]
+                if length:
+                    append(syms_table[window])
+                    pos += length
+                    continue
+            else:
+                # Last bits: padding is not decoded
+                left = self.code_length - pos
+                ends = [end for end in ends_table[window] if end <= left]
+                if ends:
+                    append(syms_table[window][:len(ends)])
+                    pos += ends[-1]
+                    continue
+            ch, pos = self._decode_long(codes, pos)
+            append(ch)
+
+        return ''.join(string_buf)
+
+    def loads(self, data):
+        """Loads codified data from bytes (or any buffer)."""
+        unpickled_root, length, array_codes = marshal.loads(bytes(data))
         self.root = cPickle.loads(unpickled_root)
         self.code_length = length        
         self.array_codes = array.array('B', array_codes)
-        fp.close()
 
-    def decode_as(self, filename):
+    def load_canonical(self, code_lengths, code_length, data):
+        """Loads codified bytes given the canonical code lengths and the number of bits."""
+        self.root = _tree_from_codes(canonical_codes(code_lengths))
+        self.code_length = code_length
+        self.array_codes = data # Any buffer, it is only read by _get_windows
+
+    def read(self, filename_or_fp):
+        """Loads codified data from a file (name or file-like object)."""
+        if hasattr(filename_or_fp, 'read'):
+            self.loads(filename_or_fp.read())
+        else:
+            fp = open(filename_or_fp, 'rb')
+            self.loads(fp.read())
+            fp.close()
+
+    def decode_from_bytes(self, data=None):
+        """Returns the decoded string, loading it from bytes first if given."""
+        if data is not None:
+            self.loads(data)
+        return self._decode()
+
+    def decode_as(self, filename_or_fp):
         decoded = self._decode()
-        fout = open(filename, 'wb')
-        fout.write(decoded)
-        fout.close()
+        if hasattr(filename_or_fp, 'write'):
+            filename_or_fp.write(decoded)
+        else:
+            fout = open(filename_or_fp, 'wb')
+            fout.write(decoded)
+            fout.close()
+
+def encode_to_bytes(long_str):
+    """Returns the Huffman codified bytes of a string."""
+    return Encoder().encode_to_bytes(long_str)
+
+def decode_from_bytes(data):
+    """Returns the string decoded from Huffman codified bytes."""
+    return Decoder().decode_from_bytes(data)
 
 if __name__=='__main__':
     original_file = 'filename.txt'
@@ -0,0 +1,228 @@
+"""
+
+This module measures the codec while it runs: how long every stage takes and
+how much work it does (pixels, symbols, 'X' symbols, bytes). It is off by
+default; turn it on with enable() or the LHE_INSTRUMENT environment variable.
+When it is off, timed functions only check a flag and counters are not even
+computed (callers check instrument.enabled first).
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import functools
+import json
+import os
+import threading
+import time
+
+# -----------------#
+# INSTRUMENTATION  #
+# -----------------#
+
+enabled = os.environ.get("LHE_INSTRUMENT", "") not in ("", "0")
+
+_lock = threading.Lock()
+_timers = {} # Stage: [calls, seconds]
+_counters = {} # Name: value
+_listeners = []
+
+
+def enable():
+	"""Turns the instrumentation on."""
+	global enabled
+	enabled = True
+
+
+def disable():
+	"""Turns the instrumentation off (what was measured is kept)."""
+	global enabled
+	enabled = False
+
+
+def reset():
+	"""Forgets every timer and counter."""
+	with _lock:
+		_timers.clear()
+		_counters.clear()
+
+
+#*******************************************************************************#
+#	Function addListener: This adds a function that gets every measure as it    #
+#	happens: listener(kind, name, value), kind being "timer" (value in seconds) #
+#	or "counter". It is called in the thread that measured.                     #
+#	Input: listener                                                             #
+#	Output: None                                                                #
+#*******************************************************************************#
+
+def addListener(listener):
+	"""Calls listener(kind, name, value) for every timer ("timer") and counter ("counter")."""
+	_listeners.append(listener)
+
+
+def removeListener(listener):
+	"""Stops calling a listener added with addListener."""
+	_listeners.remove(listener)
+
+
+def _record(kind, name, value):
+	with _lock:
+		if (kind == "timer"):
+			timer = _timers.setdefault(name, [0, 0.0])
+			timer[0] += 1
+			timer[1] += value
+		else:
+			_counters[name] = _counters.get(name, 0) + value
+	for listener in _listeners:
+		listener(kind, name, value)
+
+
+def count(name, value=1):
+	"""Adds value to a counter (if the instrumentation is on)."""
+	if enabled:
+		_record("counter", name, value)
+
+
+#*******************************************************************************#
+#	Class timer: This measures a block of code as a stage:                      #
+#	    with instrument.timer("stage"):                                         #
+#	        ...                                                                 #
+#	Input: name of the stage                                                    #
+#*******************************************************************************#
+
+class timer(object):
+	"""Context manager that adds the time of its block to a stage (if the instrumentation is on)."""
+	def __init__(self, name):
+		self.name = name
+		self.start = None
+
+	def __enter__(self):
+		if enabled:
+			self.start = time.time()
+		return self
+
+	def __exit__(self, *exc):
+		if self.start is not None:
+			_record("timer", self.name, time.time() - self.start)
+			self.start = None
+
+
+#*******************************************************************************#
+#	Function timed: This is a decorator that measures every call of a function  #
+#	as a stage. Stages can be inside other stages: every one gets its own time. #
+#	Input: name of the stage                                                    #
+#	Output: decorator                                                           #
+#*******************************************************************************#
+
+def timed(name):
+	"""Decorator that adds the time of every call to a stage (if the instrumentation is on)."""
+	def decorator(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			if not enabled:
+				return function(*args, **kwargs)
+			start = time.time()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				_record("timer", name, time.time() - start)
+		return wrapper
+	return decorator
+
+
+#*******************************************************************************#
+#	Function snapshot: This gets everything measured until now, so it can be    #
+#	exported, sent from a worker to its parent (see merge) or compared.        #
+#	Input: None                                                                 #
+#	Output: {"timers": {stage: {"calls": n, "seconds": s}}, "counters": {...}}  #
+#*******************************************************************************#
+
+def snapshot():
+	"""Returns the timers and counters measured until now (a dictionary)."""
+	with _lock:
+		return {"timers": dict([(name, {"calls": calls, "seconds": seconds}) for name, (calls, seconds) in _timers.items()]),
+				"counters": dict(_counters)}
+
+
+def merge(other):
+	"""Adds a snapshot (of a worker, for example) to the timers and counters of this process."""
+	with _lock:
+		for name, stage in other["timers"].items():
+			timer = _timers.setdefault(name, [0, 0.0])
+			timer[0] += stage["calls"]
+			timer[1] += stage["seconds"]
+		for name, value in other["counters"].items():
+			_counters[name] = _counters.get(name, 0) + value
+
+
+#*******************************************************************************#
+#	Class pooled: This runs a function in a worker process of a pool and sends  #
+#	back what it measured with its result, so the parent adds it with collect:  #
+#	    results = [instrument.collect(output) for output in                     #
+#	               pool.map(instrument.pooled(function), tasks)]                #
+#	Workers measure if the parent did when it sent the task. In the parent      #
+#	itself (a pool of threads, for example) the function just runs.             #
+#	Input: function (of the module level, so it can be pickled)                 #
+#*******************************************************************************#
+
+class pooled(object):
+	"""Wraps a function for a pool, so it returns (result, snapshot or None) for collect."""
+	def __init__(self, function):
+		self.function = function
+		self.enabled = enabled
+		self.parent = os.getpid()
+
+	def __call__(self, *args):
+		global enabled
+		if (os.getpid() == self.parent):
+			return self.function(*args), None
+
+		# A worker sends only what it measured for this task
+		enabled = self.enabled
+		if not enabled:
+			return self.function(*args), None
+		reset()
+		result = self.function(*args)
+		return result, snapshot()
+
+
+def collect(output):
+	"""Returns the result of a pooled function, adding what its worker measured to this process."""
+	result, measured = output
+	if measured is not None:
+		merge(measured)
+	return result
+
+
+#*******************************************************************************#
+#	Function prometheusText: This exports everything measured in the Prometheus #
+#	text format: every stage as lhe_stage_seconds_total and                     #
+#	lhe_stage_calls_total with a stage label, and every counter as              #
+#	lhe_<counter>_total.                                                        #
+#	Input: prefix of the metrics (optional)                                     #
+#	Output: text                                                                #
+#*******************************************************************************#
+
+def prometheusText(prefix="lhe"):
+	"""Returns the timers and counters in the Prometheus text format."""
+	data = snapshot()
+	lines = []
+
+	if data["timers"]:
+		for metric, key in (("stage_seconds_total", "seconds"), ("stage_calls_total", "calls")):
+			lines.append("# TYPE %s_%s counter" % (prefix, metric))
+			for name in sorted(data["timers"]):
+				lines.append('%s_%s{stage="%s"} %r' % (prefix, metric, name, data["timers"][name][key]))
+
+	for name in sorted(data["counters"]):
+		lines.append("# TYPE %s_%s_total counter" % (prefix, name))
+		lines.append("%s_%s_total %r" % (prefix, name, data["counters"][name]))
+
+	return "\n".join(lines) + "\n"
+
+
+def logLine(**fields):
+	"""Returns a JSON line with the timers, the counters and any other fields given."""
+	data = snapshot()
+	data.update(fields)
+	return json.dumps(data, sort_keys=True)
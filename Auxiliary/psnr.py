@@ -1,12 +1,15 @@
 """
 
 This module calculates the Peak Signal to Noise Ratio (PSNR) of a codified image.
+See quality.py for the PSNR of every plane, the weighted PSNR and the SSIM.
 
 """
 # LHE Codec
 # Author: Eduardo Rodes Pastor
 
 import math
+import numpy as np
+from quality import squaredError
 
 # ----------------#
 # PSNR CALCULATOR #
@@ -26,21 +29,16 @@ def calculatePSNR(y_pred, y, npix):
         It compares the predicted luminance list with the original one and gets
         the total error between them.
 
-        Parameters: predicted luminance (integer list with values from 0 to 255), 
-        original luminance (integer list with values from 0 to 255), number of 
-        pixels of the image (integer)
+        Parameters: predicted luminance (integer list or array with values from
+        0 to 255), original luminance (integer list or array with values from 0
+        to 255, with the same number of values), number of pixels of the image (integer)
 
-        Exceptions: This function does not throw an exception.
+        Exceptions: This will throw ValueError if the luminance lists have not
+        the same number of values.
 
         """
-        total_y = 0 # Summatory of squared errors
+        total_y = squaredError(np.ravel(y_pred), np.ravel(y)) # Summatory of squared errors, computed at once (see quality.py)
 
-        for i in range(0, len(y)): 
-                
-                dif_y = y_pred[i] - y[i] # Simple error between predicted and original luminance
-
-                total_y = total_y + pow(dif_y, 2) # We add its square to the summatory
-                         
         meanSquaredError = float(total_y) / float(npix) # And we get the mean squared error per pixel
         
         if (meanSquaredError != 0):
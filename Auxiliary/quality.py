@@ -0,0 +1,270 @@
+"""
+
+This module measures the quality of a decoded image against the original one:
+mean squared error and PSNR of every plane (Y, Cb and Cr), the weighted PSNR
+of the three planes and the SSIM of every plane. Everything is computed with
+NumPy a band of rows at a time, so images larger than memory (memory mapped
+files, or bands decoded one after the other) can be measured too.
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import collections
+import math
+import numpy as np
+import color
+
+# ----------------#
+# QUALITY METRICS #
+# ----------------#
+
+PEAK = 255 # We use 255 because we're using 8 bits for every value
+MAX_PSNR = 100.0 # PSNR of identical planes (it would be infinite)
+PSNR_WEIGHTS = (6, 1, 1) # Weights of Y, Cb and Cr in the weighted PSNR
+SSIM_BLOCK = 4 # SSIM windows are 2x2 blocks of 4x4 pixels, so they are 8x8 pixels and there is one every 4 pixels
+SSIM_C1 = (0.01 * PEAK) ** 2
+SSIM_C2 = (0.03 * PEAK) ** 2
+DEFAULT_ROWS = 256 # Rows measured at a time by compareYUV and compareRGB
+
+# Quality of a decoded image: pixels of a plane, and mean squared error, PSNR (dB) and SSIM of every
+# plane, psnr being the weighted PSNR. The SSIM of a plane is None if it has no 8x8 window
+Quality = collections.namedtuple("Quality", "pixels mse_y mse_cb mse_cr psnr_y psnr_cb psnr_cr psnr ssim_y ssim_cb ssim_cr")
+
+
+#*******************************************************************************#
+#	Function squaredError: This adds the squared differences between two arrays #
+#	at once. Every square is an exact integer, and so is their sum in float64   #
+#	for any image with less than 2^53 / 255^2 (138 billion) values.             #
+#	Input: original and decoded values (arrays or lists of the same shape)      #
+#	Output: sum of squared errors (float)                                       #
+#*******************************************************************************#
+
+def squaredError(original, decoded):
+	"""Returns the sum of the squared differences between two arrays.
+
+	Parameters: original and decoded values (arrays or lists of the same
+	shape, values from 0 to 255).
+
+	Exceptions: This will throw ValueError if their shapes are different.
+
+	"""
+	original = np.asarray(original)
+	decoded = np.asarray(decoded)
+	if (original.shape != decoded.shape):
+		raise ValueError("Shapes %s and %s are different" % (original.shape, decoded.shape))
+
+	diff = original.astype(np.float64).ravel()
+	diff -= decoded.ravel()
+	return float(np.dot(diff, diff))
+
+
+def mse(original, decoded):
+	"""Returns the mean squared error of two arrays (or lists) of the same shape."""
+	size = np.size(original)
+	return squaredError(original, decoded) / size if size else 0.0
+
+
+def psnr(mse, peak=PEAK):
+	"""Returns the PSNR (dB) of a mean squared error, MAX_PSNR if it is 0."""
+	if (mse == 0):
+		return MAX_PSNR
+	return min(MAX_PSNR, 10 * math.log10(float(peak * peak) / mse))
+
+
+def weightedPSNR(psnr_y, psnr_cb, psnr_cr):
+	"""Returns the PSNR of the three planes weighted with PSNR_WEIGHTS (6:1:1)."""
+	return (PSNR_WEIGHTS[0] * psnr_y + PSNR_WEIGHTS[1] * psnr_cb + PSNR_WEIGHTS[2] * psnr_cr) / float(sum(PSNR_WEIGHTS))
+
+
+#*******************************************************************************#
+#	Function _blockSums: This adds, for every 4x4 block of a band, the original #
+#	and decoded values, their squares and their products. Every SSIM window is  #
+#	then 2x2 of these blocks. Rows and columns out of a whole block are left    #
+#	out, as in x264 and libvpx.                                                 #
+#	Input: original and decoded planes (rows x width, rows multiple of 4)       #
+#	Output: sums (int64 array of 5 x block rows x block columns)                #
+#*******************************************************************************#
+
+def _blockSums(original, decoded):
+	n, m = original.shape[0] // SSIM_BLOCK, original.shape[1] // SSIM_BLOCK
+	x = original[:n * SSIM_BLOCK, :m * SSIM_BLOCK].astype(np.int32)
+	y = decoded[:n * SSIM_BLOCK, :m * SSIM_BLOCK].astype(np.int32)
+
+	# Adding strided rows and then columns is much faster than sum() on a reshaped array
+	sums = np.empty((5, n, m), dtype=np.int64)
+	for i, values in enumerate((x, y, x * x, y * y, x * y)):
+		rows = values[0::SSIM_BLOCK].copy()
+		for k in range(1, SSIM_BLOCK):
+			rows += values[k::SSIM_BLOCK]
+		sums[i] = rows[:, 0::SSIM_BLOCK]
+		for k in range(1, SSIM_BLOCK):
+			sums[i] += rows[:, k::SSIM_BLOCK]
+	return sums
+
+
+#*******************************************************************************#
+#	Function _ssimWindows: This computes the SSIM of every window (2x2 blocks)  #
+#	of some rows of block sums and adds them.                                   #
+#	Input: block sums (see _blockSums, at least 2 rows and 2 columns)           #
+#	Output: sum of the SSIM of the windows, number of windows                   #
+#*******************************************************************************#
+
+def _ssimWindows(sums):
+	windows = sums[:, :-1, :-1] + sums[:, 1:, :-1] + sums[:, :-1, 1:] + sums[:, 1:, 1:]
+	mean_x, mean_y, xx, yy, xy = windows / float((2 * SSIM_BLOCK) ** 2)
+
+	mean_xy = mean_x * mean_y
+	mean_xx = mean_x * mean_x
+	mean_yy = mean_y * mean_y
+	ssim = (2 * mean_xy + SSIM_C1) * (2 * (xy - mean_xy) + SSIM_C2)
+	ssim /= (mean_xx + mean_yy + SSIM_C1) * (xx - mean_xx + yy - mean_yy + SSIM_C2)
+
+	return float(ssim.sum()), ssim.size
+
+
+#*******************************************************************************#
+#	Class QualityMeter: This measures an image a band of rows at a time, in     #
+#	order, keeping only the errors added until now, the rows of the last band  #
+#	that do not fill a row of SSIM blocks and the sums of the last row of       #
+#	blocks. The result is the same one we get measuring the whole image.        #
+#	Input: width of the image and True if we want the SSIM                      #
+#*******************************************************************************#
+
+class QualityMeter(object):
+	"""Measures the quality of an image given a band of rows at a time.
+
+	Parameters: width of the image (integer), True if we want the SSIM
+	(boolean, True by default; it is slower than the PSNR).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	def __init__(self, width, ssim=True):
+		self.width = width
+		self.ssim = ssim
+		self.rows = 0 # Rows measured
+		self._errors = [0.0, 0.0, 0.0] # Squared errors of every plane
+		self._ssim = [0.0, 0.0, 0.0] # SSIM of the windows of every plane
+		self._windows = [0, 0, 0]
+		self._pending = [None, None, None] # Rows (original, decoded) not in a row of blocks yet
+		self._last = [None, None, None] # Sums of the last row of blocks
+
+	def update(self, original, decoded):
+		"""Measures the next band of rows of the image.
+
+		Parameters: original and decoded bands (sequences of Y, Cb and Cr
+		planes, uint8 arrays of rows x width, as a 3 x rows x width array).
+
+		Exceptions: This will throw ValueError if the planes have not the
+		same shape, or their width is not the width of the image.
+
+		"""
+		planes = [(np.asarray(original[i]), np.asarray(decoded[i])) for i in range(0, 3)]
+		rows = planes[0][0].shape[0]
+		for x, y in planes:
+			if (x.shape != y.shape or x.shape != (rows, self.width)):
+				raise ValueError("Planes of %s and %s values can not be measured with width %d" % (x.shape, y.shape, self.width))
+
+		for i, (x, y) in enumerate(planes):
+			self._errors[i] += squaredError(x, y)
+			if self.ssim:
+				self._updateSSIM(i, x, y)
+
+		self.rows += rows
+
+	def updateRGB(self, original, decoded):
+		"""Measures the next band of rows of the image, given in RGB.
+
+		Parameters: original and decoded bands (uint8 arrays of rows x width
+		x 3), converted to YCbCr as the encoder does.
+
+		Exceptions: This will throw ValueError if the bands have not the
+		same shape, or their width is not the width of the image.
+
+		"""
+		original, decoded = np.asarray(original), np.asarray(decoded)
+		self.update(color.RGBtoYUV(original[:, :, 0], original[:, :, 1], original[:, :, 2]),
+					color.RGBtoYUV(decoded[:, :, 0], decoded[:, :, 1], decoded[:, :, 2]))
+
+	def _updateSSIM(self, i, x, y):
+		if self._pending[i] is not None:
+			x = np.concatenate((self._pending[i][0], x))
+			y = np.concatenate((self._pending[i][1], y))
+
+		used = x.shape[0] // SSIM_BLOCK * SSIM_BLOCK
+		self._pending[i] = (x[used:].copy(), y[used:].copy()) if used < x.shape[0] else None
+		if not used:
+			return
+
+		sums = _blockSums(x[:used], y[:used])
+		if self._last[i] is not None:
+			sums = np.concatenate((self._last[i], sums), axis=1)
+		self._last[i] = sums[:, -1:]
+
+		if (sums.shape[1] > 1 and sums.shape[2] > 1):
+			total, windows = _ssimWindows(sums)
+			self._ssim[i] += total
+			self._windows[i] += windows
+
+	def result(self):
+		"""Returns the Quality of the rows measured until now.
+
+		Exceptions: This will throw ValueError if nothing was measured.
+
+		"""
+		pixels = self.rows * self.width
+		if not pixels:
+			raise ValueError("There are no pixels to measure")
+
+		errors = [error / pixels for error in self._errors]
+		psnrs = [psnr(error) for error in errors]
+		ssims = [total / windows if windows else None for total, windows in zip(self._ssim, self._windows)]
+
+		return Quality(pixels, *(errors + psnrs + [weightedPSNR(*psnrs)] + ssims))
+
+
+#*******************************************************************************#
+#	Function compareYUV: This measures a decoded image given its planes and the #
+#	original ones. Planes can be memory mapped: they are read a band at a time. #
+#	Input: original and decoded Y, Cb and Cr planes, True if we want the SSIM,  #
+#	rows measured at a time                                                     #
+#	Output: Quality                                                             #
+#*******************************************************************************#
+
+def compareYUV(original, decoded, ssim=True, rows=DEFAULT_ROWS):
+	"""Returns the Quality of a decoded image given in YCbCr.
+
+	Parameters: original and decoded images (sequences of Y, Cb and Cr
+	planes, arrays of height x width with values from 0 to 255), True if we
+	want the SSIM (boolean), rows measured at a time (integer).
+
+	Exceptions: This will throw ValueError if the planes have not the same
+	shape.
+
+	"""
+	if ([np.shape(plane) for plane in original] != [np.shape(plane) for plane in decoded]):
+		raise ValueError("The planes of both images have not the same shape")
+
+	height, width = np.shape(original[0])
+	meter = QualityMeter(width, ssim)
+	for h in range(0, height, rows):
+		meter.update([plane[h:h + rows] for plane in original], [plane[h:h + rows] for plane in decoded])
+	return meter.result()
+
+
+def compareRGB(original, decoded, ssim=True, rows=DEFAULT_ROWS):
+	"""Returns the Quality of a decoded image given in RGB (arrays of height x width x 3, or PIL images).
+
+	Exceptions: This will throw ValueError if the images have not the same
+	shape.
+
+	"""
+	original, decoded = np.asarray(original), np.asarray(decoded)
+	if (original.shape != decoded.shape):
+		raise ValueError("Shapes %s and %s are different" % (original.shape, decoded.shape))
+
+	meter = QualityMeter(original.shape[1], ssim)
+	for h in range(0, original.shape[0], rows):
+		meter.updateRGB(original[h:h + rows], decoded[h:h + rows])
+	return meter.result()
@@ -0,0 +1,147 @@
+"""
+
+This module is an adaptive binary range coder (the one used by LZMA) for hops.
+Every hop is coded with 4 binary decisions, and their probabilities depend on
+the upper and the previous hop.
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+# --------------#
+# RANGE CODER   #
+# --------------#
+
+PROB_BITS = 11 # Probabilities are integers from 0 to 2048
+PROB_INIT = 1 << (PROB_BITS - 1) # Every decision starts with probability 1/2
+MOVE_BITS = 4 # Adaptation speed: the bigger, the slower
+TOP = 1 << 24 # Range is normalized when it gets under this
+
+NO_HOP = 9 # Context value when there is no upper or previous hop
+CONTEXTS = 10 * 10 # Upper hop (or NO_HOP) x previous hop (or NO_HOP)
+TREE_SIZE = 16 # Hops 0 to 8 are coded with a binary tree of 4 decisions
+
+
+#*******************************************************************************#
+#	Function rangeEncodeKernel: This codifies a hops list with the range coder. #
+#	It only uses integers and indexing, so it runs on Python lists or compiled  #
+#	by Numba over arrays (see kernels.py). The list can have several planes of  #
+#	the same size (cb and cr), so the first row of each one has no upper hop.   #
+#	Input: hops (0 to 8), number of hops, width of a row of hops, size of each  #
+#	plane, probabilities (CONTEXTS * TREE_SIZE values, PROB_INIT at first),     #
+#	output bytes (big enough)                                                   #
+#	Output: number of bytes written                                             #
+#*******************************************************************************#
+
+def rangeEncodeKernel(hops, n, width, plane_size, probs, out):
+	row = width if width > 0 else 1 # Rows of 0 hops (1 pixel wide subsampled chrominance): every hop starts a row
+	low = 0 # It can take 33 bits, the last one is the carry
+	rng = 0xFFFFFFFF
+	cache = 0 # Last byte we can not write yet, since a carry could change it
+	cache_size = 1 # That byte and the number of 0xFF bytes after it
+	pos = 0
+
+	for k in range(0, n):
+		p = k % plane_size
+		up = hops[k - row] if p >= row else NO_HOP
+		prev = hops[k - 1] if p % row != 0 else NO_HOP
+		base = (up * 10 + prev) * TREE_SIZE
+
+		hop = hops[k]
+		m = 1 # Node of the tree
+		for i in range(3, -1, -1):
+			bit = (hop >> i) & 1
+			prob = probs[base + m]
+			bound = (rng >> PROB_BITS) * prob
+
+			if (bit == 0):
+				rng = bound
+				probs[base + m] = prob + (((1 << PROB_BITS) - prob) >> MOVE_BITS)
+			else:
+				low += bound
+				rng -= bound
+				probs[base + m] = prob - (prob >> MOVE_BITS)
+			m = (m << 1) | bit
+
+			# Normalization: we shift out the highest byte of low
+			while (rng < TOP):
+				rng = rng << 8
+				if (low < 0xFF000000 or low > 0xFFFFFFFF):
+					carry = low >> 32
+					temp = cache
+					while (cache_size > 0):
+						out[pos] = (temp + carry) & 0xFF
+						pos += 1
+						temp = 0xFF
+						cache_size -= 1
+					cache = (low >> 24) & 0xFF
+				cache_size += 1
+				low = (low & 0x00FFFFFF) << 8
+
+	# Flush: the 4 bytes of low and the pending ones
+	for i in range(0, 5):
+		if (low < 0xFF000000 or low > 0xFFFFFFFF):
+			carry = low >> 32
+			temp = cache
+			while (cache_size > 0):
+				out[pos] = (temp + carry) & 0xFF
+				pos += 1
+				temp = 0xFF
+				cache_size -= 1
+			cache = (low >> 24) & 0xFF
+		cache_size += 1
+		low = (low & 0x00FFFFFF) << 8
+
+	return pos
+
+
+#*******************************************************************************#
+#	Function rangeDecodeKernel: This is the inverse of rangeEncodeKernel, with  #
+#	the same contexts. Bytes after the end of the data are read as 0.           #
+#	Input: codified bytes, number of hops, width of a row of hops, size of each #
+#	plane, probabilities (PROB_INIT at first), output hops                      #
+#	Output: number of bytes read                                                #
+#*******************************************************************************#
+
+def rangeDecodeKernel(data, n, width, plane_size, probs, hops):
+	row = width if width > 0 else 1 # As in rangeEncodeKernel
+	size = len(data)
+	rng = 0xFFFFFFFF
+	code = 0
+	pos = 0
+
+	# The first byte is always 0 (the initial cache of the encoder)
+	for i in range(0, 5):
+		code = (code << 8) | (data[pos] if pos < size else 0)
+		pos += 1
+
+	for k in range(0, n):
+		p = k % plane_size
+		up = hops[k - row] if p >= row else NO_HOP
+		prev = hops[k - 1] if p % row != 0 else NO_HOP
+		base = (up * 10 + prev) * TREE_SIZE
+
+		m = 1
+		for i in range(0, 4):
+			prob = probs[base + m]
+			bound = (rng >> PROB_BITS) * prob
+
+			if (code < bound):
+				rng = bound
+				probs[base + m] = prob + (((1 << PROB_BITS) - prob) >> MOVE_BITS)
+				m = m << 1
+			else:
+				code -= bound
+				rng -= bound
+				probs[base + m] = prob - (prob >> MOVE_BITS)
+				m = (m << 1) | 1
+
+			while (rng < TOP):
+				rng = rng << 8
+				code = (code << 8) | (data[pos] if pos < size else 0)
+				pos += 1
+
+		# Damaged data could give hops over 8, and they are used as contexts
+		hops[k] = min(m - TREE_SIZE, 8)
+
+	return pos
@@ -0,0 +1,217 @@
+"""
+
+This module encodes many images with a pool of warm workers: every worker
+imports the codec, loads the hops cache and compiles the kernels only once,
+and then encodes the images it gets one after the other.
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import collections
+import multiprocessing
+import os
+import time
+from cStringIO import StringIO
+from PIL import Image
+import kernels
+import Auxiliary.instrument as instrument
+import codec
+from hops_cache import getHopsCache
+from LHEquantizer import ImagePlanes
+from binary_enc import ENTROPY_HUFFMAN, ENTROPY_RANGE
+
+# -------------#
+# LHE BATCH    #
+# -------------#
+
+IMAGE_EXTENSIONS = (".bmp", ".png", ".jpg", ".jpeg", ".gif", ".tif", ".tiff", ".ppm")
+
+# Result of every image: paths, size of the .lhe file (bytes), pixels, seconds and error (None if it worked)
+EncodeResult = collections.namedtuple("EncodeResult", "input output size pixels seconds error")
+
+
+#*******************************************************************************#
+#	Function warmUp: This gets a process ready to encode: it loads the hops     #
+#	cache (from a .npy file, if given) and runs every kernel on a small image,  #
+#	so Numba compiles (or loads) them now and not with the first image.         #
+#	Input: kernels backend and .npy file of the hops cache (optional)           #
+#	Output: None                                                                #
+#*******************************************************************************#
+
+def warmUp(backend=None, cache_file=None):
+	"""Loads the hops cache and compiles the kernels of this process.
+
+	Parameters: kernels backend (string, "python" or "numba"; the current
+	one by default), .npy file of the hops cache (string, optional).
+
+	Exceptions: This will throw an exception if the backend is not available
+	or the .npy file is not a hops cache.
+
+	"""
+	if backend is not None:
+		kernels.setBackend(backend)
+	getHopsCache(kernels.RMAX, filename=cache_file)
+
+	image = ImagePlanes(Image.new('RGB', (8, 8), (128, 64, 192)))
+	for mode in (0, 1, 2):
+		for entropy in (ENTROPY_HUFFMAN, ENTROPY_RANGE):
+			codec.encode_image(image, StringIO(), mode, jobs=1, entropy=entropy)
+
+
+#*******************************************************************************#
+#	Function encodeTask: This encodes an image in a worker. The .lhe file is    #
+#	written in a temporary file first, so an interrupted job never leaves half  #
+#	of it. Errors are returned, not thrown, so one bad image does not stop the  #
+#	others.                                                                     #
+#	Input: (image, .lhe file, chrominance mode, number of blocks, entropy coder)#
+#	Output: EncodeResult                                                        #
+#*******************************************************************************#
+
+def encodeTask(args):
+	"""Encodes an image in a .lhe file and returns an EncodeResult.
+
+	Parameters: tuple of image and .lhe file (paths), chrominance mode,
+	number of blocks in a row and in a column and entropy coder (integers).
+
+	Exceptions: This function does not throw an exception; errors are in
+	the result.
+
+	"""
+	image, lhe_file, mode, blocks_x, blocks_y, entropy = args
+	start = time.time()
+	try:
+		planes = ImagePlanes(image)
+		data = StringIO()
+		codec.encode_image(planes, data, mode, blocks_x, blocks_y, jobs=1, entropy=entropy)
+
+		tmp_file = lhe_file + ".tmp"
+		with open(tmp_file, "wb") as f:
+			f.write(data.getvalue())
+		os.rename(tmp_file, lhe_file)
+
+		return EncodeResult(image, lhe_file, len(data.getvalue()), planes.npix, time.time() - start, None)
+	except Exception as e:
+		return EncodeResult(image, lhe_file, 0, 0, time.time() - start, "%s: %s" % (type(e).__name__, e))
+
+
+#*******************************************************************************#
+#	Class BatchEncoder: This keeps a pool of warm workers and encodes the       #
+#	images of a manifest with them. The manifest is read only as fast as the    #
+#	workers encode, so it can be as long as we want.                            #
+#	Input: number of processes, chrominance mode, number of blocks, entropy     #
+#	coder, images waiting for a worker, kernels backend and hops cache file     #
+#*******************************************************************************#
+
+class BatchEncoder(object):
+	"""Encodes images in a pool of warm worker processes.
+
+	Parameters: number of processes (integer, all the CPUs by default),
+	chrominance mode (integer, 0 for 4:2:0, 1 for 4:2:2 or 2 for 4:4:4),
+	number of blocks in a row and in a column (integers, 1 by default),
+	entropy coder (ENTROPY_HUFFMAN by default or ENTROPY_RANGE), most images
+	sent to the workers and not finished yet (integer, 2 per process by
+	default), kernels backend (string, the current one by default) and .npy
+	file of the hops cache (string, optional).
+
+	Exceptions: This will throw an exception if the backend is not available
+	or the hops cache file is not valid.
+
+	"""
+	def __init__(self, jobs=None, mode=0, blocks_x=1, blocks_y=1, entropy=ENTROPY_HUFFMAN, queue_size=None,
+				 backend=None, cache_file=None):
+		self.jobs = jobs or multiprocessing.cpu_count()
+		self.mode = mode
+		self.blocks_x = blocks_x
+		self.blocks_y = blocks_y
+		self.entropy = entropy
+		self.queue_size = queue_size or 2 * self.jobs
+
+		# Workers are forked from a warm process, and warm themselves anyway (with spawn they start cold)
+		warmUp(backend, cache_file)
+		self._pool = multiprocessing.Pool(self.jobs, warmUp, (kernels.getBackend(), cache_file))
+
+	def encode(self, manifest):
+		"""Yields an EncodeResult for every image of the manifest, in the same order.
+
+		Parameters: manifest (iterable of images, or of image and .lhe file
+		pairs; the .lhe file is the image path with .lhe extension by default).
+
+		"""
+		pending = collections.deque()
+		for item in manifest:
+			image, lhe_file = item if isinstance(item, tuple) else (item, lheFileName(item))
+			pending.append(self._pool.apply_async(instrument.pooled(encodeTask), ((image, lhe_file, self.mode, self.blocks_x, self.blocks_y, self.entropy),)))
+
+			# Bounded queue: we wait for the oldest image before reading more
+			if (len(pending) >= self.queue_size):
+				yield instrument.collect(pending.popleft().get())
+
+		while pending:
+			yield instrument.collect(pending.popleft().get())
+
+	def close(self):
+		"""Waits for the workers and stops them."""
+		self._pool.close()
+		self._pool.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self._pool.terminate()
+			self._pool.join()
+
+
+#*******************************************************************#
+#	Function lheFileName: This gets the .lhe file of an image.      #
+#	Input: image path, output folder (optional)                     #
+#	Output: .lhe file path                                          #
+#*******************************************************************#
+
+def lheFileName(image, output_dir=None):
+	"""Returns the .lhe file of an image: its name with .lhe extension, in output_dir or next to it."""
+	name = os.path.splitext(image)[0] + ".lhe"
+	if output_dir is not None:
+		name = os.path.join(output_dir, os.path.basename(name))
+	return name
+
+
+#*******************************************************************************#
+#	Function readManifest: This gets the images to encode from some paths:      #
+#	images, folders (their images, sorted) or manifest files (.txt, with an     #
+#	image and optionally its .lhe file in every line).                          #
+#	Input: paths and output folder (optional)                                   #
+#	Output: generator of (image, .lhe file)                                     #
+#*******************************************************************************#
+
+def readManifest(paths, output_dir=None):
+	"""Yields the image and .lhe file pairs of some images, folders or manifest files.
+
+	Parameters: paths (iterable of strings), output folder for .lhe files
+	(string, next to every image by default).
+
+	Exceptions: This will throw an exception if a folder or a manifest file
+	can not be read.
+
+	"""
+	for path in paths:
+		if os.path.isdir(path):
+			for name in sorted(os.listdir(path)):
+				if name.lower().endswith(IMAGE_EXTENSIONS):
+					image = os.path.join(path, name)
+					yield image, lheFileName(image, output_dir)
+
+		elif path.lower().endswith(".txt"):
+			with open(path) as f:
+				for line in f:
+					fields = line.split()
+					if not fields or fields[0].startswith("#"):
+						continue
+					yield fields[0], fields[1] if len(fields) > 1 else lheFileName(fields[0], output_dir)
+
+		else:
+			yield path, lheFileName(path, output_dir)
@@ -0,0 +1,93 @@
+"""
+
+Benchmark of the entropy coders: bits per pixel and throughput of Huffman
+(symbols) and of the adaptive range coder (hops), for the same hops.
+
+Usage: python benchmarks/entropy.py [image ...] (input_img/*.bmp by default)
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import glob, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import kernels
+import Auxiliary.color as color
+from LHEquantizer import loadImage, getPlaneHops
+from binary_enc import getSymbols, symbolsString, getHuffman, getRange
+from binary_dec import decodeHuffman, decodeRange, expandSymbols
+from image_dec import symbolsToHops
+
+MODES = ("4:2:0", "4:2:2", "4:4:4")
+
+
+#*******************************************************************************#
+#	Function timeIt: This runs a function several times and keeps the fastest   #
+#	time, so the first run (Numba compilation, caches) does not count.          #
+#	Input: function, number of runs                                             #
+#	Output: result of the function, best time in seconds                        #
+#*******************************************************************************#
+
+def timeIt(function, runs=3):
+	best = None
+	for i in range(0, runs):
+		start = time.time()
+		result = function()
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return result, best
+
+
+def huffmanEncode(planes, width, height, npix):
+	y_sym, cb_sym, cr_sym = [getSymbols(hops, width, height, npix)[0] for hops in planes]
+	lum = getHuffman(y_sym)
+	chrom = getHuffman(symbolsString(cb_sym) + '0' + symbolsString(cr_sym))
+	return lum, chrom
+
+
+def huffmanDecode(lum, chrom, width, npix, mode):
+	y_sym, cb_sym, cr_sym = expandSymbols(decodeHuffman(lum), decodeHuffman(chrom), npix, mode)
+	return [symbolsToHops(sym, width, component, mode) for sym, component in ((y_sym, "y"), (cb_sym, "cb"), (cr_sym, "cr"))]
+
+
+def rangeEncode(planes, width, height, mode):
+	return getRange(planes[:1], width, height, mode, False), getRange(planes[1:], width, height, mode, True)
+
+
+def rangeDecode(lum, chrom, width, height, mode):
+	return decodeRange(lum, width, height, mode, False) + decodeRange(chrom, width, height, mode, True)
+
+
+def benchmark(filename):
+	img = loadImage(filename)
+	width, height, npix = img.width, img.height, img.npix
+	y, cb, cr = color.RGBtoYUV(*img.planes())
+
+	for mode in (0, 1, 2):
+		planes = [getPlaneHops(plane, width, height, component, mode)[0] for plane, component in ((y, "y"), (cb, "cb"), (cr, "cr"))]
+
+		(lum, chrom), huff_enc = timeIt(lambda: huffmanEncode(planes, width, height, npix))
+		hops, huff_dec = timeIt(lambda: huffmanDecode(lum, chrom, width, npix, mode))
+		huff_bpp = 8.0 * (len(lum) + len(chrom)) / npix
+
+		(lum, chrom), range_enc = timeIt(lambda: rangeEncode(planes, width, height, mode))
+		hops, range_dec = timeIt(lambda: rangeDecode(lum, chrom, width, height, mode))
+		range_bpp = 8.0 * (len(lum) + len(chrom)) / npix
+
+		mpix = npix / 1e6
+		print "%-20s %s  huffman %6.3f bpp %7.2f / %7.2f Mpix/s   range %6.3f bpp %7.2f / %7.2f Mpix/s   (%+.1f%%)" % (
+			os.path.basename(filename), MODES[mode],
+			huff_bpp, mpix / huff_enc, mpix / huff_dec,
+			range_bpp, mpix / range_enc, mpix / range_dec,
+			100.0 * (range_bpp - huff_bpp) / huff_bpp)
+
+
+if __name__ == '__main__':
+	images = sys.argv[1:] or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "input_img", "*.bmp")))
+
+	print "Backend: %s (encode / decode throughput, best of 3)" % kernels.getBackend()
+	for filename in images:
+		benchmark(filename)
@@ -0,0 +1,224 @@
+"""
+
+Benchmark of every stage of the codec: ingest, RGBtoYUV, getHops, getSymbols,
+Huffman encode and decode, symbolsToHops, hopsToYUV, upsampling and YUVtoRGB,
+for synthetic and real images at several resolutions and chrominance modes.
+
+It records the throughput of every stage (Mpix/s of the image), the peak
+memory of the process, bits per pixel and PSNR as JSON, and can compare them
+with a saved baseline: throughputs slower than the threshold, or more bits
+per pixel, are regressions and the exit status is 1.
+
+Usage: python benchmarks/stages.py [image ...] [--sizes 256,512,1024]
+       [--modes 0,1,2] [--runs 3] [--output results.json]
+       [--baseline baseline.json] [--threshold 0.10]
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import argparse, glob, json, multiprocessing, os, resource, sys
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+from PIL import Image
+import kernels
+import Auxiliary.color as color
+import Auxiliary.quality as quality
+from LHEquantizer import ImagePlanes, getPlaneHops
+from binary_enc import getSymbols, getHuffman
+from binary_dec import decodeHuffman, expandChain
+from image_dec import symbolsToHops, upsampleChroma
+from batch import warmUp
+from entropy import timeIt, MODES
+
+STAGES = ("ingest", "RGBtoYUV", "getHops", "getSymbols", "huffmanEncode", "huffmanDecode",
+		  "symbolsToHops", "hopsToYUV", "upsampling", "YUVtoRGB")
+COMPONENTS = ("y", "cb", "cr")
+
+
+#*******************************************************************************#
+#	Function syntheticImage: This makes an image with smooth gradients, edges   #
+#	and some noise, so every hop is used, at any size.                          #
+#	Input: width and height                                                     #
+#	Output: PIL image                                                           #
+#*******************************************************************************#
+
+def syntheticImage(width, height):
+	yy, xx = np.mgrid[0:height, 0:width].astype(np.float64)
+	noise = np.random.RandomState(0).randint(-12, 13, (height, width))
+	r = 128 + 100 * np.sin(xx / 23.0) + noise
+	g = 128 + 100 * np.cos(yy / 17.0) + (((xx // 64) + (yy // 64)) % 2) * 40 - 20
+	b = 128 + 100 * np.sin((xx + yy) / 41.0) - noise
+	return Image.fromarray(np.clip(np.dstack((r, g, b)), 0, 255).astype(np.uint8))
+
+
+def peakRSS():
+	# Peak resident memory of this process in MB (ru_maxrss is in KB on Linux, bytes on Mac)
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss / 1024.0 / (1024.0 if sys.platform == "darwin" else 1.0)
+
+
+#*******************************************************************************#
+#	Function benchmark: This runs every stage for an image and a chrominance    #
+#	mode, each one with the output of the previous one, as the codec does.      #
+#	Input: (name of the image, BMP file in memory, chrominance mode, runs)      #
+#	Output: results (dictionary)                                                #
+#*******************************************************************************#
+
+def benchmark(args):
+	name, bmp, mode, runs = args
+	stages = {}
+	mpix = None
+
+	def stage(name, function):
+		result, seconds = timeIt(function, runs)
+		stages[name] = {"seconds": seconds, "mpix_s": mpix / seconds if seconds > 0 else None, "rss_mb": peakRSS()}
+		return result
+
+	image = ImagePlanes(StringIO(bmp))
+	width, height, npix = image.width, image.height, image.npix
+	mpix = npix / 1e6
+
+	stage("ingest", lambda: ImagePlanes(StringIO(bmp)))
+	yuv = stage("RGBtoYUV", lambda: color.RGBtoYUV(*image.planes()))
+	hops = stage("getHops", lambda: [getPlaneHops(plane, width, height, component, mode)[0]
+									 for plane, component in zip(yuv, COMPONENTS)])
+	symbols = stage("getSymbols", lambda: [getSymbols(plane, width, height, npix)[0] for plane in hops])
+	codified = stage("huffmanEncode", lambda: [getHuffman(sym) for sym in symbols])
+
+	def huffmanDecode():
+		decoded = []
+		for i, data in enumerate(codified):
+			sym = np.zeros(kernels.planeSize(width, height, mode, i > 0)[0], dtype=np.uint8)
+			expandChain(decodeHuffman(data), sym)
+			decoded.append(sym)
+		return decoded
+
+	decoded = stage("huffmanDecode", huffmanDecode)
+	dec_hops = stage("symbolsToHops", lambda: [symbolsToHops(sym, width, component, mode)
+											   for sym, component in zip(decoded, COMPONENTS)])
+	values = stage("hopsToYUV", lambda: [kernels.reconstruct(plane, int(first[0, 0]), width, height, mode, component != "y")
+										 for plane, first, component in zip(dec_hops, yuv, COMPONENTS)])
+
+	planes = [values[0].reshape(height, width)]
+	if (mode != 2):
+		planes += stage("upsampling", lambda: [upsampleChroma(plane, width, height, mode) for plane in values[1:]])
+	else:
+		planes += [plane.reshape(height, width) for plane in values[1:]]
+
+	rgb = np.empty((height, width, 3), dtype=np.uint8)
+	stage("YUVtoRGB", lambda: color.YUVtoRGB(planes[0], planes[1], planes[2], out=(rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2])))
+
+	original = np.dstack(image.planes())
+	return {"image": name, "width": width, "height": height, "mode": MODES[mode],
+			"bpp": 8.0 * sum([len(data) for data in codified]) / npix,
+			"psnr": quality.psnr(quality.mse(original, rgb)), "peak_rss_mb": peakRSS(), "stages": stages}
+
+
+#*******************************************************************************#
+#	Function getImages: This gets the images of the benchmark: a synthetic one  #
+#	and the real ones, resized to every size (width of a square image).         #
+#	Input: real images (paths) and sizes                                        #
+#	Output: list of (name, BMP file in memory)                                  #
+#*******************************************************************************#
+
+def getImages(filenames, sizes):
+	images = []
+	for size in sizes:
+		sources = [("synthetic", syntheticImage(size, size))]
+		sources += [(os.path.basename(filename), Image.open(filename).convert('RGB').resize((size, size), Image.BICUBIC))
+					for filename in filenames]
+		for name, image in sources:
+			bmp = StringIO()
+			image.save(bmp, "BMP")
+			images.append(("%s@%d" % (name, size), bmp.getvalue()))
+	return images
+
+
+def caseKey(case):
+	return case["image"], case["mode"]
+
+
+#*******************************************************************************#
+#	Function compare: This compares results with a baseline. A stage is a       #
+#	regression if its throughput is lower than the baseline one by more than    #
+#	the threshold, and so is an image with more bits per pixel or less PSNR.    #
+#	Input: results, baseline results and threshold (0.10 is 10%)                #
+#	Output: list of regressions (strings)                                       #
+#*******************************************************************************#
+
+def compare(results, baseline, threshold):
+	old = dict([(caseKey(case), case) for case in baseline["cases"]])
+	regressions = []
+
+	for case in results["cases"]:
+		if caseKey(case) not in old:
+			continue
+		base = old[caseKey(case)]
+		label = "%s %s" % caseKey(case)
+
+		for name, stage in sorted(case["stages"].items()):
+			base_stage = base["stages"].get(name)
+			if not base_stage or not base_stage["mpix_s"] or not stage["mpix_s"]:
+				continue
+			change = stage["mpix_s"] / base_stage["mpix_s"] - 1
+			if change < -threshold:
+				regressions.append("%s %s: %.2f Mpix/s, baseline %.2f (%+.1f%%)" % (label, name, stage["mpix_s"], base_stage["mpix_s"], 100 * change))
+
+		if case["bpp"] > base["bpp"] * 1.001:
+			regressions.append("%s: %.4f bpp, baseline %.4f" % (label, case["bpp"], base["bpp"]))
+		if case["psnr"] < base["psnr"] - 0.01:
+			regressions.append("%s: PSNR %.2f dB, baseline %.2f" % (label, case["psnr"], base["psnr"]))
+
+	return regressions
+
+
+def printCase(case):
+	print "%-24s %s  %6.3f bpp %6.2f dB %7.1f MB  " % (case["image"], case["mode"], case["bpp"], case["psnr"], case["peak_rss_mb"]) + \
+		" ".join(["%s %.1f" % (name, case["stages"][name]["mpix_s"]) for name in STAGES if name in case["stages"]])
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmark of every stage of the LHE codec")
+	parser.add_argument("images", nargs="*", help="real images (input_img/*.bmp by default)")
+	parser.add_argument("--sizes", default="256,512,1024", help="widths (and heights) of the images")
+	parser.add_argument("--modes", default="0,1,2", help="chrominance modes")
+	parser.add_argument("--runs", type=int, default=3, help="runs of every stage, the fastest counts")
+	parser.add_argument("--output", default=None, help="JSON file for the results")
+	parser.add_argument("--baseline", default=None, help="JSON file of a previous run to compare with")
+	parser.add_argument("--threshold", type=float, default=0.10, help="slowdown counted as a regression (0.10 by default)")
+	args = parser.parse_args()
+
+	filenames = args.images or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "input_img", "*.bmp")))
+	sizes = [int(size) for size in args.sizes.split(",")]
+	modes = [int(mode) for mode in args.modes.split(",")]
+
+	print "Backend: %s (Mpix/s of every stage, best of %d)" % (kernels.getBackend(), args.runs)
+
+	# Every case runs in a new (warm) process, so its peak memory is only its own
+	results = {"backend": kernels.getBackend(), "runs": args.runs, "cases": []}
+	pool = multiprocessing.Pool(1, warmUp, maxtasksperchild=1)
+	try:
+		for name, bmp in getImages(filenames, sizes):
+			for mode in modes:
+				case = pool.apply(benchmark, ((name, bmp, mode, args.runs),))
+				results["cases"].append(case)
+				printCase(case)
+	finally:
+		pool.close()
+		pool.join()
+
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			regressions = compare(results, json.load(f), args.threshold)
+		for regression in regressions:
+			print "REGRESSION " + regression
+		print "%d regressions against %s" % (len(regressions), args.baseline)
+		sys.exit(1 if regressions else 0)
@@ -7,7 +7,11 @@ This module gets the symbols lists from the .lhe file of the coded image.
 # Author: Eduardo Rodes Pastor
 
 import Auxiliary.huff as huff
-import math, struct, os
+import Auxiliary.instrument as instrument
+import kernels
+import math, struct, os, zlib, mmap, copy_reg, types
+import numpy as np
+from binary_enc import LHE_MAGIC, LHE_LEGACY, LHE_ENTROPY, LHE_TOC, LHE_VERSION, HEADER, BLOCK_ENTRY, TOC_ENTRY, HUFFMAN_SYMBOLS, ENTROPY_HUFFMAN, ENTROPY_RANGE
 
 from array import *
 
@@ -15,6 +19,10 @@ from array import *
 # BINARY DECODER #
 # ---------------#
 
+# Codified data are buffers of the .lhe file (no copies), and they are sent to
+# other processes as strings
+copy_reg.pickle(types.BufferType, lambda data: (str, (str(data),)))
+
 
 #*****************************************************************************#
 #	Function getData: This reads some data from the .lhe file header. Since   #
@@ -29,7 +37,7 @@ from array import *
 def getData(lhe_file):
 	"""Returns some values from the .lhe file header that will be useful for the decoding.
 
-	Parameters: .lhe file (string)
+	Parameters: .lhe file (string or file-like object)
 
 	Output: In order: chrominance mode (integer, 0 for 4:2:0, 1 for 4:2:2 
 	or 2 for 4:4:4), image width and height (integers), y, cb and cr values
@@ -41,52 +49,387 @@ def getData(lhe_file):
 	output_lhe folder.
 
 	"""
+	with LHEReader(lhe_file) as reader:
+		return reader.header
+
+
+#*****************************************************************************#
+#	Function readFile: This reads a whole .lhe file.                          #
+#	Input: .lhe file (name or file-like object)                               #
+#	Output: Data of the file (string)                                         #
+#*****************************************************************************#
+
+def readFile(lhe_file):
+	"""Returns the whole content of a .lhe file.
+
+	Parameters: .lhe file (string with its path or file-like object)
+
+	Exceptions: This will throw an exception if the .lhe file does not exist.
+
+	"""
+	if hasattr(lhe_file, "read"):
+		return lhe_file.read()
+
 	fp = open(lhe_file, "rb")
 	data = fp.read()
+	fp.close()
+
+	return data
+
+
+#*****************************************************************************#
+#	Class LHEReader: This opens a .lhe file only once. Files on disk are      #
+#	memory mapped, so only the bytes we use are read, and the codified data   #
+#	of every plane is a buffer of the file instead of a copy. The header is   #
+#	parsed once, when the reader is created.                                  #
+#	Input: .lhe file (name or file-like object)                               #
+#*****************************************************************************#
 
-	i = 0 # Value to seek
-	k = 0 # Position of the list where we will write a specific data
+class LHEReader(object):
+	"""Reads a .lhe file, memory mapping it when it is on disk.
 
-	# We need 10 slots: lhe type, mode, width, height, 2 for number of blocks, 3 for first values of pixels and 1 for the codified luminance length
-	header = [0] * 10  
-	while (i <= 18): # The file header has a size of 19 bytes
+	Attributes: data (mmap or string with the whole file), version, entropy,
+	mode, width, height, blocks_x and blocks_y (integers), first (y, cb and cr
+	values of the first pixel), header (same values as getData).
 
-		# We get a position in the file header
-		fp.seek(i)
+	Exceptions: This will throw an exception if the .lhe file does not exist
+	or its header is not valid.
 
-		# If this position is not 2, 6 or 15 (not width, height or codified luminance length, that data size is 1 byte
-		if (i != 2 and i != 6 and i != 15):
-			data = fp.read(1) # We read 1 byte
-			unpacked_data = struct.unpack("B", data)[0] # 'B' is for 1 byte
-			header[k] = unpacked_data # We save it in the final list
-			k = k + 1 # Next position in the list to save the following value
-			i = i + 1 # Seek 1 byte forward
+	"""
+	def __init__(self, lhe_file):
+		self._map = None
 
-		# Otherwise, we need 4 bytes for the value. This is the same as before:
+		if hasattr(lhe_file, "read"):
+			fp = lhe_file
 		else:
-			data = fp.read(4)
-			unpacked_data = struct.unpack("I", data)[0] # 'I' is for 4 bytes
-			header[k] = unpacked_data
-			k = k + 1
-			i = i + 4
+			fp = open(lhe_file, "rb")
+
+		try:
+			# Empty files, pipes or objects without a real file can not be mapped
+			if (fp.tell() != 0):
+				raise ValueError("The file is not at its beginning")
+			self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+			self.data = self._map
+		except (AttributeError, ValueError, EnvironmentError, mmap.error):
+			self.data = fp.read()
+		finally:
+			if fp is not lhe_file:
+				fp.close() # The map does not need it
+
+		if instrument.enabled:
+			instrument.count("bytes_read", len(self.data))
+
+		self.version, self.start = parseVersion(self.data)
+		self.entropy = parseEntropy(self.data)
+
+		# The whole header at once
+		lhe_type, self.mode, self.width, self.height, self.blocks_x, self.blocks_y, first_y, first_cb, first_cr, lum_len = HEADER.unpack_from(self.data, self.start)
+		self.first = (first_y, first_cb, first_cr)
+		self.header = (self.mode, self.width, self.height, first_y, first_cb, first_cr, lum_len)
+
+	def view(self, position, length):
+		"""Returns a buffer of some bytes of the file, without copying them."""
+		return buffer(self.data, position, length)
+
+	def toc(self):
+		"""Returns the table of contents, as parseTOC."""
+		return parseTOC(self.data)
+
+	def plane(self, entry):
+		"""Returns the codified data (buffer) of a plane given its table of contents entry, as parsePlane."""
+		return parsePlane(self.data, entry)
+
+	def blocks(self):
+		"""Returns the number of blocks and the codified data (buffers) of every block, as parseBlocks."""
+		return parseBlocks(self.data)
+
+	def close(self):
+		"""Closes the map of the file. Buffers of it can not be used after this."""
+		if self._map is not None:
+			self._map.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+#*****************************************************************************#
+#	Function getVersion: This reads the version of a .lhe file. Files which   #
+#	do not start with LHE_MAGIC are legacy ones. Since version 3, the entropy #
+#	coder byte goes before the header.                                        #
+#	Input: .lhe file                                                          #
+#	Output: Version of the file, position of the header                       #
+#*****************************************************************************#
+
+def getVersion(lhe_file):
+	"""Returns the version of a .lhe file and the position where its header starts.
+
+	Parameters: .lhe file (string or file-like object)
+
+	Exceptions: This will throw an exception if the .lhe file does not exist
+	or its version is newer than this decoder.
+
+	"""
+	with LHEReader(lhe_file) as reader:
+		return reader.version, reader.start
+
+
+def parseVersion(data):
+	"""Same as getVersion, for the bytes of a .lhe file (string or buffer)."""
+	if (data[:len(LHE_MAGIC)] != LHE_MAGIC):
+		return LHE_LEGACY, 0
+
+	version = struct.unpack("B", data[len(LHE_MAGIC):len(LHE_MAGIC) + 1])[0]
+	if (version > LHE_VERSION):
+		raise ValueError("Version %d of .lhe files is not supported" % version)
+	if (version >= LHE_ENTROPY):
+		return version, len(LHE_MAGIC) + 2
+
+	return version, len(LHE_MAGIC) + 1
+
+
+#*****************************************************************************#
+#	Function getEntropy: This reads the entropy coder of a .lhe file.         #
+#	Input: .lhe file                                                          #
+#	Output: Entropy coder (ENTROPY_HUFFMAN or ENTROPY_RANGE)                  #
+#*****************************************************************************#
+
+def getEntropy(lhe_file):
+	"""Returns the entropy coder of a .lhe file (ENTROPY_HUFFMAN or ENTROPY_RANGE).
+
+	Parameters: .lhe file (string or file-like object)
+
+	Exceptions: This will throw an exception if the .lhe file does not exist
+	or its entropy coder is unknown.
+
+	"""
+	with LHEReader(lhe_file) as reader:
+		return reader.entropy
+
+
+def parseEntropy(data):
+	"""Same as getEntropy, for the bytes of a .lhe file (string or buffer)."""
+	version, start = parseVersion(data)
+	if (version < LHE_ENTROPY):
+		return ENTROPY_HUFFMAN
+
+	entropy = struct.unpack("B", data[start - 1:start])[0]
+	if (entropy != ENTROPY_HUFFMAN and entropy != ENTROPY_RANGE):
+		raise ValueError("Entropy coder %d of .lhe files is not supported" % entropy)
+
+	return entropy
+
+
+#*****************************************************************************#
+#	Function parseData: This is getData for the bytes of a .lhe file. Since   #
+#	we know the size each number has, HEADER unpacks all of them at once.     #
+#	Input: Data of the .lhe file (string or buffer)                           #
+#	Output: Same as getData                                                   #
+#*****************************************************************************#
+
+def parseData(data):
+	"""Returns some values from the header of the bytes of a .lhe file.
+
+	Parameters: data of the .lhe file (string or buffer)
+
+	Output: Same values as getData.
+
+	Exceptions: This will throw an exception if the data is shorter than
+	the header.
+
+	"""
+	version, start = parseVersion(data)
+
+	# We need 10 values: lhe type, mode, width, height, 2 for number of blocks, 3 for first values of pixels and 1 for the codified luminance length
+	header = HEADER.unpack_from(data, start) # The file header has a size of 19 bytes
 
 	# We return the values we need in this decoder
 	return header[1], header[2], header[3], header[6], header[7], header[8], header[9]
 
 
+#*****************************************************************************#
+#	Function getTOC: This reads the table of contents of a .lhe file (since   #
+#	version 4): where the codified data of every plane of every block is, so  #
+#	we can read only the planes or blocks we need.                            #
+#	Input: .lhe file                                                          #
+#	Output: Number of blocks in a row and in a column, and a list of blocks   #
+#	(row by row), each one with the (first value, position, length, crc32)    #
+#	of its y, cb and cr planes                                                #
+#*****************************************************************************#
+
+def getTOC(lhe_file):
+	"""Returns the number of blocks and the table of contents of a .lhe file.
+
+	Parameters: .lhe file (string or file-like object)
+
+	Output: number of blocks in a row and in a column (integers) and list of
+	blocks, each one a list of y, cb and cr entries: tuples of the first value
+	of the plane, position and length of its codified data in the file and
+	its crc32 (integers).
+
+	Exceptions: This will throw an exception if the .lhe file does not exist
+	or it has no table of contents (version 3 or older).
+
+	"""
+	with LHEReader(lhe_file) as reader:
+		return reader.toc()
+
+
+def parseTOC(data):
+	"""Same as getTOC, for the bytes of a .lhe file (string or buffer)."""
+	version, start = parseVersion(data)
+	if (version < LHE_TOC):
+		raise ValueError("Version %d of .lhe files has no table of contents" % version)
+
+	blocks_x, blocks_y = struct.unpack_from("BB", data, start + 10)
+
+	toc = []
+	i = start + HEADER.size # Table of contents position
+	for b in range(0, blocks_x * blocks_y):
+		block = []
+		for plane in range(0, 3):
+			block.append(TOC_ENTRY.unpack_from(data, i))
+			i = i + TOC_ENTRY.size
+		toc.append(block)
+
+	return blocks_x, blocks_y, toc
+
+
+#*****************************************************************************#
+#	Function parsePlane: This gets the codified data of a plane given its     #
+#	table of contents entry, checking its crc32.                              #
+#	Input: Data of the .lhe file (string or buffer), entry of the plane       #
+#	Output: Codified data of the plane (buffer of the data, not a copy)       #
+#*****************************************************************************#
+
+def parsePlane(data, entry):
+	"""Returns the codified data of a plane, given its entry in the table of contents.
+
+	Parameters: data of the .lhe file (string or buffer), entry of the plane
+	(tuple of first value, position, length and crc32, as parseTOC gives it).
+
+	Exceptions: This will throw an exception if the data is damaged (its
+	crc32 is not the saved one) or the file is too short.
+
+	"""
+	first, position, length, crc = entry
+	plane = buffer(data, position, length)
+
+	if (len(plane) != length or zlib.crc32(plane) & 0xFFFFFFFF != crc):
+		raise ValueError("Codified data at position %d of the .lhe file is damaged" % position)
+
+	return plane
+
+
+#*****************************************************************************#
+#	Function getBlocks: This reads the block index of a .lhe file, and the    #
+#	codified luminance and chrominance of every block. A .lhe file without    #
+#	blocks is returned as a single block. Since version 4 we use the table of #
+#	contents, and every block has its codified y, cb and cr instead.          #
+#	Input: .lhe file                                                          #
+#	Output: Number of blocks in a row and in a column, and a list of blocks   #
+#	(first pixel values, codified luminance and chrominance), row by row      #
+#*****************************************************************************#
+
+def getBlocks(lhe_file):
+	"""Returns the number of blocks and the codified data of every block of a .lhe file.
+
+	Parameters: .lhe file (string or file-like object)
+
+	Output: number of blocks in a row and in a column (integers) and list of
+	blocks, each one a tuple of y, cb and cr values of its first pixel
+	(integers) and its codified luminance and chrominance (strings), or its
+	codified y, cb and cr since version 4.
+
+	Exceptions: This will throw an exception if the .lhe file does not exist
+	or its codified data is damaged.
+
+	"""
+	return parseBlocks(readFile(lhe_file))
+
+
+def parseBlocks(data):
+	"""Same as getBlocks, for the bytes of a .lhe file (string or buffer). Codified data are buffers of it."""
+	version, start = parseVersion(data)
+
+	if (version >= LHE_TOC):
+		blocks_x, blocks_y, toc = parseTOC(data)
+		blocks = [tuple([entry[0] for entry in block] + [parsePlane(data, entry) for entry in block]) for block in toc]
+		return blocks_x, blocks_y, blocks
+
+	header = HEADER.unpack_from(data, start)
+	blocks_x, blocks_y = header[4:6]
+	nblocks = blocks_x * blocks_y
+
+	# Files without blocks have a single one: header, luminance and chrominance
+	if (nblocks == 1):
+		first_y, first_cb, first_cr, lum_len = header[6:]
+		i = start + HEADER.size
+		return 1, 1, [(first_y, first_cb, first_cr, buffer(data, i, lum_len), buffer(data, i + lum_len))]
+
+	blocks = []
+	i = start + HEADER.size # Block index position
+	k = i + BLOCK_ENTRY.size * nblocks # Blocks position
+
+	for b in range(0, nblocks):
+		first_y, first_cb, first_cr, lum_len, chrom_len = BLOCK_ENTRY.unpack_from(data, i)
+		blocks.append((first_y, first_cb, first_cr, buffer(data, k, lum_len), buffer(data, k + lum_len, chrom_len)))
+		i = i + BLOCK_ENTRY.size
+		k = k + lum_len + chrom_len
+
+	return blocks_x, blocks_y, blocks
+
+
+#*****************************************************************************#
+#	Function decodeHuffman: This decodes a Huffman codified string in memory, #
+#	as saved by binary_enc.getHuffman. Since version 2, we rebuild the        #
+#	canonical codes from their lengths; legacy files have the whole tree.     #
+#	Input: Codified symbols (string), version of the file                     #
+#	Output: Symbols (string)                                                  #
+#*****************************************************************************#
+
+@instrument.timed("huffmanDecode")
+def decodeHuffman(data, version=LHE_VERSION):
+	"""Returns the symbols string of some Huffman codified data.
+
+	Parameters: codified data (string), version of the .lhe file it comes
+	from (LHE_VERSION by default).
+
+	Exceptions: This will throw an exception if the data is not valid.
+
+	"""
+	if (version == LHE_LEGACY):
+		return huff.decode_from_bytes(data)
+
+	# Code lengths, 4 bits each, in HUFFMAN_SYMBOLS order
+	size = (len(HUFFMAN_SYMBOLS) + 1) // 2
+	lengths = {}
+	for i in range(0, len(HUFFMAN_SYMBOLS)):
+		lengths[HUFFMAN_SYMBOLS[i]] = ord(data[i // 2]) >> (4 - 4 * (i % 2)) & 0x0F
+
+	nbits = struct.unpack_from("=I", data, size)[0]
+
+	decoder = huff.Decoder()
+	decoder.load_canonical(lengths, nbits, buffer(data, size + 4)) # Without copying the bits
+	return decoder.decode_from_bytes()
+
+
 #*****************************************************************************#
 #	Function getSymbolsLists: This returns the luminance and chrominance list #
 #	of symbols given a .lhe file. It also detects the 'X' value in every      #
-#	moment, since it also is the dynamic decompressor.                        #
+#	moment, since it also is the dynamic decompressor. Everything is done in  #
+#	memory, so several files can be decoded at the same time.                 #
 #	Input: .lhe file, number of pixels of the image, length of codified       #
 #	luminance and chrominance mode.                                           #
-#	Output: Three symbols lists: luminance and both chrominances.             #
+#	Output: Three symbols arrays: luminance and both chrominances.            #
 #*****************************************************************************#
 
 def getSymbolsLists(lhe_file, npix, lum_len, mode):
 	"""Returns the codified symbols lists of a given .lhe file.
 
-	Parameters: .lhe file (string), number of pixels if the image (integer),
+	Parameters: .lhe file (string or file-like object), number of pixels if the image (integer),
 	length of codified luminance (integer) and chrominance mode (integer, 
 	0 for 4:2:0, 1 for 4:2:2 or 2 for 4:4:4).
 
@@ -94,142 +437,210 @@ def getSymbolsLists(lhe_file, npix, lum_len, mode):
 	output_lhe folder.
 
 	"""
-	# -- LUMINANCE AND CHROMINANCE FILES -- #
+	with LHEReader(lhe_file) as reader:
+		return parseSymbolsLists(reader.data, npix, lum_len, mode)
 
-	# We discard the header and we get 2 files with the Huffman codified luminance and chrominance
-	with open(lhe_file, "rb", 0) as fp:
-		fp.seek(19)
-		data_lum = fp.read(lum_len)
-		data_chrom = fp.read()
-	fp.close()
 
-	fp = open("output_lhe/out-huffman_lum.lhe", "wb")
-	fp.write(data_lum)
-	fp.close()
-	fp = open("output_lhe/out-huffman_chrom.lhe", "wb")
-	fp.write(data_chrom)
-	fp.close()
+def parseSymbolsLists(data, npix, lum_len, mode):
+	"""Same as getSymbolsLists, for the bytes of a .lhe file (string or buffer)."""
+	version, start = parseVersion(data)
 
-	# We decode with Huffman both files
-	dec = huff.Decoder("output_lhe/out-huffman_lum.lhe")
-	dec.decode_as("output_lhe/out-lum.lhe")
+	# We discard the header and we decode with Huffman the luminance and the chrominance
+	if (parseEntropy(data) != ENTROPY_HUFFMAN):
+		raise ValueError("This .lhe file has no symbols, use getHopsLists")
 
-	dec = huff.Decoder("output_lhe/out-huffman_chrom.lhe")
-	dec.decode_as("output_lhe/out-chrom.lhe")
+	if (version >= LHE_TOC):
+		lum, cb, cr = parseBlocks(data)[2][0][3:]
+		lum_sym = decodeHuffman(lum, version)
+		chrom_sym = decodeHuffman(cb, version) + '0' + decodeHuffman(cr, version) # As older versions join them
+	else:
+		lum_sym = decodeHuffman(buffer(data, start + HEADER.size, lum_len), version)
+		chrom_sym = decodeHuffman(buffer(data, start + HEADER.size + lum_len), version)
 
-	# And we get the symbols of each file
-	f = open("output_lhe/out-lum.lhe", "rb")
-	lum_sym = f.read()
-	f.close()
-	f = open("output_lhe/out-chrom.lhe", "rb")
-	chrom_sym = f.read()
-	f.close()
+	return expandSymbols(lum_sym, chrom_sym, npix, mode)
 
-	# We create the lists we are going to work with
-	yuvlum_sym = [0] * len(lum_sym) # Provisional luminance list
-	yuvchrom_sym = [0] * (len(chrom_sym)) # provisional chrominance list
-	y_sym = [0] * npix # Final luminance list
-	ch_sym = [0] * 2*npix # Final chrominances list
 
-	# -- LUMINANCE DYNAMIC DECOMPRESSOR -- #
+#*****************************************************************************#
+#	Function getHopsLists: This returns the luminance and chrominance hops    #
+#	of a .lhe file codified with the range coder.                             #
+#	Input: .lhe file, width and height of the image, length of codified       #
+#	luminance and chrominance mode.                                           #
+#	Output: Three hops lists: luminance and both chrominances.                #
+#*****************************************************************************#
 
-	# We apply the pertinent changes to the 'X' symbol
-	# Remember it means a variable group of '1' symbols
-	x_length = 8 # Starting x_length
-	in_chain = "false" # If we just got a '1', we are in a chain, so x_length doesnt decrement
+def getHopsLists(lhe_file, width, height, lum_len, mode):
+	"""Returns the hops lists of a given .lhe file codified with the range coder.
 
-	for i in range(0, len(lum_sym)):
+	Parameters: .lhe file (string or file-like object), width and height of the
+	image (integers), length of codified luminance (integer) and chrominance
+	mode (integer, 0 for 4:2:0, 1 for 4:2:2 or 2 for 4:4:4).
 
-		# If we get 'X', we change it for the correct number of '1' symbols in a row 
-		if lum_sym[i] == 'X':
-			in_chain = "true" # 'X' is just a group of '1'
-			chain = ''.join(['1'] * x_length) # We create the '1' chain
-			yuvlum_sym[i] = chain # And save it in the list
-			x_length = x_length + 2 # Finally, we increase x_length for the next 'X'
+	Exceptions: This will throw an exception if the .lhe file does not exist
+	or it is not codified with the range coder.
 
-		# If we get '1', we save it and decrease x_length if it's the first '1' we get
-		elif (lum_sym[i] == '1'):
-			yuvlum_sym[i] = '1'
-			if (in_chain == "false"): # '1' after a symbol which is not 'X' or '1'
-				x_length = int(math.ceil(float(x_length) / 2))
-			in_chain = "true"
+	"""
+	with LHEReader(lhe_file) as reader:
+		return parseHopsLists(reader.data, width, height, lum_len, mode)
 
-		# Otherwise, save the symbol and we stop being in a '1' chain
-		else:
-			yuvlum_sym[i] = lum_sym[i]
-			in_chain = "false" 
 
-	# Resetting variables for chrominance
-	x_length = 8
-	in_chain = "false"
+def parseHopsLists(data, width, height, lum_len, mode):
+	"""Same as getHopsLists, for the bytes of a .lhe file (string or buffer)."""
+	version, start = parseVersion(data)
 
-	# -- CHROMINANCE DYNAMIC DECOMPRESSOR -- #
+	if (parseEntropy(data) != ENTROPY_RANGE):
+		raise ValueError("This .lhe file is not codified with the range coder, use getSymbolsLists")
 
-	# Same bucle as before, but with a separator of chrominances
-	for i in range(0, len(chrom_sym)):
+	if (version >= LHE_TOC):
+		lum, cb, cr = parseBlocks(data)[2][0][3:]
+		y_hops, = decodeRange(lum, width, height, mode, False)
+		cb_hops, = decodeRange(cb, width, height, mode, True, 1)
+		cr_hops, = decodeRange(cr, width, height, mode, True, 1)
+	else:
+		y_hops, = decodeRange(buffer(data, start + HEADER.size, lum_len), width, height, mode, False)
+		cb_hops, cr_hops = decodeRange(buffer(data, start + HEADER.size + lum_len), width, height, mode, True)
 
-		if chrom_sym[i] == 'X':
-			in_chain = "true"
-			chain = ''.join(['1'] * x_length) 
-			yuvchrom_sym[i] = chain
-			x_length = x_length + 2
+	return y_hops, cb_hops, cr_hops
 
-		elif (chrom_sym[i] == '1'):
-			yuvchrom_sym[i] = '1'
-			if (in_chain == "false"):
-				x_length = int(math.ceil(float(x_length) / 2))
-			in_chain = "true"
 
-		# '0' is the separator, so we reset variables
-		elif (chrom_sym[i] == '0'):
-			yuvchrom_sym[i] = '0'
-			x_length = 8
-			in_chain = "false"
-			continue
+#*****************************************************************************#
+#	Function decodeRange: This decodes hops codified with the range coder, as #
+#	saved by binary_enc.getRange.                                             #
+#	Input: Codified hops (string), width and height of the image, chrominance #
+#	mode, whether they are chrominances and number of planes (optional).      #
+#	Output: List of hops lists (1 for luminance, 2 for chrominances)          #
+#*****************************************************************************#
 
-		else:
-			yuvchrom_sym[i] = chrom_sym[i]
-			in_chain = "false"
+@instrument.timed("rangeDecode")
+def decodeRange(data, width, height, mode, chroma, nplanes=None):
+	"""Returns the hops lists of some range codified data.
+
+	Parameters: codified data (string), width and height of the image
+	(integers), chrominance mode (integer), True if the data are cb and cr and
+	number of planes codified (integer, 2 for chrominances and 1 for
+	luminance by default; every plane is codified alone since version 4).
 
-	# We join the lists so we can work with them
-	yuvlum_sym = ''.join(yuvlum_sym)
-	yuvchrom_sym = ''.join(yuvchrom_sym)
+	Exceptions: This function does not throw an exception; damaged data
+	gives wrong hops.
 
-	# Luminance saving
-	for i in range(0, len(yuvlum_sym)):
-		y_sym[i] = int(yuvlum_sym[i])
+	"""
+	n, row_width = kernels.planeSize(width, height, mode, chroma)
+	if nplanes is None:
+		nplanes = 2 if chroma else 1
 
-	k = 0 # Position in the final list of chrominance symbols
+	hops = kernels.rangeDecode(data, nplanes * n, row_width, n)
+	if not isinstance(hops, list):
+		hops = hops.tolist()
+
+	return [hops[i * n:(i + 1) * n] for i in range(0, nplanes)]
 
-	# Chrominance saving
-	for i in range(0, len(yuvchrom_sym)):
-		if (int(yuvchrom_sym[i]) != 0): # We dont save the separator
-			ch_sym[k] = int(yuvchrom_sym[i])
-			k = k + 1 
-		else:
-			continue # If we get the separator, we dont increment k
 
+#*****************************************************************************#
+#	Function expandSymbols: This is the dynamic decompressor. It changes      #
+#	every 'X' symbol for its chain of '1' symbols, writing every symbol       #
+#	directly in a single uint8 array, and splits the decoded chrominance in   #
+#	both chrominances at the '0' separator.                                   #
+#	Input: luminance and chrominance decoded symbols (strings), number of     #
+#	pixels of the image and chrominance mode.                                 #
+#	Output: Three symbols arrays (views of the same array): luminance and     #
+#	both chrominances.                                                        #
+#*****************************************************************************#
+
+def expandSymbols(lum_sym, chrom_sym, npix, mode):
+	"""Returns the luminance and chrominances symbols arrays given the decoded symbols.
+
+	Parameters: luminance and chrominance symbols (strings, as the Huffman decoder
+	gives them), number of pixels of the image (integer) and chrominance mode
+	(integer, 0 for 4:2:0, 1 for 4:2:2 or 2 for 4:4:4).
+
+	Output: y, cb and cr symbols (uint8 arrays, integers from 1 to 9, and 0
+	where there are no more symbols).
+
+	Exceptions: This will throw an exception if the symbols are more than the
+	pixels of the image.
+
+	"""
 	# If we are in 4:4:4, all lists have the same length, the number of pixels
 	# If we are in 4:2:2, chrominance lists have their length halved
 	# If we are in 4:2:0, luminance list is 4 times longer than chrominance ones
 	if (mode == 0): # 4:2:0
-		npix = int(npix/4)
+		n = int(npix/4)
 	elif (mode == 1): # 4:2:2
-		npix = int(npix/2)
-
-	# We assign the right length to chrominance lists
-	cb_sym = [0] * npix
-	cr_sym = [0] * npix 
-	
-	# We save both chrominance final symbols
-	for i in range(0, npix):
-		cb_sym[i] = ch_sym[i]
-		cr_sym[i] = ch_sym[npix+i]
-
-	# We delete the files we dont want anymore.
-	os.remove("output_lhe/out-huffman_lum.lhe")
-	os.remove("output_lhe/out-huffman_chrom.lhe")
-	os.remove("output_lhe/out-lum.lhe")
-	os.remove("output_lhe/out-chrom.lhe")
-
-	return y_sym, cb_sym, cr_sym
\ No newline at end of file
+		n = int(npix/2)
+	else:
+		n = npix
+
+	symbols = np.zeros(npix + 2 * n, dtype=np.uint8)
+	y_sym = symbols[:npix]
+	cb_sym = symbols[npix:npix + n]
+	cr_sym = symbols[npix + n:]
+
+	# '0' is the separator of both chrominances, and the decompressor starts again after it
+	separator = chrom_sym.find('0')
+	if (separator < 0):
+		separator = len(chrom_sym)
+
+	expandChain(lum_sym, y_sym)
+	expandChain(chrom_sym[:separator], cb_sym)
+	expandChain(chrom_sym[separator + 1:], cr_sym)
+
+	return y_sym, cb_sym, cr_sym
+
+
+#*****************************************************************************#
+#	Function expandChain: This decompresses a symbols string in an array.     #
+#	'X' and '1' symbols come in chains. When a chain starts with '1',         #
+#	x_length is halved; every 'X' means x_length '1' symbols, and x_length    #
+#	grows 2 after it. So we only walk the chains, and then we write every     #
+#	symbol in its position at once.                                           #
+#	Input: symbols (string), output array                                     #
+#	Output: number of symbols written                                         #
+#*****************************************************************************#
+
+@instrument.timed("expandChain")
+def expandChain(sym, out):
+	"""Writes the decompressed symbols of a string in an array, returning how many they are.
+
+	Parameters: symbols (string with '1' to '9' and 'X'), output array (uint8
+	array, long enough).
+
+	Exceptions: This will throw an exception if the array is too short.
+
+	"""
+	codes = np.frombuffer(sym, dtype=np.uint8)
+	is_x = (codes == ord('X'))
+	in_chain = is_x | (codes == ord('1'))
+
+	# Chains of 'X' and '1' symbols, and the number of 'X' in each one
+	first = in_chain & ~np.concatenate(([False], in_chain[:-1]))
+	starts = np.flatnonzero(first)
+	chain = np.cumsum(first) - 1
+	n_x = np.bincount(chain[is_x], minlength=len(starts)).tolist()
+	halve = (codes[starts] == ord('1')).tolist()
+
+	# The only sequential part: x_length at the start of every chain
+	first_x = [0] * len(starts)
+	x_length = 8 # Starting x_length
+	for c in range(0, len(starts)):
+		if halve[c]: # '1' after a symbol which is not 'X' or '1'
+			x_length = (x_length + 1) // 2 # Rounding up
+		first_x[c] = x_length
+		x_length = x_length + 2 * n_x[c] # Every 'X' increases x_length
+
+	# Number of symbols of every input symbol: 1, or x_length for 'X'
+	x_pos = np.flatnonzero(is_x)
+	x_chain = chain[x_pos]
+	x_rank = np.arange(len(x_pos)) - np.searchsorted(x_chain, x_chain) # 'X' number inside its chain
+	counts = np.ones(len(codes), dtype=np.intp)
+	counts[x_pos] = np.array(first_x, dtype=np.intp)[x_chain] + 2 * x_rank
+
+	ends = np.cumsum(counts)
+	total = int(ends[-1]) if len(ends) else 0
+	if (total > len(out)):
+		raise ValueError("There are %d symbols, but only %d pixels" % (total, len(out)))
+
+	# Every 'X' and '1' is written as '1', and the rest in their final position
+	out[:total] = 1
+	others = np.flatnonzero(~in_chain)
+	out[ends[others] - 1] = codes[others] - ord('0')
+
+	return total
@@ -8,7 +8,10 @@ This module writes a .lhe file with some data, given the hops lists of the image
 # Author: Eduardo Rodes Pastor
 
 import Auxiliary.huff as huff
-import math, struct, os
+import Auxiliary.instrument as instrument
+import kernels
+import numpy as np
+import math, struct, os, zlib
 
 from array import *
 
@@ -16,203 +19,508 @@ from array import *
 # BINARY ENCODER #
 # ---------------#
 
+# .lhe files start with this and the version of the file. Legacy files have no
+# version, they start with the header (first byte is 0) and save the Huffman
+# tree of every codified string with cPickle.
+LHE_MAGIC = "LHE"
+LHE_LEGACY = 1
+LHE_CANONICAL = 2 # Canonical Huffman code lengths instead of the tree
+LHE_ENTROPY = 3 # A byte with the entropy coder after the version
+LHE_TOC = 4 # Every plane codified alone, and a table of contents after the header
+LHE_VERSION = LHE_TOC
+
+# Header of .lhe files, after the version: LHE type (always 0), chrominance mode,
+# width, height, number of blocks in a row and in a column, first y, cb and cr
+# values and codified luminance length (of the first block). 19 bytes
+HEADER = struct.Struct("=BBIIBBBBBI")
+
+# Block index entry of every block before version 4: first y, cb and cr values
+# and codified luminance and chrominance lengths
+BLOCK_ENTRY = struct.Struct("=BBBII")
+
+# Table of contents entry of every plane (y, cb and cr of every block): first
+# value of the plane, position of its codified data in the file, length and crc32
+TOC_ENTRY = struct.Struct("=BIII")
+
+# Entropy coders. Files older than version 3 always use Huffman
+ENTROPY_HUFFMAN = 0 # Symbols (getSymbols) with Huffman
+ENTROPY_RANGE = 1 # Hops with the adaptive range coder (Auxiliary/rangecoder.py)
+
+# Every symbol we codify with Huffman, in the order its code length is saved
+HUFFMAN_SYMBOLS = "0123456789X"
+
+# Here, we will create a list of lists for every posibility of upper hop. We will use a symbol '2' which means that this
+# hop equals the upper one. If we know that the actual symbol is different than '2', we can discard the upper hop 
+# In these arrays, we will change the original one depending on the symbol which misses (is in the upper position).
+# This original distribution means that the hop 4 (null hop) will be represented with the symbol '1'. Positive hops will 
+# be represented with even symbols and negative hops with odd symbols.
+
+DISTRIBUTION = np.array([ [9, 7, 5, 3, 1, 2, 4, 6, 8], # Original symbols distribution: Hop 0 is '9', hop 1 is '7', hop 2 is '5'...
+						  [2, 8, 6, 4, 1, 3, 5, 7, 9], # Upper hop = 0 and actual hop != 0. There is no hop 0 -> Hop 1 is 8, hop 2 is 6...
+						  [9, 2, 6, 4, 1, 3, 5, 7, 8], # Upper hop = 1 
+						  [9, 7, 2, 4, 1, 3, 5, 6, 8], # Upper hop = 2
+						  [9, 7, 5, 2, 1, 3, 4, 6, 8], # Upper hop = 3
+						  [9, 7, 5, 3, 1, 2, 4, 6, 8], # If upper hop = 4 (symbol '1'), actual symbol can be '2', since it can not represent a null hop.
+						  [9, 7, 5, 3, 1, 2, 4, 6, 8], # Upper hop = 5
+						  [9, 7, 5, 4, 1, 3, 2, 6, 8], # Upper hop = 6
+						  [9, 7, 6, 4, 1, 3, 5, 2, 8], # Upper hop = 7
+						  [9, 8, 6, 4, 1, 3, 5, 7, 2] ], dtype=np.int8) # Upper hop = 8
+
+
+# Symbols as getSymbols gives them, by value; 'X' is X_SYMBOL in the arrays
+X_SYMBOL = 10
+# Character of every symbol value, to build the Huffman string at once
+SYMBOL_CHARS = np.frombuffer(HUFFMAN_SYMBOLS, dtype=np.uint8)
+
+
 #******************************************************************************#
 #	Function getSymbols: This converts a hops list into a symbol list. We will #
 #	use a cache called distribution, so we know which symbol we need based on  #
 #	the upper and the actual hop. It will also include a symbol compressor; we #
 #	will use a symbol 'X' which means a variable '1' (null hops) chain each    #
 #	time, based on the length of '1' chains we got before.                     #
+#	Both things are done in two stages: mapSymbols and compressSymbols.        #
 #	Input: Hops list, width, height and number of pixels of the image.         #
-#	Output: Symbols list                                                       #
+#	Output: Symbols array (int8, 0 to 9 and X_SYMBOL for 'X')                  #
 #******************************************************************************#
 
+@instrument.timed("getSymbols")
 def getSymbols(hops, width, height, npix):
-	"""Returns a list of symbols given their respective hops list.
+	"""Returns the symbols array given their respective hops.
 
 	This function also uses the dynamic compressor: we have a 'X' symbol which
 	will mean a variable '1' chain of symbols.
 
-	Parameters: Hops list (integers from 0 to 8), width and height of the image
-	(integer), number of pixels of it (integer).
+	Parameters: Hops (array or list of integers from 0 to 8, as getPlaneHops
+	gives them), width and height of the image (integer), number of pixels of
+	it (integer).
+
+	Output: symbols (int8 array, X_SYMBOL is 'X'; see symbolsString), width
+	and height.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	# Rows always have the width of the image, even for subsampled chrominance
+	sym = compressSymbols(mapSymbols(hops[:min(len(hops), width * height)], width))
+	if instrument.enabled:
+		instrument.count("symbols", len(sym))
+
+	return sym, width, height
+
+
+#******************************************************************************#
+#	Function mapSymbols: This gets the symbol of every hop at once. Null hops  #
+#	are '1', hops of the first row use the original distribution, hops equal   #
+#	to the upper one are '2' and the rest use the distribution of the upper    #
+#	hop.                                                                       #
+#	Input: Hops list, width of a row.                                          #
+#	Output: Symbols array (integers from 1 to 9)                               #
+#******************************************************************************#
+
+def mapSymbols(hops, width):
+	"""Returns the symbol of every hop, without the 'X' compressor.
+
+	Parameters: hops (list or array of integers from 0 to 8), width of a row
+	of hops (integer).
 
 	Exceptions: This function does not throw an exception.
 
 	"""
-	sym = [0] * npix # Symbols list
-	lock = 0 # So we can break the bucle when mode is 4:2:2 or 4:2:0
+	hops = np.asarray(hops, dtype=np.int16).ravel()
+	sym = np.empty(len(hops), dtype=np.int8)
 
-	# Dynamic compressor variables
-	cnt = 0 # Counter for '1' chains
+	# Hops without value (-1) of odd images take the last column, as with lists
+	column = hops % 9
+
+	# If we are analyzing the first row, there is no upper hop, so we use the original distribution
+	sym[:width] = DISTRIBUTION[0][column[:width]]
+
+	# If the upper symbol equals this one, write '2'. Otherwise, we check our distribution for the correct symbol
+	upper = hops[:-width] if len(hops) > width else hops[:0]
+	actual = hops[width:]
+	sym[width:] = np.where(actual == upper, 2, DISTRIBUTION[upper + 1, column[width:]])
+
+	# If the hop is null, write '1'
+	sym[hops == 4] = 1
+
+	return sym
+
+
+#******************************************************************************#
+#	Function compressSymbols: This is the dynamic compressor. Every chain of   #
+#	'1' symbols (null hops) is replaced by 'X' symbols, each one meaning       #
+#	x_length '1' symbols; x_length grows after every 'X'. The '1' symbols that #
+#	remain are written, and if a chain had no 'X', x_length is halved when the #
+#	next symbol comes. We only walk the chains, not every symbol.              #
+#	Input: Symbols array (from mapSymbols).                                    #
+#	Output: Symbols array (int8, X_SYMBOL for 'X')                             #
+#******************************************************************************#
+
+def compressSymbols(sym):
+	"""Returns the symbols array with every '1' chain compressed with 'X' symbols (X_SYMBOL).
+
+	Parameters: symbols (array of integers from 1 to 9, as mapSymbols gives them).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	sym = np.asarray(sym, dtype=np.int8)
+	others = np.flatnonzero(sym != 1) # Positions of the symbols which are not '1'
+
+	# Length of the '1' chain before every other symbol, and the one at the end
+	chains = np.diff(np.concatenate(([-1], others, [len(sym)]))) - 1
+	found = np.flatnonzero(chains)
+	lengths = chains[found].tolist()
+
+	# The only sequential part: how many 'X' and '1' symbols every chain gets
+	xs = [0] * len(lengths)
+	ones = [0] * len(lengths)
 	x_length = 8 # 'X' will start meaning eight '1' symbols
 
-	# This means we are in a chain which some of their symbols already were
-	# compressed with 'X'. This is a long chain and we dont reduce x_length
-	in_chain = "false" 
-
-	# Here, we will create a list of lists for every posibility of upper hop. We will use a symbol '2' which means that this
-	# hop equals the upper one. If we know that the actual symbol is different than '2', we can discard the upper hop 
-	# In these arrays, we will change the original one depending on the symbol which misses (is in the upper position).
-	# This original distribution means that the hop 4 (null hop) will be represented with the symbol '1'. Positive hops will 
-	# be represented with even symbols and negative hops with odd symbols.
-
-	distribution = [ [9, 7, 5, 3, 1, 2, 4, 6, 8], # Original symbols distribution: Hop 0 is '9', hop 1 is '7', hop 2 is '5'...
-					 [2, 8, 6, 4, 1, 3, 5, 7, 9], # Upper hop = 0 and actual hop != 0. There is no hop 0 -> Hop 1 is 8, hop 2 is 6...
-					 [9, 2, 6, 4, 1, 3, 5, 7, 8], # Upper hop = 1 
-					 [9, 7, 2, 4, 1, 3, 5, 6, 8], # Upper hop = 2
-					 [9, 7, 5, 2, 1, 3, 4, 6, 8], # Upper hop = 3
-					 [9, 7, 5, 3, 1, 2, 4, 6, 8], # If upper hop = 4 (symbol '1'), actual symbol can be '2', since it can not represent a null hop.
-					 [9, 7, 5, 3, 1, 2, 4, 6, 8], # Upper hop = 5
-					 [9, 7, 5, 4, 1, 3, 2, 6, 8], # Upper hop = 6
-					 [9, 7, 6, 4, 1, 3, 5, 2, 8], # Upper hop = 7
-					 [9, 8, 6, 4, 1, 3, 5, 7, 2] ] # Upper hop = 8
-
-	# We will use the symbol 'X' to represent '1' chains. The length of these chains will be saved in an array
-	for i in range(0, height):
-		for j in range(0, width):
-
-			k = i*width + j # This is the pixel (hop) we are analyzing.
-
-			# This interrupts the bucle if we are in 4:2:2 or 4:2:0
-			if (k == len(hops)):
-				lock = 1
-				break
-
-			# If the hop is null, write '1' or 'X' depending on how many null hops are behind this one
-			if (hops[k] == 4): 
-				cnt = cnt + 1 # We increase the length of the chain
-				if (cnt < x_length): 
-					sym[k] = 1 # This symbol '1' will be removed if the chain has a length >= x_length
-				else:
-					sym[k-(x_length-1)] = 'X' # If chain length reaches 8, we write 'X'
-					cnt = 0 # Reseting counter
-					in_chain = "true" # We keep analyzing the chain
-					for p in range(0, x_length-1): 
-						sym[k-p] = 0 # We clear all the symbols '1' we wrote in this chain
-					x_length = x_length + 2 # We increase the length for next chain
-					
-				continue
-
-			# If we are analyzing the first row, there is no upper hop, so we use the original distribution
-			elif (i == 0): 
-				sym[k] = distribution[0][hops[k]]
-				if (cnt != 0): # If we get a != '1' symbol, we reset the counter and save it in an array
-					cnt = 0 # Reset
-					if (in_chain == "false"): 
-						x_length = int(math.ceil(float(x_length) / 2)) # We reduce the length of the symbol 'X'
-				in_chain = "false" # We are not anymore in a chain
-				continue
-
-			# If the upper symbol equals this one (and this one is not '1'), write '2'
-			elif (hops[k] == hops[k-width]): 
-				sym[k] = 2
-				if (cnt != 0): # Same as before
-					cnt = 0
-					if (in_chain == "false"):
-						x_length = int(math.ceil(float(x_length) / 2))
-				in_chain = "false"
-				continue
-
-			# If this hop is different than the upper one, we check our distribution for the correct symbol
-			else:				
-				sym[k] = distribution[hops[k-width]+1][hops[k]] 
-				if (cnt != 0): # Same as before
-					cnt = 0
-					if (in_chain == "false"):
-						x_length = int(math.ceil(float(x_length) / 2))
-				in_chain = "false"
-				continue
-
-		if (lock == 1):
-			break
-
-	sym = [x for x in sym if x != 0] # This removes all '0' symbols that are remaining.
+	for c in range(0, len(lengths)):
+		cnt = lengths[c]
+		n_x = 0
+		while (cnt >= x_length): # Chain length reaches x_length, we write 'X'
+			cnt = cnt - x_length
+			x_length = x_length + 2 # We increase the length for next chain
+			n_x = n_x + 1
+		xs[c] = n_x
+		ones[c] = cnt
+
+		# A chain without 'X' reduces the length of the symbol 'X' when the next symbol comes
+		if (cnt != 0 and n_x == 0):
+			x_length = (x_length + 1) // 2 # Rounding up
+
+	# Now we place everything: symbols which are not '1' move forward as many
+	# positions as 'X' and '1' symbols are written before them
+	xs = np.array(xs, dtype=np.intp)
+	ones = np.array(ones, dtype=np.intp)
+	written = xs + ones
+	before = np.zeros(len(others) + 1, dtype=np.intp)
+	before[found] = written
+	before = np.cumsum(before)
+
+	result = np.ones(len(others) + int(before[-1]), dtype=np.int8) # Remaining positions are '1'
+	result[np.arange(len(others)) + before[:-1]] = sym[others]
+
+	# 'X' symbols go first in their chain
+	starts = found + before[found] - written
+	result[np.repeat(starts - np.cumsum(xs) + xs, xs) + np.arange(int(xs.sum()))] = X_SYMBOL
+	if instrument.enabled:
+		instrument.count("x_runs", int(np.count_nonzero(xs))) # Chains with 'X'
+		instrument.count("x_symbols", int(xs.sum()))
+
+	return result
 
-	return sym, width, height
+
+#******************************************************************************#
+#	Function symbolsString: This gets the string Huffman codifies from the     #
+#	symbols getSymbols gives, with a table of the character of every value.    #
+#	Symbols lists (integers and 'X') are joined as they always were.           #
+#	Input: Symbols (array, list or string).                                    #
+#	Output: Symbols string.                                                    #
+#******************************************************************************#
+
+def symbolsString(symbols):
+	"""Returns the symbols string of a symbols array (as getSymbols gives it), list or string."""
+	if isinstance(symbols, str):
+		return symbols
+	if isinstance(symbols, np.ndarray):
+		return SYMBOL_CHARS[symbols].tostring()
+	return ''.join([str(item) for item in symbols])
 
 
 #******************************************************************************#
 #	Function writeFile: This will create a .lhe file which will contain some   #
 #	data for the decoder and both luminance and chrominance symbols with       #
-#	Huffman coding. I know creating and deleting files can be a bit slow, but  #
-#	I think it's the easiest way to understand what this method is doing.      #
+#	Huffman coding. Everything is codified in memory and written once, so     #
+#	several images can be encoded at the same time in the same folder.         #
 #	Header will have the data used in the C codec (check readme), and that's   #
 #	why we won't use a part of it here.                                        #
 #	Input: Symbol lists, chrominance mode, luminance and chrominance value for #
-#	first pixel, width and height of the image.                                #
+#	first pixel, width and height of the image, .lhe file and version of the   #
+#	file (optional).                                                           #
 #	Output: None, this just creates the file.                                  #
 #******************************************************************************#
 
-def writeFile(y_sym, cb_sym, cr_sym, mode, first_y_pixel, first_cb_pixel, first_cr_pixel, width, height): # This will write the image size and the 3 codified symbols lists in a file.
+def writeFile(y_sym, cb_sym, cr_sym, mode, first_y_pixel, first_cb_pixel, first_cr_pixel, width, height, lhe_file="output_lhe/lhe_file.lhe", version=LHE_VERSION): # This will write the image size and the 3 codified symbols lists in a file.
 	"""Writes a .lhe file with some data for the decoder.
 
-	Parameters: y, cb and cr symbols lists (integer values from 1 to 9), y, cb and cr
+	Parameters: y, cb and cr symbols (arrays from getSymbols, lists or strings), y, cb and cr
 	value of the first pixel of the image (integer values from 0 to 255), width and 
-	height of the image (integer).
+	height of the image (integer), .lhe file (path or file-like object, 
+	output_lhe/lhe_file.lhe by default), version of the file (LHE_VERSION by
+	default, LHE_LEGACY for the old files).
 
-	Exceptions: This function does not throw an exception.
+	Exceptions: This will throw an exception if the file can not be written.
 
 	"""
 	# -- PAYLOAD -- #
 
-	f = open("output_lhe/" + "payload_lum" + ".lhe", "wb")
+	lum = getHuffman(y_sym, version) # We codify the luminance with Huffman 
 
-	for item in y_sym: # We write the not codified luminance (y)
-  		f.write(str(item))
+	cb_sym = symbolsString(cb_sym)
+	cr_sym = symbolsString(cr_sym)
 
-  	f.close()
+	if (version >= LHE_TOC):
+		# Every chrominance alone, so they can be decoded without the other one
+		chrom = (getHuffman(cb_sym, version), getHuffman(cr_sym, version))
+	else:
+		# We codify both chrominances with Huffman. '0' avoids a bug and helps to separate both chrominances
+		chrom = (getHuffman(cb_sym + '0' + cr_sym, version),)
 
-	enc = huff.Encoder("output_lhe/payload_lum.lhe") # We codify the luminance with Huffman 
-	enc.write("output_lhe/huffman_lum.lhe") # We save codified luminance in a lhe file
+	# -- WRITING FILE -- #
 
-	lum_len = os.path.getsize("output_lhe/huffman_lum.lhe") # This is the size of that file
+	# Version, header, luminance and chrominance. Total header length: 19 bytes.
+	writeBlocksFile([(first_y_pixel, first_cb_pixel, first_cr_pixel, lum) + chrom], mode, width, height, 1, 1, lhe_file, version)
 
-	f = open("output_lhe/" + "payload_chrom" + ".lhe", "wb")
 
-  	for item in cb_sym: # We write the not codified chrominance (cb)
-  		f.write(str(item))
-  	f.write('0') # This avoids a bug and helps to separate both chrominances
-  	for item in cr_sym: # We write the not codified chrominance (cr)
-  		f.write(str(item))
-  	f.close()
+#******************************************************************************#
+#	Function getHuffman: This codifies a symbols string with Huffman in memory #
+#	Since version 2, codes are canonical, so we only save the code length of   #
+#	every symbol (4 bits each, 0 if it is not used, in HUFFMAN_SYMBOLS order), #
+#	the number of bits (4 bytes) and then the bits. Legacy files save the      #
+#	bytes huff.Encoder.write would save in a file, with the whole tree.        #
+#	Input: Symbols string (or array or list of symbols), version of the file.  #
+#	Output: Codified symbols (string).                                         #
+#******************************************************************************#
 
-	enc = huff.Encoder("output_lhe/payload_chrom.lhe") # We codify both chrominances with Huffman
-	enc.write("output_lhe/huffman_chrom.lhe") # We save codified chrominances in a lhe file
+@instrument.timed("huffmanEncode")
+def getHuffman(symbols, version=LHE_VERSION):
+	"""Returns the Huffman codified bytes of a symbols string.
 
-	# -- HEADER -- #
+	Parameters: Symbols (string, array from getSymbols, or list of integers
+	from 0 to 9 and 'X'), version of the file (LHE_VERSION by default).
+
+	Exceptions: This will throw an exception if there is a symbol which is
+	not in HUFFMAN_SYMBOLS.
+
+	"""
+	symbols = symbolsString(symbols)
+
+	if (version == LHE_LEGACY):
+		return huff.encode_to_bytes(symbols)
+
+	if not symbols:
+		# Chrominance of a block (or an image) of 1 row or 1 column can have no symbols at all
+		lengths, nbits, data = {}, 0, ''
+	else:
+		lengths, nbits, data = huff.Encoder().encode_canonical(symbols)
+
+	unknown = set(lengths) - set(HUFFMAN_SYMBOLS)
+	if unknown:
+		raise ValueError("Symbols %s can not be codified" % ', '.join(sorted(unknown)))
+
+	# With 11 symbols, codes are never longer than 10 bits
+	nibbles = [lengths.get(symbol, 0) for symbol in HUFFMAN_SYMBOLS] + [0]
+	header = ''.join([chr(nibbles[i] << 4 | nibbles[i + 1]) for i in range(0, len(nibbles), 2)])
+
+	return header + struct.pack("=I", nbits) + data
+
+
+#******************************************************************************#
+#	Function writeRangeFile: This is writeFile for the range coder. We do not  #
+#	need symbols: hops are codified directly, and the probability of each one  #
+#	depends on the upper and the previous hop.                                 #
+#	Input: Hops lists, chrominance mode, luminance and chrominance value for   #
+#	first pixel, width and height of the image, .lhe file (optional).          #
+#	Output: None, this just creates the file.                                  #
+#******************************************************************************#
+
+def writeRangeFile(y_hops, cb_hops, cr_hops, mode, first_y_pixel, first_cb_pixel, first_cr_pixel, width, height, lhe_file="output_lhe/lhe_file.lhe"):
+	"""Writes a .lhe file with the hops codified with the range coder.
+
+	Parameters: y, cb and cr hops lists (integer values from 0 to 8), y, cb and cr
+	value of the first pixel of the image (integer values from 0 to 255), width and
+	height of the image (integer), .lhe file (path or file-like object,
+	output_lhe/lhe_file.lhe by default).
+
+	Exceptions: This will throw an exception if the file can not be written.
 
-	f = open("output_lhe/header.lhe", "wb")
+	"""
+	lum = getRange([y_hops], width, height, mode, False)
+	cb = getRange([cb_hops], width, height, mode, True)
+	cr = getRange([cr_hops], width, height, mode, True)
+
+	writeBlocksFile([(first_y_pixel, first_cb_pixel, first_cr_pixel, lum, cb, cr)], mode, width, height, 1, 1, lhe_file, LHE_VERSION, ENTROPY_RANGE)
+
+
+#******************************************************************************#
+#	Function getRange: This codifies the hops of one or more planes of the     #
+#	same component type (luminance or both chrominances) with the range coder. #
+#	Planes are codified one after the other in the same string.                #
+#	Input: List of hops lists, width and height of the image, chrominance mode #
+#	and whether the planes are chrominances.                                   #
+#	Output: Codified hops (string).                                            #
+#******************************************************************************#
+
+@instrument.timed("rangeEncode")
+def getRange(planes, width, height, mode, chroma):
+	"""Returns the range codified bytes of some hops planes.
+
+	Parameters: list of hops lists (integers from 0 to 8, as getHops gives
+	them), width and height of the image (integers), chrominance mode
+	(integer) and True if the planes are cb and cr.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	n, row_width = kernels.planeSize(width, height, mode, chroma)
+
+	# Odd images can have slots without hop (-1), we codify them as null hops
+	hops = np.empty(n * len(planes), dtype=np.uint8)
+	hops.fill(4)
+	for i, plane in enumerate(planes):
+		plane = np.asarray(plane[:n], dtype=np.int16)
+		hops[i * n:i * n + len(plane)] = np.where(plane < 0, 4, plane)
+
+	return kernels.rangeEncode(hops, row_width, n)
+
+
+#******************************************************************************#
+#	Function writeBlocksFile: This creates a .lhe file for an image divided in #
+#	blocks. The header is the same one writeFile writes, but the number of     #
+#	blocks bytes are the real ones, and its first pixels and codified          #
+#	luminance length are the ones of the first block.                          #
+#	Since version 4, every plane of every block is codified alone, and a table #
+#	of contents comes after the header: a TOC_ENTRY for every plane (y, cb and #
+#	cr of every block, row by row), with its first value, the position of its  #
+#	codified data in the file, its length and its crc32. So a decoder can find #
+#	(and check) any plane of any block without reading the others.            #
+#	In older versions, after the header comes the block index: for each block  #
+#	(row by row), its first pixel values and the length of its codified        #
+#	luminance and chrominance (11 bytes), and a single block has no index.     #
+#	Then, the codified data of every block, in the same order.                 #
+#	Input: List of blocks (first y, cb and cr values, codified luminance and   #
+#	chrominance, or y, cb and cr since version 4), chrominance mode, width and #
+#	height of the image, number of blocks in a row and in a column, .lhe file, #
+#	version of the file, entropy coder.                                        #
+#	Output: None, this just creates the file.                                  #
+#******************************************************************************#
+
+def writeBlocksFile(blocks, mode, width, height, blocks_x, blocks_y, lhe_file, version=LHE_VERSION, entropy=ENTROPY_HUFFMAN):
+	"""Writes a .lhe file with some data for the decoder and every block of the image.
+
+	Parameters: list of blocks (tuples of first y, cb and cr values of the
+	block, integers from 0 to 255, and codified data, strings: luminance and
+	chrominance, or y, cb and cr since version 4), chrominance mode (integer),
+	width and height of the image (integers), number of blocks in a row and in
+	a column (integers from 1 to 255), .lhe file (path or file-like object),
+	version of the file (LHE_VERSION by default, it must be the one the blocks
+	were codified with), entropy coder the blocks were codified with
+	(ENTROPY_HUFFMAN by default or ENTROPY_RANGE).
+
+	Exceptions: This will throw an exception if the file can not be written,
+	if the version of the file can not save the entropy coder, or if the
+	blocks do not have the codified data this version saves.
+
+	"""
+	if (version < LHE_ENTROPY and entropy != ENTROPY_HUFFMAN):
+		raise ValueError("Version %d of .lhe files only supports Huffman" % version)
+
+	nplanes = 3 if (version >= LHE_TOC) else 2
+	for block in blocks:
+		if (len(block) != 3 + nplanes):
+			raise ValueError("Version %d of .lhe files needs %d codified planes per block, not %d" % (version, nplanes, len(block) - 3))
+
+	if hasattr(lhe_file, "write"):
+		f = lhe_file
+	else:
+		f = open(lhe_file, "wb")
+
+	# -- VERSION AND HEADER -- #
+
+	writeHeader(f, mode, width, height, blocks_x, blocks_y, blocks[0][:3], len(blocks[0][3]), version, entropy)
+
+	# -- TABLE OF CONTENTS -- #
+
+	if (version >= LHE_TOC):
+		position = getDataPosition(len(blocks)) # Data of the first plane
+		for block in blocks:
+			for first, data in zip(block[:3], block[3:]):
+				f.write(TOC_ENTRY.pack(first, position, len(data), zlib.crc32(data) & 0xFFFFFFFF))
+				position = position + len(data)
+
+	# -- BLOCK INDEX -- #
+
+	# A single block is written exactly as writeFile does, without index
+	elif (len(blocks) > 1):
+		for first_y_pixel, first_cb_pixel, first_cr_pixel, lum, chrom in blocks:
+			f.write(BLOCK_ENTRY.pack(first_y_pixel, first_cb_pixel, first_cr_pixel, len(lum), len(chrom)))
+
+	# -- BLOCKS -- #
+
+	for block in blocks:
+		for data in block[3:]:
+			f.write(data)
+
+	if instrument.enabled:
+		header = HEADER.size + (len(LHE_MAGIC) + 1 if version != LHE_LEGACY else 0) + (1 if version >= LHE_ENTROPY else 0)
+		index = TOC_ENTRY.size * 3 * len(blocks) if (version >= LHE_TOC) else (BLOCK_ENTRY.size * len(blocks) if len(blocks) > 1 else 0)
+		instrument.count("bytes_written", header + index + sum([len(data) for block in blocks for data in block[3:]]))
+
+	if f is not lhe_file:
+		f.close()
+
+
+#******************************************************************************#
+#	Function writeHeader: This writes the version and the header of a .lhe     #
+#	file (everything before the table of contents or the block index).         #
+#	Input: File object, chrominance mode, width and height of the image,       #
+#	number of blocks in a row and in a column, first y, cb and cr values and   #
+#	codified luminance length of the first block, version, entropy coder.      #
+#	Output: None, this just writes in the file.                                #
+#******************************************************************************#
+
+def writeHeader(f, mode, width, height, blocks_x, blocks_y, first, lum_len, version=LHE_VERSION, entropy=ENTROPY_HUFFMAN):
+	"""Writes the version and the header of a .lhe file.
+
+	Parameters: file object, chrominance mode (integer), width and height of
+	the image (integers), number of blocks in a row and in a column (integers
+	from 1 to 255), y, cb and cr values of the first pixel (tuple of integers
+	from 0 to 255), codified luminance length of the first block (integer),
+	version of the file and entropy coder (integers).
+
+	Exceptions: This will throw an exception if the file can not be written.
+
+	"""
+	first_y_pixel, first_cb_pixel, first_cr_pixel = first
+
+	# -- VERSION -- #
+
+	if (version != LHE_LEGACY):
+		f.write(LHE_MAGIC + struct.pack("B", version))
+	if (version >= LHE_ENTROPY):
+		f.write(struct.pack("B", entropy)) # Entropy coder
+
+	# -- HEADER -- #
 
 	f.write(struct.pack("B", 0)) # We are in basic LHE, so we write a '00000000' byte.
-	f.write(struct.pack("B", mode)) # YUV mode (00000000 for 4:2:0, 00000001 for 4:2:2 and 00000010 for 4:4:4)
+	f.write(struct.pack("B", mode)) # YUV mode
 	f.write(struct.pack("I", width)) # 4 bytes for width
 	f.write(struct.pack("I", height)) # 4 bytes for height
-	f.write(struct.pack("B", 1)) # We do not divide the image in blocks, so we write 1 block for height and width (00000001)
-	f.write(struct.pack("B", 1))
-	f.write(struct.pack("B", first_y_pixel)) # We need to save the first pixel of each list, so the decoder has a reference
+	f.write(struct.pack("B", blocks_x)) # Number of blocks in a row
+	f.write(struct.pack("B", blocks_y)) # Number of blocks in a column
+	f.write(struct.pack("B", first_y_pixel))
 	f.write(struct.pack("B", first_cb_pixel))
 	f.write(struct.pack("B", first_cr_pixel))
-	f.write(struct.pack("I", lum_len)) # 4 bytes for codified luminancy length. 
-	f.close() # Total header length: 19 bytes.
+	f.write(struct.pack("I", lum_len)) # Codified luminance length of the first block
 
-	f = open("output_lhe/lhe_file.lhe", "wb") # This is the final lhe file
 
-	# -- WRITING FILE -- #
+#******************************************************************************#
+#	Function getDataPosition: This gets where the codified data of the first   #
+#	block starts in a version 4 file, after the table of contents.             #
+#	Input: Number of blocks.                                                   #
+#	Output: Position of the data (integer).                                    #
+#******************************************************************************#
+
+def getDataPosition(nblocks):
+	"""Returns the position of the codified data in a .lhe file with a table of contents.
+
+	Parameters: number of blocks of the image (integer).
 
-	f2 = open("output_lhe/header.lhe", "rb") # Writing header
-	f.write(f2.read())
-	f2.close()
-	f2 = open("output_lhe/huffman_lum.lhe", "rb") # Writing luminance
-	f.write(f2.read())
-	f2.close()
-	f2 = open("output_lhe/huffman_chrom.lhe", "rb") # Writing chrominance
-	f.write(f2.read())
-	f2.close()
-	f.close()
-
-	# -- REMOVING OTHER FILES -- #
-
-	os.remove("output_lhe/header.lhe")
-	os.remove("output_lhe/huffman_lum.lhe")
-	os.remove("output_lhe/huffman_chrom.lhe")
-	os.remove("output_lhe/payload_lum.lhe")
-	os.remove("output_lhe/payload_chrom.lhe")
\ No newline at end of file
+	Exceptions: This function does not throw an exception.
+
+	"""
+	return len(LHE_MAGIC) + 2 + HEADER.size + TOC_ENTRY.size * 3 * nblocks
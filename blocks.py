@@ -0,0 +1,350 @@
+"""
+
+This module encodes and decodes an image divided in independent blocks, using
+several processes at the same time (the pool of workers.py).
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import numpy as np
+import Auxiliary.color as color
+import kernels
+import workers
+from LHEquantizer import loadImage, getPlaneHops
+from binary_enc import getSymbols, getHuffman, getRange, writeBlocksFile, LHE_TOC, LHE_VERSION, ENTROPY_HUFFMAN, ENTROPY_RANGE
+from binary_dec import LHEReader, decodeHuffman, decodeRange, expandSymbols, expandChain
+from image_dec import symbolsToHops, hopsToYUV, saveImage, DEFAULT_OUTPUT
+
+# -------------#
+# LHE BLOCKS   #
+# -------------#
+
+COMPONENTS = ("y", "cb", "cr")
+
+
+#*******************************************************************************#
+#	Function _axisLimits: This divides a row (or a column) of the image in      #
+#	blocks of the same even size, except the last one. A last block of 1 pixel #
+#	would have no subsampled chrominance, so it is merged into the previous     #
+#	one. The limits we get for a number of blocks are the ones we get again     #
+#	for the number of blocks they have, so the decoder finds them from the      #
+#	header, and files without a block of 1 pixel keep the limits they had.      #
+#	Input: size of the row (or column), number of blocks                        #
+#	Output: limits of the blocks (list of (start, end) tuples)                  #
+#*******************************************************************************#
+
+def _axisLimits(size, nblocks):
+	block_size = -(-size // nblocks) # Rounding up
+	block_size = block_size + block_size % 2 # Even size
+	limits = [(start, min(start + block_size, size)) for start in range(0, size, block_size)]
+
+	tiny = (len(limits) > 1 and limits[-1][1] - limits[-1][0] < 2)
+	if (len(limits) == nblocks and not tiny):
+		return limits
+
+	# nblocks blocks of an even size and a last one with the extra pixel
+	block_size, extra = divmod(size - 1, nblocks)
+	if (nblocks > 1 and extra == 0 and block_size >= 2 and block_size % 2 == 0):
+		return [(start, start + block_size) for start in range(0, size - 1 - block_size, block_size)] + [(size - 1 - block_size, size)]
+
+	# Otherwise the last block is merged with less blocks
+	if tiny:
+		return _axisLimits(size, len(limits) - 1)
+	return limits
+
+
+#*******************************************************************************#
+#	Function getBlocksLimits: This divides the image in a grid of blocks. Every #
+#	block has the same size except the last ones of each row and column, and    #
+#	block sizes are even, so subsampled chrominance starts in the same pixels   #
+#	as in the whole image. Because of that, we can get less blocks than asked.  #
+#	No block is 1 pixel wide or high (see _axisLimits).                         #
+#	Input: width and height of the image, number of blocks in a row and in a    #
+#	column                                                                      #
+#	Output: limits of the blocks in a row and in a column (lists of (start,     #
+#	end) tuples)                                                                #
+#*******************************************************************************#
+
+def getBlocksLimits(width, height, blocks_x, blocks_y):
+	"""Returns the horizontal and vertical limits of the blocks of an image.
+
+	Parameters: width and height of the image (integers), number of blocks in
+	a row and in a column (integers from 1 to 255).
+
+	Exceptions: This will throw an exception if the number of blocks is not
+	between 1 and 255.
+
+	"""
+	limits = []
+
+	for size, nblocks in ((width, blocks_x), (height, blocks_y)):
+		if (nblocks < 1 or nblocks > 255):
+			raise ValueError("The number of blocks must be between 1 and 255, not %d" % nblocks)
+
+		limits.append(_axisLimits(size, nblocks))
+
+	return limits[0], limits[1]
+
+
+#*******************************************************************************#
+#	Function encodeBlock: This encodes a block as if it was a whole image, so   #
+#	prediction and hop1 start again in it.                                      #
+#	Input: (y, cb and cr planes of the block, chrominance mode, entropy coder)  #
+#	Output: first y, cb and cr values, codified y, cb and cr                    #
+#*******************************************************************************#
+
+def encodeBlock(args):
+	"""Returns the first pixel values and the codified y, cb and cr of a block.
+
+	Parameters: tuple of y, cb and cr planes of the block (uint8 arrays),
+	chrominance mode and entropy coder (integers).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	y, cb, cr, mode, entropy = args
+	height, width = y.shape
+	npix = width * height
+
+	y_hops, y_pred = getPlaneHops(y, width, height, "y", mode)
+	cb_hops, cb_pred = getPlaneHops(cb, width, height, "cb", mode)
+	cr_hops, cr_pred = getPlaneHops(cr, width, height, "cr", mode)
+
+	first = int(y[0, 0]), int(cb[0, 0]), int(cr[0, 0])
+
+	# Every plane is codified alone, as in writeFile
+	if (entropy == ENTROPY_RANGE):
+		return first + (getRange([y_hops], width, height, mode, False),
+						getRange([cb_hops], width, height, mode, True),
+						getRange([cr_hops], width, height, mode, True))
+
+	y_sym, width, height = getSymbols(y_hops, width, height, npix)
+	cb_sym, width, height = getSymbols(cb_hops, width, height, npix)
+	cr_sym, width, height = getSymbols(cr_hops, width, height, npix)
+
+	return first + tuple([getHuffman(sym) for sym in (y_sym, cb_sym, cr_sym)])
+
+
+#*******************************************************************************#
+#	Function decodeBlock: This decodes a block given its codified data. Since   #
+#	version 4 every plane is codified alone, so we only decode the components   #
+#	we are asked for (the codified data of the others can be None).             #
+#	Input: (block: first y, cb and cr values and codified luminance and         #
+#	chrominance, or y, cb and cr; width and height of the block, chrominance    #
+#	mode, version of the file, entropy coder, chroma upsampling method and      #
+#	components)                                                                 #
+#	Output: y, cb and cr planes of the block (None if not asked)                #
+#*******************************************************************************#
+
+def decodeBlock(args):
+	"""Returns the y, cb and cr planes of a block given its codified data.
+
+	Parameters: tuple of block (tuple of y, cb and cr values of its first
+	pixel, integers, and its codified data, strings), width and height of the
+	block (integers), chrominance mode, version of the .lhe file and entropy
+	coder (integers), upsampling of subsampled chrominance (string),
+	components to decode (tuple of "y", "cb" and "cr").
+
+	Exceptions: This will throw an exception if the codified data is not valid.
+
+	"""
+	block, width, height, mode, version, entropy, upsampling, components = args
+	hops = decodeBlockHops(block, width, height, mode, version, entropy, components)
+
+	planes = [None] * 3
+	for i in range(0, 3):
+		if (COMPONENTS[i] in components):
+			planes[i] = np.empty((height, width), dtype=np.uint8)
+			hopsToYUV(hops[i], block[i], width, height, COMPONENTS[i], mode, upsampling, planes[i])
+
+	return planes
+
+
+#*******************************************************************************#
+#	Function decodeBlockHops: This gets the hops of a block given its codified  #
+#	data (only the hops of the components we are asked for since version 4).   #
+#	Input: block, width and height of the block, chrominance mode, version of   #
+#	the file, entropy coder and components                                      #
+#	Output: y, cb and cr hops of the block (None if not asked)                  #
+#*******************************************************************************#
+
+def decodeBlockHops(block, width, height, mode, version, entropy, components=COMPONENTS):
+	"""Returns the y, cb and cr hops of a block given its codified data.
+
+	Parameters: block (tuple of y, cb and cr values of its first pixel,
+	integers, and its codified data, strings), width and height of the block
+	(integers), chrominance mode, version of the .lhe file and entropy coder
+	(integers), components to decode (tuple of "y", "cb" and "cr").
+
+	Exceptions: This will throw an exception if the codified data is not valid.
+
+	"""
+	npix = width * height
+	hops = [None] * 3
+
+	if (version >= LHE_TOC):
+		for i, data in enumerate(block[3:]):
+			if (COMPONENTS[i] not in components):
+				continue
+			if (entropy == ENTROPY_RANGE):
+				hops[i], = decodeRange(data, width, height, mode, i > 0, 1)
+			else:
+				sym = np.zeros(kernels.planeSize(width, height, mode, i > 0)[0], dtype=np.uint8)
+				expandChain(decodeHuffman(data, version), sym)
+				hops[i] = symbolsToHops(sym, width, COMPONENTS[i], mode)
+
+	# Older versions have both chrominances together
+	elif (entropy == ENTROPY_RANGE):
+		lum, chrom = block[3:]
+		hops[0], = decodeRange(lum, width, height, mode, False)
+		hops[1], hops[2] = decodeRange(chrom, width, height, mode, True)
+	else:
+		lum, chrom = block[3:]
+		symbols = expandSymbols(decodeHuffman(lum, version), decodeHuffman(chrom, version), npix, mode)
+		hops = [symbolsToHops(sym, width, component, mode) for sym, component in zip(symbols, COMPONENTS)]
+
+	return hops
+
+
+#*******************************************************************************#
+#	Function encodeBlocks: This encodes every block of an image in parallel and #
+#	saves them in a .lhe file.                                                  #
+#	Input: image file (or ImagePlanes), .lhe file, chrominance mode, number of  #
+#	blocks in a row and in a column, number of processes, entropy coder         #
+#	Output: None, this just creates the file                                    #
+#*******************************************************************************#
+
+def encodeBlocks(image, lhe_file, mode, blocks_x, blocks_y, jobs=None, entropy=ENTROPY_HUFFMAN):
+	"""Encodes an image divided in blocks, every block in its own process.
+
+	Parameters: image file (string) or ImagePlanes, .lhe file (path or file-like object),
+	chrominance mode (integer, 0 for 4:2:0, 1 for 4:2:2 or 2 for 4:4:4), number
+	of blocks in a row and in a column (integers from 1 to 255), number of
+	processes (integer; by default all the CPUs for workers.POOL_PIXELS
+	pixels or more, this process for smaller images), entropy coder
+	(ENTROPY_HUFFMAN by default or ENTROPY_RANGE).
+
+	Exceptions: This will throw an exception if the image can not be opened or
+	the .lhe file can not be written.
+
+	"""
+	if isinstance(image, basestring):
+		image = loadImage(image)
+
+	y, cb, cr = color.RGBtoYUV(*image.planes())
+
+	limits_x, limits_y = getBlocksLimits(image.width, image.height, blocks_x, blocks_y)
+
+	tasks = [(y[y0:y1, x0:x1], cb[y0:y1, x0:x1], cr[y0:y1, x0:x1], mode, entropy)
+			 for (y0, y1) in limits_y for (x0, x1) in limits_x]
+
+	blocks = workers.run(encodeBlock, tasks, jobs, image.npix)
+
+	writeBlocksFile(blocks, mode, image.width, image.height, len(limits_x), len(limits_y), lhe_file, LHE_VERSION, entropy)
+
+
+#*******************************************************************************#
+#	Function decodeBlocks: This decodes every block of a .lhe file in parallel  #
+#	and joins them in the y, cb and cr planes of the image. If we only want     #
+#	some components or a region of the image, we only decode its blocks; since  #
+#	version 4 we also read only their planes, using the table of contents.      #
+#	Input: .lhe file (or LHEReader), number of processes, chroma upsampling     #
+#	method, components and region (optional)                                    #
+#	Output: y, cb, cr planes (uint8 arrays of height x width)                   #
+#*******************************************************************************#
+
+def decodeBlocks(lhe_file, jobs=None, upsampling="nearest", components=COMPONENTS, region=None):
+	"""Returns the y, cb and cr planes of a .lhe file, decoding every block in its own process.
+
+	Parameters: .lhe file (path, file-like object or LHEReader), number of processes (integer, all the CPUs
+	by default for workers.POOL_PIXELS pixels or more), upsampling of subsampled chrominance (string, "nearest" by
+	default or "bilinear"), components we want (tuple of "y", "cb" and "cr",
+	all of them by default) and region of the image (tuple of x0, y0, x1 and
+	y1, the whole image by default).
+
+	Output: a plane (uint8 array of height x width, or the size of the region)
+	for every component asked, in the same order.
+
+	Exceptions: This will throw an exception if the .lhe file is not valid,
+	or if the components or the region are not valid.
+
+	"""
+	for component in components:
+		if component not in COMPONENTS:
+			raise ValueError("Unknown component '%s' (we have: %s)" % (component, ", ".join(COMPONENTS)))
+
+	reader = lhe_file if isinstance(lhe_file, LHEReader) else LHEReader(lhe_file)
+	try:
+		return _decodeBlocks(reader, jobs, upsampling, components, region)
+	finally:
+		if reader is not lhe_file:
+			reader.close()
+
+
+def _decodeBlocks(reader, jobs, upsampling, components, region):
+	version, entropy, mode, width, height = reader.version, reader.entropy, reader.mode, reader.width, reader.height
+
+	rx0, ry0, rx1, ry1 = region if region is not None else (0, 0, width, height)
+	if not (0 <= rx0 < rx1 <= width and 0 <= ry0 < ry1 <= height):
+		raise ValueError("Region %s is not inside the image (%d x %d)" % (str(region), width, height))
+
+	if (version >= LHE_TOC):
+		blocks_x, blocks_y, blocks = reader.toc()
+	else:
+		blocks_x, blocks_y, blocks = reader.blocks()
+
+	limits_x, limits_y = getBlocksLimits(width, height, blocks_x, blocks_y)
+
+	# Only the blocks inside the region
+	tasks = []
+	positions = []
+	for b, block in enumerate(blocks):
+		x0, x1 = limits_x[b % blocks_x]
+		y0, y1 = limits_y[b // blocks_x]
+		if (x1 <= rx0 or x0 >= rx1 or y1 <= ry0 or y0 >= ry1):
+			continue
+
+		# With the table of contents, we read (and check) only the planes we decode
+		if (version >= LHE_TOC):
+			block = tuple([entry[0] for entry in block] + [reader.plane(entry) if COMPONENTS[i] in components else None
+															for i, entry in enumerate(block)])
+
+		tasks.append((block, x1 - x0, y1 - y0, mode, version, entropy, upsampling, tuple(components)))
+		positions.append((x0, y0, x1, y1))
+
+	planes = dict([(component, np.empty((ry1 - ry0, rx1 - rx0), dtype=np.uint8)) for component in components])
+
+	for (x0, y0, x1, y1), block_planes in zip(positions, workers.run(decodeBlock, tasks, jobs, (rx1 - rx0) * (ry1 - ry0))):
+		# Part of the block inside the region
+		cx0, cy0, cx1, cy1 = max(x0, rx0), max(y0, ry0), min(x1, rx1), min(y1, ry1)
+		for component, block_plane in zip(COMPONENTS, block_planes):
+			if (component in planes):
+				planes[component][cy0 - ry0:cy1 - ry0, cx0 - rx0:cx1 - rx0] = block_plane[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+
+	return [planes[component] for component in components]
+
+
+#*******************************************************************************#
+#	Function decodeBlocksToBMP: This decodes a .lhe file divided in blocks and  #
+#	saves the image in the output_img folder, as the decoder example does (or   #
+#	in any other file).                                                         #
+#	Input: .lhe file, number of processes, output and format                    #
+#	Output: None                                                                #
+#*******************************************************************************#
+
+def decodeBlocksToBMP(lhe_file, jobs=None, output=DEFAULT_OUTPUT, fmt=None):
+	"""Decodes a .lhe file divided in blocks and saves it as output_img/output-image.bmp.
+
+	Parameters: .lhe file (path or file-like object), number of processes (integer, all the CPUs
+	by default for workers.POOL_PIXELS pixels or more), output (path or file-like object, output_img/output-image.bmp
+	by default), format (string, "BMP", "PNG" or "YUV"; the extension of the
+	output by default).
+
+	Exceptions: This will throw an exception if the .lhe file is not valid.
+
+	"""
+	y, cb, cr = decodeBlocks(lhe_file, jobs)
+	height, width = y.shape
+
+	saveImage(y, cb, cr, (width, height), output, fmt)
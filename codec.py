@@ -0,0 +1,381 @@
+"""
+
+This module encodes and decodes whole images, running the y, cb and cr stages
+of the codec at the same time in the pool of processes of workers.py.
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+from cStringIO import StringIO
+import numpy as np
+import Auxiliary.color as color
+import Auxiliary.instrument as instrument
+import blocks
+import workers
+from LHEquantizer import ImagePlanes, getPlaneHops
+from binary_enc import getSymbols, symbolsString, getHuffman, getRange, writeBlocksFile, LHE_TOC, LHE_VERSION, ENTROPY_HUFFMAN, ENTROPY_RANGE
+from binary_dec import LHEReader, decodeHuffman, decodeRange, expandSymbols
+from image_dec import symbolsToHops, hopsToYUV, hopsToRows, rebandRows, getOutputFormat, saveImage
+
+# -------------#
+# LHE CODEC    #
+# -------------#
+
+COMPONENTS = ("y", "cb", "cr")
+
+DEFAULT_ROWS = 16 # Rows of every band given by decode_rows
+
+#*******************************************************************************#
+#	Function _encodePlane: This gets the symbols string of a component (hops    #
+#	and symbols stages). The range coder does not need symbols, so we just get  #
+#	the hops.                                                                   #
+#	Input: (plane, index of the plane, chrominance mode, entropy coder)         #
+#	Output: symbols (string) or hops (int8 array)                               #
+#*******************************************************************************#
+
+def _encodePlane(args):
+	plane, index, mode, entropy = args
+	height, width = plane.shape
+	npix = width * height
+
+	hops, result = getPlaneHops(plane, width, height, COMPONENTS[index], mode)
+	if (entropy == ENTROPY_RANGE):
+		return hops
+
+	sym, width, height = getSymbols(hops, width, height, npix)
+
+	return symbolsString(sym)
+
+
+def _entropyCode(args):
+	data, entropy, width, height, mode, chroma = args
+	if (entropy == ENTROPY_RANGE):
+		return getRange(data, width, height, mode, chroma)
+	return getHuffman(data)
+
+
+def _entropyDecode(args):
+	data, version, entropy, width, height, mode, chroma = args
+	if (entropy == ENTROPY_RANGE):
+		return decodeRange(data, width, height, mode, chroma, 1 if (version >= LHE_TOC) else None)
+	return decodeHuffman(data, version)
+
+
+#*******************************************************************************#
+#	Function _decodePlane: This gets the values of a component from its symbols #
+#	(or its hops, with the range coder), hops and YUV stages. In this process   #
+#	they are written directly in the plane given; a worker returns them.        #
+#	Input: (index of the plane, symbols list, first value, chrominance mode,    #
+#	entropy coder, chroma upsampling method, width, height, plane or None)      #
+#	Output: values (uint8 array of height x width)                              #
+#*******************************************************************************#
+
+def _decodePlane(args):
+	index, sym, first, mode, entropy, upsampling, width, height, plane = args
+
+	if (entropy == ENTROPY_RANGE):
+		hops = sym
+	else:
+		hops = symbolsToHops(sym, width, COMPONENTS[index], mode)
+
+	return hopsToYUV(hops, first, width, height, COMPONENTS[index], mode, upsampling, plane)
+
+
+#*******************************************************************************#
+#	Function encode_image: This encodes an image in a .lhe file. Each one of    #
+#	the y, cb and cr planes is quantized and turned into symbols by its own     #
+#	worker; then luminance and chrominance are coded with Huffman at the same   #
+#	time. Small images are coded in this process unless we ask for processes    #
+#	(see workers.py). The file is the same one the example writes.              #
+#	Input: image (file, PIL image or ImagePlanes), .lhe file, chrominance mode, #
+#	number of blocks (optional), number of processes and entropy coder          #
+#	Output: None, this just creates the file                                    #
+#*******************************************************************************#
+
+@instrument.timed("encode_image")
+def encode_image(image, lhe_file, mode, blocks_x=1, blocks_y=1, jobs=None, entropy=ENTROPY_HUFFMAN):
+	"""Encodes an image in a .lhe file, running its y, cb and cr stages in parallel.
+
+	Parameters: image (path, file object, PIL image or ImagePlanes), .lhe file
+	(path or file-like object), chrominance mode (integer, 0 for 4:2:0, 1 for 4:2:2 or 2 for
+	4:4:4), number of blocks in a row and in a column (integers, 1 by default),
+	number of processes (integer, 1 runs everything in this process; by
+	default images of workers.POOL_PIXELS pixels or more use all the CPUs),
+	entropy coder (ENTROPY_HUFFMAN by default, or ENTROPY_RANGE for smaller
+	files).
+
+	Exceptions: This will throw an exception if the image can not be opened or
+	the .lhe file can not be written.
+
+	"""
+	if not isinstance(image, ImagePlanes):
+		image = ImagePlanes(image)
+
+	# Images divided in blocks are encoded block by block instead
+	if (blocks_x * blocks_y > 1):
+		blocks.encodeBlocks(image, lhe_file, mode, blocks_x, blocks_y, jobs, entropy)
+		return
+
+	planes = color.RGBtoYUV(image.r, image.g, image.b)
+
+	y_sym, cb_sym, cr_sym = workers.run(_encodePlane, [(planes[i], i, mode, entropy) for i in range(3)], jobs, image.npix)
+
+	# Every plane is codified alone, so y, cb and cr are codified at the same time too
+	if (entropy == ENTROPY_RANGE):
+		tasks = [([y_sym], False), ([cb_sym], True), ([cr_sym], True)]
+	else:
+		tasks = [(y_sym, False), (cb_sym, True), (cr_sym, True)]
+
+	codified = workers.run(_entropyCode, [(data, entropy, image.width, image.height, mode, chroma) for data, chroma in tasks], jobs, image.npix)
+
+	first = [int(plane[0, 0]) for plane in planes]
+
+	writeBlocksFile([tuple(first + codified)], mode, image.width, image.height, 1, 1, lhe_file, LHE_VERSION, entropy)
+
+
+#*******************************************************************************#
+#	Function decodePlanes: This decodes a .lhe file into its YUV planes.        #
+#	Every codified plane (luminance and chrominance before version 4) is        #
+#	decoded at the same time, and then every component gets its hops and       #
+#	values in its own worker (small images are decoded in this process, right   #
+#	in the planes, see workers.py). Some components or a region of the image    #
+#	are decoded by blocks instead, so we only decode the planes and blocks we   #
+#	need.                                                                       #
+#	Input: .lhe file (or LHEReader), number of processes, chroma upsampling     #
+#	method, components and region (optional)                                    #
+#	Output: y, cb, cr planes (uint8 arrays of height x width)                   #
+#*******************************************************************************#
+
+@instrument.timed("decodePlanes")
+def decodePlanes(lhe_file, jobs=None, upsampling="nearest", components=COMPONENTS, region=None):
+	"""Returns the y, cb and cr planes of a .lhe file, running its stages in parallel.
+
+	Parameters: .lhe file (path, file-like object or LHEReader), number of processes (integer, 1 runs
+	everything in this process; by default images of workers.POOL_PIXELS
+	pixels or more use all the CPUs), upsampling of subsampled chrominance
+	(string, "nearest" by default or "bilinear"), components we want (tuple of "y",
+	"cb" and "cr", all of them by default; only "y" for a luminance preview)
+	and region of the image (tuple of x0, y0, x1 and y1, the whole image by
+	default).
+
+	Output: a plane (uint8 array of height x width, or the size of the region)
+	for every component asked, in the same order.
+
+	Exceptions: This will throw an exception if the .lhe file is not valid.
+
+	"""
+	reader = lhe_file if isinstance(lhe_file, LHEReader) else LHEReader(lhe_file)
+	try:
+		return _decodePlanes(reader, jobs, upsampling, components, region)
+	finally:
+		if reader is not lhe_file:
+			reader.close()
+
+
+def _decodePlanes(reader, jobs, upsampling, components, region):
+	version, entropy, mode, width, height = reader.version, reader.entropy, reader.mode, reader.width, reader.height
+	first_y, first_cb, first_cr = reader.first
+
+	if (reader.blocks_x * reader.blocks_y > 1 or region is not None or tuple(components) != COMPONENTS):
+		return blocks.decodeBlocks(reader, jobs, upsampling, components, region)
+
+	codified = reader.blocks()[2][0][3:] # Buffers of the file, they are only copied for other processes
+	chroma = [False, True, True][:len(codified)]
+
+	npix = width * height
+	decoded = workers.run(_entropyDecode, [(plane, version, entropy, width, height, mode, c) for plane, c in zip(codified, chroma)], jobs, npix)
+	if (entropy == ENTROPY_RANGE):
+		y_sym, cb_sym, cr_sym = sum(decoded, []) # Lists of hops lists
+	else:
+		# Chrominances are joined with '0', as older versions saved them
+		y_sym, cb_sym, cr_sym = expandSymbols(decoded[0], '0'.join(decoded[1:]), npix, mode)
+
+	# In this process values are written directly in the planes, workers send them back
+	planes = np.empty((3, height, width), dtype=np.uint8)
+	out = [None] * 3 if workers.useProcesses(jobs, npix) else list(planes)
+	values = workers.run(_decodePlane, [(i, sym, first, mode, entropy, upsampling, width, height, out[i])
+								 for i, (sym, first) in enumerate(zip((y_sym, cb_sym, cr_sym), (first_y, first_cb, first_cr)))], jobs, npix)
+	for i in range(0, 3):
+		if out[i] is None:
+			planes[i] = values[i].reshape(height, width)
+
+	return planes
+
+
+#*******************************************************************************#
+#	Function decode_image: This decodes a .lhe file (or a region of it) into    #
+#	RGB values.                                                                 #
+#	Input: .lhe file, number of processes, chroma upsampling method and region  #
+#	Output: rgb (uint8 array of height x width x 3)                             #
+#*******************************************************************************#
+
+def decode_image(lhe_file, jobs=None, upsampling="nearest", region=None):
+	"""Decodes a .lhe file, running its y, cb and cr stages in parallel.
+
+	Parameters: .lhe file (path or file-like object), number of processes (integer, 1 runs
+	everything in this process), upsampling of subsampled chrominance (string,
+	"nearest" by default or "bilinear"), region of the image (tuple of x0, y0,
+	x1 and y1, the whole image by default).
+
+	Output: RGB values (uint8 array of height x width x 3).
+
+	Exceptions: This will throw an exception if the .lhe file is not valid.
+
+	"""
+	y, cb, cr = decodePlanes(lhe_file, jobs, upsampling, region=region)
+	height, width = y.shape
+
+	rgb = np.empty((height, width, 3), dtype=np.uint8)
+	color.YUVtoRGB(y, cb, cr, out=(rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]))
+
+	return rgb
+
+
+#*******************************************************************************#
+#	Function decode_rows: This decodes a .lhe file a band of rows at a time, so #
+#	they can be used before the rest of the image is decoded. The hops of a row #
+#	of blocks (the whole image if it has not blocks) are decoded first, and     #
+#	then values and RGB are only computed for the rows of the band.             #
+#	Input: .lhe file, rows of every band, chroma upsampling method and True if  #
+#	we want YCbCr instead of RGB                                                #
+#	Output: generator of rgb bands (uint8 arrays of rows x width x 3)           #
+#*******************************************************************************#
+
+def decode_rows(lhe_file, rows=DEFAULT_ROWS, upsampling="nearest", ycbcr=False):
+	"""Decodes a .lhe file, yielding its RGB values a band of rows at a time.
+
+	Parameters: .lhe file (path, file-like object or LHEReader), rows of
+	every band (integer, DEFAULT_ROWS by default), upsampling of subsampled
+	chrominance (string, "nearest" by default or "bilinear"), True if we
+	want the decoded Y, Cb and Cr values instead of RGB (boolean).
+
+	Output: generator of RGB bands (uint8 arrays of rows x width x 3, the
+	last one can have less rows), the same rows decode_image gives, or
+	YCbCr bands with the same shape.
+
+	Exceptions: This will throw an exception if the .lhe file is not valid.
+
+	"""
+	reader = lhe_file if isinstance(lhe_file, LHEReader) else LHEReader(lhe_file)
+	try:
+		for band in rebandRows(_decodeRows(reader, rows, upsampling, ycbcr), rows):
+			yield band
+	finally:
+		if reader is not lhe_file:
+			reader.close()
+
+
+def _decodeRows(reader, rows, upsampling, ycbcr):
+	version, entropy, mode, width, height = reader.version, reader.entropy, reader.mode, reader.width, reader.height
+
+	if (version >= LHE_TOC):
+		blocks_x, blocks_y, codified = reader.toc()
+	else:
+		blocks_x, blocks_y, codified = reader.blocks()
+
+	limits_x, limits_y = blocks.getBlocksLimits(width, height, blocks_x, blocks_y)
+
+	for r, (y0, y1) in enumerate(limits_y):
+		# Bands of y, cb and cr of every block of the row
+		bands = []
+		for (x0, x1), block in zip(limits_x, codified[r * blocks_x:(r + 1) * blocks_x]):
+			if (version >= LHE_TOC):
+				block = tuple([entry[0] for entry in block] + [reader.plane(entry) for entry in block])
+			hops = blocks.decodeBlockHops(block, x1 - x0, y1 - y0, mode, version, entropy)
+			bands.append([hopsToRows(hops[i], block[i], x1 - x0, y1 - y0, COMPONENTS[i], mode, rows, upsampling)
+						  for i in range(0, 3)])
+
+		for h in range(y0, y1, rows):
+			planes = np.empty((3, min(rows, y1 - h), width), dtype=np.uint8)
+			for (x0, x1), block_bands in zip(limits_x, bands):
+				for plane, band in zip(planes, block_bands):
+					plane[:, x0:x1] = next(band)
+
+			if ycbcr:
+				yield np.dstack(planes)
+				continue
+
+			rgb = np.empty(planes.shape[1:] + (3,), dtype=np.uint8)
+			color.YUVtoRGB(planes[0], planes[1], planes[2], out=(rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]))
+			yield rgb
+
+
+#*******************************************************************************#
+#	Function decode_to_file: This decodes a .lhe file and saves the image in a  #
+#	file or in a file-like object, without going through the output_img folder. #
+#	Input: .lhe file, output, format, number of processes, chroma upsampling    #
+#	method, True if PIL must convert YCbCr to RGB and region                    #
+#	Output: None, this just saves the image                                     #
+#*******************************************************************************#
+
+def decode_to_file(lhe_file, output, fmt=None, jobs=None, upsampling="nearest", ycbcr=False, region=None):
+	"""Decodes a .lhe file and saves the image as BMP, PNG or raw YUV planes.
+
+	Parameters: .lhe file (path or file-like object), output (path or
+	file-like object, a StringIO keeps the image in memory), format (string,
+	"BMP", "PNG" or "YUV"; the extension of the output by default), number of
+	processes (integer), upsampling of subsampled chrominance (string), True
+	if PIL must convert YCbCr to RGB instead of our formula, region of the
+	image (tuple of x0, y0, x1 and y1, the whole image by default).
+
+	Exceptions: This will throw an exception if the .lhe file is not valid,
+	the format is not supported or the output can not be written.
+
+	"""
+	fmt = getOutputFormat(output, fmt) # Before decoding, so a wrong format fails fast
+
+	y, cb, cr = decodePlanes(lhe_file, jobs, upsampling, region=region)
+	height, width = y.shape
+
+	saveImage(y, cb, cr, (width, height), output, fmt, ycbcr)
+
+
+#*******************************************************************************#
+#	Function encode_bytes: This encodes an image given its file in memory, and  #
+#	returns the .lhe file in memory too, so nothing is read from or written in  #
+#	a file (two calls never share a path, and no I/O blocks them).              #
+#	Input: image file (string), chrominance mode, number of blocks, number of   #
+#	processes and entropy coder                                                 #
+#	Output: .lhe file (string)                                                  #
+#*******************************************************************************#
+
+def encode_bytes(data, mode, blocks_x=1, blocks_y=1, jobs=1, entropy=ENTROPY_HUFFMAN):
+	"""Encodes an image file in memory and returns the .lhe file.
+
+	Parameters: image file (string, any format PIL can open), chrominance
+	mode (integer, 0 for 4:2:0, 1 for 4:2:2 or 2 for 4:4:4), number of blocks
+	in a row and in a column (integers, 1 by default), number of processes
+	(integer, 1 by default, so it can run in a worker), entropy coder.
+
+	Exceptions: This will throw an exception if the image is not valid.
+
+	"""
+	lhe_file = StringIO()
+	encode_image(StringIO(data), lhe_file, mode, blocks_x, blocks_y, jobs, entropy)
+	return lhe_file.getvalue()
+
+
+#*******************************************************************************#
+#	Function decode_bytes: This decodes a .lhe file in memory and returns the   #
+#	image file (BMP, PNG or raw YUV planes) in memory too.                      #
+#	Input: .lhe file (string), format, number of processes, chroma upsampling   #
+#	method, True if PIL must convert YCbCr to RGB and region                    #
+#	Output: image file (string)                                                 #
+#*******************************************************************************#
+
+def decode_bytes(data, fmt="BMP", jobs=1, upsampling="nearest", ycbcr=False, region=None):
+	"""Decodes a .lhe file in memory and returns the image file.
+
+	Parameters: .lhe file (string), format (string, "BMP", "PNG" or "YUV"),
+	number of processes (integer, 1 by default), upsampling of subsampled
+	chrominance (string), True if PIL must convert YCbCr to RGB, region of
+	the image (tuple of x0, y0, x1 and y1, the whole image by default).
+
+	Exceptions: This will throw an exception if the .lhe file is not valid
+	or the format is not supported.
+
+	"""
+	output = StringIO()
+	decode_to_file(StringIO(data), output, fmt, jobs, upsampling, ycbcr, region)
+	return output.getvalue()
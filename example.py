@@ -14,6 +14,7 @@ from LHEquantizer import *
 from binary_enc import *
 from binary_dec import *
 from image_dec import *
+from blocks import *
 from Auxiliary.psnr import *
 
 # ------------------------#
@@ -54,8 +55,9 @@ if __name__=='__main__':
 			using = "input_img/" + image
 
 			try:
-				# We get the width, height and number of pixels of the image
-				width, height, npix = getImageData(using)
+				# We decode the image only once, and we get its width, height and number of pixels
+				img = loadImage(using)
+				width, height, npix = img.width, img.height, img.npix
 				valid_image = "true"
 				print ""
 			except:
@@ -63,13 +65,12 @@ if __name__=='__main__':
 				print "ERROR: Image cant be loaded or it is not saved in the input_img folder."
 
 		# Getting YUV values
-		r, g, b = getRGB(using, npix)
-		y, cb, cr = RGBtoYUV(r, g, b)
+		y, cb, cr = RGBtoYUV(*img.planes())
 		
 		# We get the hops based on the YUV values
-		y_hops, y_pred = getHops(y, cb, cr, "y", using, mode, npix)
-		cb_hops, cb_pred = getHops(y, cb, cr, "cb", using, mode, npix)
-		cr_hops, cr_pred= getHops(y, cb, cr, "cr", using, mode, npix)
+		y_hops, y_pred = getPlaneHops(y, width, height, "y", mode)
+		cb_hops, cb_pred = getPlaneHops(cb, width, height, "cb", mode)
+		cr_hops, cr_pred = getPlaneHops(cr, width, height, "cr", mode)
 		
 		# We get the image PSNR
 		calculatePSNR(y_pred, y, npix)
@@ -101,28 +102,37 @@ if __name__=='__main__':
 			sys.exit(0)
 
 
-		# We need the tuple for saving the image, and the number of pixels for the following function
-		size = (width, height)
-		npix = width * height
-
-		# We get the chrominance and/or luminance symbols
-		y_sym, cb_sym, cr_sym = getSymbolsLists(lhe_file, npix, lum_len, mode)
-
-		# We get the hops represented by those symbols
-		y_hops = symbolsToHops(y_sym, width, "y", mode)
-		cb_hops = symbolsToHops(cb_sym, width, "cb", mode)
-		cr_hops = symbolsToHops(cr_sym, width, "cr", mode)
+		# Images divided in blocks are decoded block by block, every block in its own process
+		blocks_x, blocks_y, blocks = getBlocks(lhe_file)
+		if (blocks_x * blocks_y > 1):
+			decodeBlocksToBMP(lhe_file)
+		else:
+			# We need the tuple for saving the image, and the number of pixels for the following function
+			size = (width, height)
+			npix = width * height
+
+			# Files codified with the range coder have the hops, without symbols
+			if (getEntropy(lhe_file) == ENTROPY_RANGE):
+				y_hops, cb_hops, cr_hops = getHopsLists(lhe_file, width, height, lum_len, mode)
+			else:
+				# We get the chrominance and/or luminance symbols
+				y_sym, cb_sym, cr_sym = getSymbolsLists(lhe_file, npix, lum_len, mode)
+
+				# We get the hops represented by those symbols
+				y_hops = symbolsToHops(y_sym, width, "y", mode)
+				cb_hops = symbolsToHops(cb_sym, width, "cb", mode)
+				cr_hops = symbolsToHops(cr_sym, width, "cr", mode)
 		
-		# We get the YUV values represented by those hops
-		y_YUV = hopsToYUV(y_hops, first_lum, width, height, "y", mode)
-		cb_YUV = hopsToYUV(cb_hops, first_cb, width, height, "cb", mode)
-		cr_YUV = hopsToYUV(cr_hops, first_cr, width, height, "cr", mode)
+			# We get the YUV values represented by those hops
+			y_YUV = hopsToYUV(y_hops, first_lum, width, height, "y", mode)
+			cb_YUV = hopsToYUV(cb_hops, first_cb, width, height, "cb", mode)
+			cr_YUV = hopsToYUV(cr_hops, first_cr, width, height, "cr", mode)
 
-		# We transform YUV into the tuple RGB
-		rgb = YUVtoRGB(y_YUV, cb_YUV, cr_YUV)
+			# We transform YUV into the tuple RGB
+			rgb = YUVtoRGB(y_YUV, cb_YUV, cr_YUV)
 
-		# Saving the rgb image to .bmp
-		RGBtoBMP(rgb, size)
+			# Saving the rgb image to .bmp
+			RGBtoBMP(rgb, size)
 
 	elif function == "exit":
 		print ""
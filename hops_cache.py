@@ -0,0 +1,148 @@
+"""
+
+This module builds, keeps and stores the pre-computed hops cache shared by the
+encoder (LHEquantizer) and the decoder (image_dec).
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import os
+import numpy as np
+
+# ------------#
+# HOPS CACHE  #
+# ------------#
+
+# Process-wide memo of built (or loaded) caches, keyed by (rmax, h1range)
+_caches = {}
+
+
+#*********************************************************************************************#
+#	Function buildHopsCache: This computes the final color component of every hop for a     #
+#	single rmax value, using whole NumPy arrays instead of bucles. It follows exactly the    #
+#	same formulas (and the same order of float operations) as the original initHopsCache,   #
+#	so every value matches it bit for bit.                                                   #
+#	Given a certain h1 value and h0 luminance, the color component of hop "i" is stored in   #
+#	cache[h1][h0][i]. Row h1 = 0 is never used by LHE and is left to zero.                   #
+#	Input: rmax (integer, 25 means 2.5f), h1range (integer)                                  #
+#	Output: cache (uint8 array of h1range x 256 x 9)                                         #
+#*********************************************************************************************#
+
+def buildHopsCache(rmax=25, h1range=20):
+	"""Returns the hops cache for a given rmax value as a uint8 array.
+
+	Parameters: rmax (integer, from 20 to 40, 25 means a maximum ratio of
+	2.5f), h1range (integer, number of hop1 values to pre-compute).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	percent_range = 0.8 # 80%
+	maximum = float(rmax)/10 # If rmax is 25 then max is 2.5f
+
+	# hop0 values are columns and hop1 values are rows, so every formula is computed at once
+	hop0 = np.arange(256).reshape(1, 256)
+	hop1 = np.arange(1, h1range).reshape(h1range - 1, 1)
+
+	# r values for positive hops and r' values for negative hops, with their limits
+	ratio_pos = np.minimum(np.power(percent_range * (255 - hop0) / hop1.astype(np.float64), 0.33333333), maximum)
+	ratio_neg = np.minimum(np.power(percent_range * hop0 / hop1.astype(np.float64), 0.33333333), maximum)
+
+	# Luminance of positive hops
+	h6 = hop1 * ratio_pos
+	h7 = h6 * ratio_pos
+	h8 = h7 * ratio_pos
+
+	# Luminance of negative hops
+	h2 = hop1 * ratio_neg
+	h1 = h2 * ratio_neg
+	h0 = h1 * ratio_neg
+
+	# Final color component, from the most negative hop (0) to the most positive hop (8).
+	# Every hop is a non negative number, so truncating it is the same as int()
+	hops = np.empty((h1range - 1, 256, 9), dtype=np.int64)
+	hops[:, :, 0] = np.maximum(hop0 - h0.astype(np.int64), 1)
+	hops[:, :, 1] = np.maximum(hop0 - h1.astype(np.int64), 1)
+	hops[:, :, 2] = np.maximum(hop0 - h2.astype(np.int64), 1)
+	hops[:, :, 3] = np.maximum(hop0 - hop1, 1)
+	hops[:, :, 4] = np.clip(hop0, 1, 255) # Null hop, zero is forbidden in "LHE advanced"
+	hops[:, :, 5] = np.minimum(hop0 + hop1, 255)
+	hops[:, :, 6] = np.minimum(hop0 + h6.astype(np.int64), 255)
+	hops[:, :, 7] = np.minimum(hop0 + h7.astype(np.int64), 255)
+	hops[:, :, 8] = np.minimum(hop0 + h8.astype(np.int64), 255)
+
+	cache = np.zeros((h1range, 256, 9), dtype=np.uint8)
+	cache[1:] = hops
+
+	return cache
+
+
+#*******************************************************************************#
+#	Function getHopsCache: This returns the hops cache for the given rmax and   #
+#	h1range. It is built only once per process; next calls get the same array. #
+#	If a .npy file is given, the cache is memory-mapped from it (or built and   #
+#	saved there if it does not exist yet), so several workers can share it.     #
+#	A .npy file has only the table, so a loaded cache is compared once with the #
+#	one built for rmax and h1range: a cache of another rmax would quantize with #
+#	other hops than the decoder uses, without any error.                        #
+#	Input: rmax, h1range, .npy file (optional)                                  #
+#	Output: cache (read-only uint8 array of h1range x 256 x 9)                  #
+#*******************************************************************************#
+
+def getHopsCache(rmax=25, h1range=20, filename=None):
+	"""Returns the (shared) hops cache for a given rmax value.
+
+	Parameters: rmax (integer, 25 means 2.5f), h1range (integer), path of a
+	.npy file where the cache is stored (string, optional).
+
+	Exceptions: This will throw ValueError if the .npy file exists but does
+	not contain the cache of this rmax and h1range.
+
+	"""
+	key = (rmax, h1range)
+
+	if key in _caches:
+		return _caches[key]
+
+	if filename is not None and os.path.exists(filename):
+		cache = np.load(filename, mmap_mode='r')
+		if cache.shape != (h1range, 256, 9) or cache.dtype != np.uint8:
+			raise ValueError("'%s' is not a hops cache for h1range %d" % (filename, h1range))
+		if not np.array_equal(cache, buildHopsCache(rmax, h1range)):
+			raise ValueError("'%s' is not the hops cache for rmax %d" % (filename, rmax))
+	else:
+		cache = buildHopsCache(rmax, h1range)
+		if filename is not None:
+			saveHopsCache(filename, cache)
+		cache.flags.writeable = False # It is shared, nobody should change it
+
+	_caches[key] = cache
+
+	return cache
+
+
+#*******************************************************************#
+#	Function saveHopsCache: This saves a hops cache in a .npy file, #
+#	so it can be memory-mapped at startup by getHopsCache.          #
+#	Input: .npy file, cache (or rmax and h1range to build it)       #
+#	Output: None, just writes the file                              #
+#*******************************************************************#
+
+def saveHopsCache(filename, cache=None, rmax=25, h1range=20):
+	"""Saves a hops cache in a .npy file.
+
+	Parameters: path of the .npy file (string), cache (uint8 array, if it is
+	not given it will be taken from getHopsCache with rmax and h1range).
+
+	Exceptions: This will throw an exception if the file can not be written.
+
+	"""
+	if cache is None:
+		cache = getHopsCache(rmax, h1range)
+
+	# We write in a temporary file first, so a worker never maps half a cache
+	tmp_filename = filename + ".tmp"
+	with open(tmp_filename, "wb") as fp:
+		np.save(fp, np.ascontiguousarray(cache, dtype=np.uint8))
+	os.rename(tmp_filename, filename)
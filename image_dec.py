@@ -6,88 +6,83 @@ This module gets and saves the decoded image, given its symbols lists.
 # LHE Codec
 # Author: Eduardo Rodes Pastor
 
+import Auxiliary.color as color
+import Auxiliary.instrument as instrument
+import kernels
 import math, struct, os
 from PIL import Image
 from array import *
+import numpy as np
 from numpy import zeros
-from example import initHopsCache
 
 # --------------#
 # IMAGE DECODER #
 # --------------#
 
 
+# Hop of every symbol given the upper hop: INVERSE_DISTRIBUTION[upper hop][symbol - 1].
+# It is the inverse of the distribution used by the encoder (binary_enc.DISTRIBUTION).
+INVERSE_DISTRIBUTION = np.array([[4, 0, 5, 3, 6, 2, 7, 1, 8], # If upper hop = 0, symbol 1 is 4, symbol 2 is 0 (up) and so on
+								 [4, 1, 5, 3, 6, 2, 7, 8, 0], # ...
+								 [4, 2, 5, 3, 6, 7, 1, 8, 0], 
+								 [4, 3, 5, 6, 2, 7, 1, 8, 0], 
+								 [4, 5, 3, 6, 2, 7, 1, 8, 0], # Distribution of hops if upper hop equals 1 or doesnt exist
+								 [4, 5, 3, 6, 2, 7, 1, 8, 0], # If upper hop = 5, we get the same list as before
+								 [4, 6, 5, 3, 2, 7, 1, 8, 0], # If upper hop = 6, symbol 1 is 4, symbol 2 is 6 (up) and so on.
+								 [4, 7, 5, 3, 6, 2, 1, 8, 0], # ...
+								 [4, 8, 5, 3, 6, 2, 7, 1, 0]], dtype=np.uint8)
+
+
 #*******************************************************************************#
-#	Function symbolsToHops: Given a list of symbols, this returns a list of the #
-#	hops they represent. We will use a list of lists called distribution which  #
-#	will work as a cache, since two symbols mean different hops based on their  #
-#	upper symbol.                                                               #
-#	Input: Symbols list, output image width, component symbols we want and      #
-#	chrminance mode                                                             #
-#	(it can be "y", "cr" or "cb"), chrominance mode and total number of pixels  #
-#	Output: List of component hops                                              #
+#	Function symbolsToHops: Given a list of symbols, this returns an array of   #
+#	the hops they represent. We will use a table called INVERSE_DISTRIBUTION,   #
+#	which works as a cache, since two symbols mean different hops based on      #
+#	their upper symbol. Every row only depends on the upper one, so we get a    #
+#	whole row of hops at once.                                                  #
+#	Input: Symbols list, image width, component (it can be "y", "cr" or "cb")   #
+#	and chrominance mode                                                        #
+#	Output: Component hops (uint8 array, as the kernels take them)              #
 #*******************************************************************************#
 
+@instrument.timed("symbolsToHops")
 def symbolsToHops(sym_list, width, component, mode): 
-	"""Transforms a symbols list into its respective hops one.
+	"""Transforms a symbols list into its respective hops (uint8 array).
 
-	Parameters: symbols list (integers from 0 to 255), width and
-	height of the image (integers), chrominance mode (integer, 
+	Parameters: symbols list or array (integers from 0 to 9), width of the
+	image (integer), component (string), chrominance mode (integer,
 	0 for 4:2:0, 1 for 4:2:2 or 2 for 4:4:4)
 
 	Exceptions: This function does not throw an exception.
 
 	"""
+	if isinstance(sym_list, np.ndarray): # As expandSymbols gives them
+		sym = sym_list.astype(np.intp)
+	else:
+		# Lists can still have 'X' symbols, which here are always 8 '1' symbols
+		sym_list = ''.join(['11111111' if e == 'X' else str(e) for e in sym_list])
+		sym = np.frombuffer(sym_list, dtype=np.uint8).astype(np.intp) - ord('0')
 
-	sym_list = ['11111111' if e == 'X' else str(e) for e in sym_list]
-	sym_list = ''.join(sym_list) # We get all the symbols in a big string
-
-	hops = [0] * len(sym_list)
-
-	distribution = [[4, 0, 5, 3, 6, 2, 7, 1, 8], # If upper hop = 0, symbol 1 is 4, symbol 2 is 0 (up) and so on
-					[4, 1, 5, 3, 6, 2, 7, 8, 0], # ...
-					[4, 2, 5, 3, 6, 7, 1, 8, 0], 
-					[4, 3, 5, 6, 2, 7, 1, 8, 0], 
-					[4, 5, 3, 6, 2, 7, 1, 8, 0], # Distribution of hops if upper hop equals 1 or doesnt exist
-					[4, 5, 3, 6, 2, 7, 1, 8, 0], # If upper hop = 5, we get the same list as before
-					[4, 6, 5, 3, 2, 7, 1, 8, 0], # If upper hop = 6, symbol 1 is 4, symbol 2 is 6 (up) and so on.						
-					[4, 7, 5, 3, 6, 2, 1, 8, 0], # ...
-					[4, 8, 5, 3, 6, 2, 7, 1, 0]]
+	n = len(sym)
+	hops = np.zeros(n, dtype=np.uint8)
+	column = (sym - 1) % 9 # Symbol 0 (no symbol) takes the last column
 
-	# Hop calculation
-	for i in range(0, len(sym_list)):
+	# If symbol is 1, hop will always be 4: that is the first column of every row of the table
 
-		# If symbol is 1, hop will always be 4.
-		if (sym_list[i] == '1'):
-			hops[i] = 4
-			continue
+	# If we are in the first row, upper symbol doesnt exist and we use distribution[4] (or [5])
+	hops[:width] = INVERSE_DISTRIBUTION[5][column[:width]]
 
-		# If we are in the first row, upper symbol doesnt exist and we use distribution[4] (or [5])
-		elif (i <= width-1):
-			hops[i] = distribution[5][int(sym_list[i])-1]
-			continue
+	for start in range(width, n, width):
+		end = min(start + width, n)
+		up = hops[start - width:end - width]
+		row_sym = sym[start:end]
 
 		# If upper symbol is not 2, we get the cache (distribution) value
-		elif (sym_list[i] != '2'):
-			hops[i] = distribution [int(hops[i-width])] [int(sym_list[i])-1]
-			continue
+		row = INVERSE_DISTRIBUTION[up, column[start:end]]
 
-		# If upper hop is not 4, we check the upper hop of it, until we get a
-		# different hop or we reach the first row
-		else:
-			if (hops[i-width] != 4):
-
-				try:
-					hops[i] = hops[i-width]
+		# If symbol is 2, hop is the upper one; if upper hop is 4, hop is always 5
+		row = np.where(row_sym == 2, np.where(up != 4, up, 5), row)
 
-				# If upper hop doesn't exist, we use distribution[4] (or [5])
-				except:
-					hops[i] = distribution[5][int(sym_list[i])-1]
-
-			# If symbol is 2 and upper symbol is 1, hop is always 5
-			else:
-				hops[i] = 5
-			continue
+		hops[start:end] = row
 
 	return hops
 
@@ -95,204 +90,435 @@ def symbolsToHops(sym_list, width, component, mode):
 #*******************************************************************************#
 #	Function hopsToYUV: This gets a specific YUV list given its hops list.      #
 #   This method is similar to GetHops in LHEquantizer, since it's its inverse   #
-#   function.                                                                   #
+#   function. Subsampled chrominance is expanded to the size of the image with  #
+#   upsampleChroma.                                                             #
 #	Input: component hops list, original color of the first pixel, width and    #
 #   height of the resulting image, component YUV we want in return.             #
 #	chrominance mode                                                            #
-#	(it can be "y", "cr" or "cb"), chrominance mode and total number of pixels  #
-#	Output: component hops []                                                   #
+#	(it can be "y", "cr" or "cb"), chrominance mode, upsampling method and      #
+#	output array (optional)                                                     #
+#	Output: component values (uint8 array with a value per pixel)               #
 #*******************************************************************************#
 
-def hopsToYUV(hops, oc, width, height, component, mode):
+@instrument.timed("hopsToYUV")
+def hopsToYUV(hops, oc, width, height, component, mode, upsampling="nearest", out=None):
 	"""Returns the y, cb and cr values (YUV) given their hops list.
 
 	Parameters: hops list (integers from 0 to 8), first value of the 
 	component we want in the first pixel (integer from 0 to 255), width and
 	height of the image (integers), component we want to get data about
 	(string), chrominance mode (integer, 0 for 4:2:0, 1 for 4:2:2 or 
-	2 for 4:4:4).
+	2 for 4:4:4), upsampling method for subsampled chrominance (string,
+	"nearest" or "bilinear"), output array (uint8 array with width * height
+	values, optional).
 
-	Exceptions: This function does not throw an exception.
+	Output: the values of every pixel (the output array if given, otherwise a
+	new uint8 array). Pixels without hop are 0.
+
+	Exceptions: This will throw an exception if the upsampling method is not
+	valid.
 
 	"""
-	# Hop1 interval: [4,10]
-	max_hop1 = 10
-	min_hop1 = 4
+	# The prediction loop is run by the current backend (see kernels.py), one value per hop
+	values = kernels.reconstruct(hops, oc, width, height, mode, component != "y")
+	if instrument.enabled:
+		instrument.count("pixels_decoded", width * height)
+
+	if out is None:
+		out = np.zeros(width * height, dtype=np.uint8)
+	plane = out.reshape(height, width) # A view, so we write in the output array
 
-	# We start in the center of the interval
-	start_hop1 = (max_hop1 + min_hop1) / 2 
-	hop1 = start_hop1
+	# Here, we will duplicate values of the chrominance lists if we are in 4:2:2 or 4:2:0, 
+	# so they will have the same length as the luminance list.
+	if (mode != 2 and component != "y"):
+		upsampleChroma(values, width, height, mode, upsampling, plane)
+	else:
+		flat = plane.reshape(-1)
+		flat[:len(values)] = values
+		flat[len(values):] = 0
 
-	hop0 = 0 # Predicted luminance signal
-	hop_number = 4 # Pre-selected hop -> 4 is null hop
-	pix = 0 # Pixel possition, from 0 to image size        
-	last_small_hop = "false" # Indicates if last hop is small. Used for h1 adaptation mechanism
-	rmax = 25 # Ratio used in LHE
+	return out 
+
+
+#*******************************************************************************#
+#	Function upsampleChroma: This expands a subsampled chrominance to the size  #
+#	of the image. The quantizer took a value every 2 pixels of the image (and   #
+#	every 2 rows in 4:2:0), so with "nearest" every value is copied to the next #
+#	pixel (and the next row), as the decoder always did. With "bilinear",       #
+#	pixels between two values of the same row (or column) get their mean.      #
+#	Everything is written directly in the output.                               #
+#	Input: chrominance values (one per hop), width and height of the image,     #
+#	chrominance mode, upsampling method and output (optional)                   #
+#	Output: chrominance plane (height x width uint8 array)                      #
+#*******************************************************************************#
 
-	npix = width * height # Total number of pixels in the image
-	result = [-1] * npix  # List where we will save the YUV component values
+@instrument.timed("upsampling")
+def upsampleChroma(values, width, height, mode, method="nearest", out=None):
+	"""Returns a subsampled chrominance expanded to the size of the image.
 
-	cache = initHopsCache()	# Initializing hops cache
+	Parameters: chrominance values (uint8 array), width and height of the
+	image (integers), chrominance mode (integer, 0 for 4:2:0 or 1 for 4:2:2),
+	upsampling method (string, "nearest" or "bilinear"), output (height x width
+	uint8 array, optional).
 
-	x = 0 # Horizontal counter
-	h = 0 # Vertical counter
+	Exceptions: This will throw an exception if the upsampling method is not
+	valid.
 
-	# If we are in mode 4:2:2 or 4:2:0, we need to check every 2 pixels, so width 
-	# is reduced to its half.
-	if (mode != 2 and component != "y"): 
-		width_adj = width/2
+	"""
+	if method not in ("nearest", "bilinear"):
+		raise ValueError("Unknown upsampling method '%s' (we have: nearest, bilinear)" % method)
+
+	if out is None:
+		out = np.empty((height, width), dtype=np.uint8)
+
+	# First we get the lines of the image the values were taken from (every
+	# line in 4:2:2, every other line in 4:2:0)
+	lines = (height + 1) // 2 if (mode == 0) else height
+	line = _upsampleLines(values, 0, 0, lines, width, method)
+
+	if (mode != 0):
+		out[:, :] = line
 	else:
-		width_adj = width # Otherwise, we go normal
-
-	while (h < height): # Output image height
-		while (x < width): # Output image width
-
-			try:
-				hop_number = hops[pix]
-			except:
-				break # This prevents unwanted exceptions when using 4:2:2 and 4:2:0
-
-			# HOP0 PREDICTION #
-			# ------------------------------------------------------------------------------ #
-
-			# If we are not in a border, we need the previous pixel and the upper-right one.
-			if (h > 0 and x > 0 and x != width - 1 and x != width):
-				hop0 = (4*result[pix-1]+3*result[pix + 1 - width_adj])/7 
-
-			# If we are in the beginning of a row, we reset Hop1
-			elif (x == 0 and h > 0):
-				hop0 = result[pix- width_adj] 
-				last_small_hop = "false" 
-				hop1 = start_hop1 
-
-			# If we are in the end of a row, we need the previous pixel and the upper one
-			elif ((x == width - 1 or x == width) and h > 0): 
-				hop0 = (4*result[pix-1]+2*result[pix- width_adj])/6 
-
-			# If we are in the first row, the hop (from 0 to 256) will be the result of the previous pixel
-			elif (h == 0 and x > 0):
-				hop0 = result[pix-1] 
-
-			# First pixel is always perfectly predicted 	
-			elif (x == 0 and h == 0):
-				hop0 = oc 
-
-			# Assignment of final value
-			result[pix] = cache[int(hop1)][int(hop0)][rmax][hop_number] # Final luminance/chrominance
-
-			# Tunning hop1 for the next hop ("h1 adaptation")
-			small_hop = "false" 
-			if (hop_number <= 5 and hop_number >= 3): 
-				small_hop = "true" # Hop 4 is in the center and is null.
-			else:
-				small_hop = "false"      
-
-			if (small_hop == "true" and last_small_hop == "true"):
-				hop1 = hop1-1 
-				if (hop1 < min_hop1):
-					hop1 = min_hop1 
-			else:
-				hop1 = max_hop1
-
-			# Let's go for the next pixel
-			last_small_hop = small_hop  
-			pix = pix + 1
-
-			# If we are in 4:2:2 or 4:2:0, we need to check every 2 pixels in a row.
-			if (mode != 2 and component != "y"): 
-				x = x + 2
-			else:
-				x = x + 1 # Otherwise, we go normal
-
-		x = 0 # This resets the horizontal counter
-
-		# If we are in 4:2:0, we need to check pixels every 2 rows.
-		if (mode == 0 and component != "y"): 
-			h = h + 2
-		else:
-			h = h + 1 # Otherwise, we go normal
+		_doubleLines(line, None, method, out)
 
-	# We give the result list a more readable format
-	for i in range(0, len(result)):
-		result[i] = int(result[i]) 
+	return out
+
+
+#*******************************************************************************#
+#	Function _upsampleLines: This gets some lines of a subsampled chrominance.  #
+#	The values are in the even pixels of the lines, one after the other, and    #
+#	odd pixels copy (or interpolate) them. Values can be a part of the whole    #
+#	list: the one before the first line is needed too, for its first pixel.     #
+#	Input: values, number of the first one, first and last line, width and      #
+#	upsampling method                                                           #
+#	Output: lines (uint8 array of lines x width)                                #
+#*******************************************************************************#
+
+def _upsampleLines(values, offset, start, stop, width, method):
+	p0 = max(start * width - 1, 0) # Pixel before the lines (as in a flat plane)
+	p1 = stop * width
+	line = np.zeros(p1 - p0, dtype=np.uint8) # Odd images have less values than pixels
+
+	first = (p0 + 1) // 2
+	last = min(offset + len(values), (p1 + 1) // 2)
+	if (last > first):
+		line[2*first - p0:2*last - p0:2] = values[first - offset:last - offset]
+
+	# Odd pixels of the plane (they are even in the line if p0 is odd)
+	odd = 1 + p0 % 2
+	if (method == "nearest"):
+		line[odd::2] = line[odd - 1::2][:len(line[odd::2])]
+	else:
+		line = line.astype(np.uint16)
+		line[odd::2] = line[odd - 1::2][:len(line[odd::2])]
+		pixels = np.arange(odd, len(line) - 1, 2)
+		pixels = pixels[((pixels + p0) % width != 0) & ((pixels + p0 + 1) % width != 0)] # Both values must be in its row
+		line[pixels] = (line[pixels - 1] + line[pixels + 1] + 1) >> 1
+
+	return line[start * width - p0:].astype(np.uint8).reshape(stop - start, width)
+
+
+#*******************************************************************************#
+#	Function _doubleLines: In 4:2:0, this copies every line in its row and the  #
+#	row below (or interpolates the row below with the next line).               #
+#	Input: lines, line after them (None if they are the last ones), upsampling  #
+#	method and output (2 rows per line, or one less for the last line)          #
+#	Output: output                                                              #
+#*******************************************************************************#
+
+def _doubleLines(line, after, method, out):
+	out[0::2] = line
+	below = out[1::2]
+	below[:, :] = line[:len(below)]
+	if (method == "bilinear"):
+		following = line[1:] if after is None else np.concatenate((line[1:], after[np.newaxis]))
+		inner = min(len(below), len(following)) # The last row has no line below
+		below[:inner] = (line[:inner].astype(np.uint16) + following[:inner] + 1) >> 1
+
+	return out
+
+
+#*******************************************************************************#
+#	Function hopsToRows: This does the same as hopsToYUV, but a band of rows at #
+#	a time, so we only keep the last row of values (and, for subsampled         #
+#	chrominance, the values of the next lines we already have).                 #
+#	Input: component hops list, original color of the first pixel, width and    #
+#	height of the image, component, chrominance mode, rows of every band and    #
+#	upsampling method                                                           #
+#	Output: generator of bands (uint8 arrays of rows x width, the last one can  #
+#	have less rows)                                                             #
+#*******************************************************************************#
+
+def hopsToRows(hops, oc, width, height, component, mode, rows, upsampling="nearest"):
+	"""Yields the values of a component given its hops list, a band of rows at a time.
+
+	Parameters: hops list (integers from 0 to 8), first value of the
+	component (integer from 0 to 255), width and height of the image
+	(integers), component (string, "y", "cb" or "cr"), chrominance mode
+	(integer, 0 for 4:2:0, 1 for 4:2:2 or 2 for 4:4:4), rows of every band
+	(integer) and upsampling method for subsampled chrominance (string,
+	"nearest" or "bilinear").
+
+	Output: generator of bands, the same rows hopsToYUV gives.
+
+	Exceptions: This will throw an exception if the upsampling method is not
+	valid.
+
+	"""
+	if upsampling not in ("nearest", "bilinear"):
+		raise ValueError("Unknown upsampling method '%s' (we have: nearest, bilinear)" % upsampling)
+
+	return rebandRows(_hopsToLines(hops, oc, width, height, component, mode, rows + rows % 2, upsampling), rows)
+
+
+def _hopsToLines(hops, oc, width, height, component, mode, rows, upsampling):
+	chroma = (component != "y")
+
+	if (mode == 2 or not chroma):
+		for h, values in zip(range(0, height, rows), kernels.reconstructRows(hops, oc, width, height, mode, chroma, rows)):
+			band = np.zeros((min(rows, height - h), width), dtype=np.uint8) # Pixels without hop are 0
+			band.reshape(-1)[:len(values)] = values
+			yield band
+		return
+
+	lines = (height + 1) // 2 if (mode == 0) else height
+	step = 2 if (mode == 0) else 1
+	values = np.zeros(0, dtype=np.uint8)
+	offset = 0 # Number of the first value we have
+	start = 0 # First line we do not have yet
+	held = None # In 4:2:0 the last line waits for the next one
+
+	for h, new in zip(range(0, height, rows), kernels.reconstructRows(hops, oc, width, height, mode, True, rows)):
+		values = np.concatenate((values, new))
+		stop = min(-(-(h + rows) // step), lines) # Every row of hops is a line
+		band = _upsampleLines(values, offset, start, stop, width, upsampling)
+
+		# We keep the values from the pixel before the next line
+		keep = max(stop * width - 1, 0) // 2
+		values = values[keep - offset:]
+		offset = keep
+		start = stop
+
+		if (mode == 1):
+			yield band
+			continue
+
+		if held is not None:
+			band = np.concatenate((held, band))
+		held = band[-1:]
+		band = band[:-1]
+		if len(band):
+			yield _doubleLines(band, held[0], upsampling, np.empty((2 * len(band), width), dtype=np.uint8))
+
+	if held is not None:
+		yield _doubleLines(held, None, upsampling, np.empty((2 - height % 2, width), dtype=np.uint8))
 
-	# Here, we will duplicate values of the chrominance lists if we are in 4:2:2 or 4:2:0, 
-	# so they will have the same length as the luminance list.
-	if (mode != 2 and component != "y"):
-		result = [x for x in result if x != -1] # We remove all non-used slots in the list
-		result = [x for x in result for _ in (0, 1)] # We duplicate every element, so we get the same chrominance in 2 consecutive elements.
-		
-		if (mode == 0):
-			i = 0 # Reseting i
-			len_res = 2*len(result) # Remember len(result) is half the value of the luminance list length
 
-			# This whole bucle copies every line of values in the image to the row below, so we get a 4:2:0 mode.
-			while (i < len_res):
+#*******************************************************************************#
+#	Function rebandRows: This joins and splits some bands of rows, so every    #
+#	has the same number of rows (but the last one).                             #
+#	Input: bands (iterable of arrays with rows in the first dimension) and rows #
+#	Output: generator of bands                                                  #
+#*******************************************************************************#
+
+def rebandRows(bands, rows):
+	"""Yields the same rows of some bands, rows rows at a time.
+
+	Parameters: bands (iterable of arrays with rows in the first dimension)
+	and rows of every band (integer).
 
-				# We get a new line
-				result_width = result[i:i+width] 
-				i = i + width
+	Exceptions: This function does not throw an exception.
 
-				# We insert that lane in a new one below the original
-				for j in range(0, width): 
-					result.insert(i, result_width[j])
-					i = i + 1
+	"""
+	pending = []
+	count = 0
+	for band in bands:
+		pending.append(band)
+		count += len(band)
+		while (count >= rows):
+			joined = pending[0] if len(pending) == 1 else np.concatenate(pending)
+			yield joined[:rows]
+			pending = [joined[rows:]]
+			count -= rows
 
-	return result 
+	if (count > 0):
+		yield pending[0] if len(pending) == 1 else np.concatenate(pending)
 
 
 #*******************************************************************#
 #	Function YUVtoRGB: This converts three YUV lists (y, cb, cr)    #
-#	in a tuple of their equivalent RGB lists.                       #
+#	in an interleaved RGB array (one r, g, b row per pixel).        #
 #	Input: y [], cb [], cr []                                       #
-#	Output: rgb [] (tuple of r, g, b)                               #
+#	Output: rgb (uint8 array of npix x 3)                           #
 #*******************************************************************#
 
 def YUVtoRGB(y, cb, cr):
 	"""Gets the RGB values from the YUV ones.
 
-	Parameters: y, cb and cr (YUV lists, integers from 0 to 255).
+	Parameters: y, cb and cr (YUV lists or arrays, integers from 0 to 255).
 
 	Exceptions: This function does not throw an exception.
 
 	"""
-	# All of these have the same length
-	r = [0] * len(y)
-	g = [0] * len(y)
-	b = [0] * len(y)
-	result = [0] * len(y)
-
-	# This is just the formula to get RGB from YUV
-	for i in range(0, len(y)):
-		r[i] = int(y[i] + 1.4075 * (cr[i]-128))
-		g[i] = int(y[i] - .3455 * (cb[i]-128) - .7169 * (cr[i]-128))
-		b[i] = int(y[i] + 1.779 * (cb[i]-128))
-		result[i] = (r[i], g[i], b[i]) # We need this for saving the image
+	# We need an interleaved buffer for saving the image, so the converter writes there directly
+	result = np.empty((len(y), 3), dtype=np.uint8)
+
+	# This is just the formula to get RGB from YUV, computed on whole planes and clipped to 0..255
+	color.YUVtoRGB(y, cb, cr, out=(result[:, 0], result[:, 1], result[:, 2]))
 
 	return result
 
 
+# Formats we can save decoded images in. BMP and PNG are saved by PIL, YUV
+# are the raw y, cb and cr planes (width x height bytes each, one after the other)
+OUTPUT_FORMATS = ("BMP", "PNG", "YUV")
+DEFAULT_OUTPUT = "output_img/output-image.bmp"
+
+
+#*******************************************************************#
+#	Function getOutputFormat: This gets the format an image will be #
+#	saved in. If it is not given, we use the extension of the file  #
+#	(BMP when there is no extension)                                #
+#	Input: output (path or file-like object), format (optional)     #
+#	Output: format (one of OUTPUT_FORMATS)                          #
+#*******************************************************************#
+
+def getOutputFormat(output, fmt=None):
+	"""Returns the format of an output image.
+
+	Parameters: output (path or file-like object), format (string, optional).
+
+	Exceptions: This will throw an exception if the format is not supported.
+
+	"""
+	if fmt is None:
+		name = output if isinstance(output, basestring) else getattr(output, "name", "")
+		fmt = os.path.splitext(name)[1][1:] or "BMP"
+
+	fmt = fmt.upper()
+	if fmt not in OUTPUT_FORMATS:
+		raise ValueError("Unknown output format '%s' (we have: %s)" % (fmt, ", ".join(OUTPUT_FORMATS)))
+
+	return fmt
+
+
+#*******************************************************************#
+#	Function RGBtoImage: This gets a PIL image from the interleaved #
+#	RGB values, using its buffer directly when it is an array       #
+#	Input: rgb (npix x 3), size                                     #
+#	Output: PIL image                                               #
+#*******************************************************************#
+
+def RGBtoImage(rgb, size):
+	"""Returns a PIL image given its RGB values.
+
+	Parameters: RGB values (uint8 array of npix x 3 or list of (r, g, b)
+	tuples with values from 0 to 255), size of the image (tuple).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	if isinstance(rgb, np.ndarray):
+		return Image.frombuffer('RGB', size, np.ascontiguousarray(rgb, dtype=np.uint8), 'raw', 'RGB', 0, 1)
+
+	im = Image.new('RGB', size) 
+	im.putdata(rgb)
+
+	return im
+
+
+#*******************************************************************#
+#	Function YUVtoImage: This gets a PIL image in YCbCr mode from   #
+#	the y, cb and cr planes, so we do not compute RGB values        #
+#	Input: y, cb, cr (uint8 arrays), size                           #
+#	Output: PIL image                                               #
+#*******************************************************************#
+
+def YUVtoImage(y, cb, cr, size):
+	"""Returns a YCbCr PIL image given its YUV planes.
+
+	Parameters: y, cb and cr planes (uint8 arrays with width * height values),
+	size of the image (tuple).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	planes = [Image.frombuffer('L', size, np.ascontiguousarray(plane, dtype=np.uint8), 'raw', 'L', 0, 1) for plane in (y, cb, cr)]
+
+	return Image.merge('YCbCr', planes)
+
+
+#*******************************************************************#
+#	Function saveImage: This saves the decoded image given its YUV  #
+#	planes, in a file or in any file-like object (a buffer for an   #
+#	HTTP response, for example)                                     #
+#	Input: y, cb, cr, size, output, format and True if PIL must     #
+#	convert YCbCr to RGB                                            #
+#	Output: None, just saves the image                              #
+#*******************************************************************#
+
+@instrument.timed("saveImage")
+def saveImage(y, cb, cr, size, output=DEFAULT_OUTPUT, fmt=None, ycbcr=False):
+	"""Saves the decoded image given its YUV planes.
+
+	Parameters: y, cb and cr planes (uint8 arrays with width * height values),
+	size of the image (tuple), output (path or file-like object, the default
+	one of the example if not given), format (string, one of OUTPUT_FORMATS;
+	the extension of the file by default), True if the image must be a YCbCr
+	PIL image converted by PIL instead of using our YUV to RGB formula.
+
+	Exceptions: This will throw an exception if the format is not supported
+	or the output can not be written.
+
+	"""
+	fmt = getOutputFormat(output, fmt)
+	y, cb, cr = [np.ascontiguousarray(plane, dtype=np.uint8).reshape(-1) for plane in (y, cb, cr)]
+
+	if (fmt != "YUV"):
+		if ycbcr:
+			im = YUVtoImage(y, cb, cr, size).convert('RGB') # BMP and PNG can not save YCbCr
+		else:
+			im = RGBtoImage(YUVtoRGB(y, cb, cr), size)
+		im.save(output, fmt)
+		return
+
+	# Raw planes are written as they are, without any conversion
+	if hasattr(output, "write"):
+		f = output
+	else:
+		f = open(output, "wb")
+	try:
+		for plane in (y, cb, cr):
+			f.write(plane.data)
+	finally:
+		if f is not output:
+			f.close()
+
+
 #*******************************************************************#
 #	Function RGBtoBMP: This gets and saves an image in .bmp format  #
-#	based on the three lists RGB given                              #
-#	Input: r [], g [], b []                                         #
-#	Output: None, just saves the image in the output_lhe/images     #
-#	subfolder                                                       #
+#	(or .png) based on the interleaved RGB array given              #
+#	Input: rgb (npix x 3), size, output and format                  #
+#	Output: None, just saves the image (output_img/output-image.bmp #
+#	by default)                                                     #
 #*******************************************************************#
 
-def RGBtoBMP(rgb, size):
+def RGBtoBMP(rgb, size, output=DEFAULT_OUTPUT, fmt=None):
 	"""Saves the new image in the specified subfolder given its RGB values.
 
-	Parameters: R, G and B values (integer lists with values from 0 to 255),
-	size of the image (integer)
+	Parameters: RGB values (uint8 array of npix x 3 or list of (r, g, b)
+	tuples with values from 0 to 255), size of the image (tuple), output
+	(path or file-like object, output_img/output-image.bmp by default),
+	format (string, BMP or PNG; the extension of the file by default).
 
 	Exceptions: This function will throw an exception if the specified folder
-	does not exist.
+	does not exist, or if the format is not supported (raw YUV needs the
+	planes, see saveImage).
 
 	"""
-	# New image with our rgb values
-	im = Image.new('RGB', size) 
-	im.putdata(rgb)
+	fmt = getOutputFormat(output, fmt)
+	if (fmt == "YUV"):
+		raise ValueError("Raw YUV is saved from the YUV planes, use saveImage")
 
-	# We save it as output-image.bmp
-	im.save("output_img/output-image.bmp", 'BMP')
\ No newline at end of file
+	# New image with our rgb values, saved as output-image.bmp if we are not told otherwise
+	RGBtoImage(rgb, size).save(output, fmt)
@@ -0,0 +1,531 @@
+"""
+
+This module contains the per pixel LHE loops as kernels (quantizer, decoder and
+range coder), and chooses the backend used to run them: compiled with Numba if
+it is installed, or pure Python.
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import os
+import numpy as np
+from hops_cache import getHopsCache
+from Auxiliary.rangecoder import rangeEncodeKernel, rangeDecodeKernel, CONTEXTS, TREE_SIZE, PROB_INIT
+
+# --------------#
+# LHE KERNELS   #
+# --------------#
+
+# Hop1 interval: [4,10]
+MAX_HOP1 = 10
+MIN_HOP1 = 4
+START_HOP1 = (MAX_HOP1 + MIN_HOP1) // 2 # We start in the center of the interval
+RMAX = 25 # Ratio used in LHE
+
+
+#*******************************************************************************#
+#	Function quantizeKernel: This is the getHops loop. It only uses integers    #
+#	and indexing, so the same code runs on Python lists (pure Python backend)   #
+#	or is compiled by Numba over uint8 arrays. It walks the image exactly as    #
+#	getHops always did (every 2 pixels and/or every 2 rows for subsampled       #
+#	chrominance), so hops and results are the same.                             #
+#	The hops cache is flat: cache[(hop1 * 256 + hop0) * 9 + hop]. In the Numba  #
+#	backend it is widened to int32, so we never subtract two unsigned values.   #
+#	Input: original component (flat), flat cache, output hops and results,      #
+#	image width and height, width of a row of hops, subsampled flag, 4:2:0 flag #
+#	Output: number of hops written                                              #
+#*******************************************************************************#
+
+def quantizeKernel(plane, cache, hops, result, img_width, img_height, width, subsampled, mode_420):
+	n_in = len(plane)
+	n_out = len(hops)
+
+	hop1 = START_HOP1
+	hop0 = 0 # Predicted luminance signal
+	hop_number = 4 # Pre-selected hop -> 4 is null hop
+	last_small_hop = False # Indicates if last hop is small. Used for h1 adaptation mechanism
+
+	pix = 0 # Pixel position in the hops list
+	k = 0 # Original color counter
+	h = 0 # Vertical counter
+
+	while (h < img_height):
+		x = 0 # Horizontal counter
+		while (x < img_width):
+
+			# Images with an odd number of pixels run out of chrominance before the end, and
+			# subsampled chrominance of odd images gives more hops than expected: we stop there,
+			# before the prediction reads values out of the hops (none at all if a row has 0 hops)
+			if (k >= n_in or pix >= n_out):
+				return pix
+			oc = plane[k]
+
+			# HOP0 PREDICTION #
+			if (h > 0 and x > 0 and x != img_width - 1 and x != img_width):
+				hop0 = (4*result[pix - 1] + 3*result[pix + 1 - width]) // 7
+			elif (x == 0 and h > 0):
+				hop0 = result[pix - width]
+				last_small_hop = False
+				hop1 = START_HOP1
+			elif ((x == img_width - 1 or x == img_width) and h > 0):
+				hop0 = (4*result[pix - 1] + 2*result[pix - width]) // 6
+			elif (h == 0 and x > 0):
+				hop0 = result[pix - 1]
+			else:
+				hop0 = oc # First pixel is always perfectly predicted
+
+			# HOPS COMPUTATION #
+			base = (hop1*256 + hop0) * 9
+			emin = 256 # Current minimum prediction error
+			finbuc = False
+
+			if (oc - hop0 >= 0):
+				for j in range(4, 9):
+					e2 = oc - cache[base + j]
+					if (e2 < 0):
+						e2 = - e2
+						finbuc = True
+					if (e2 < emin):
+						hop_number = j
+						emin = e2
+						if (finbuc):
+							break
+					else:
+						break
+			else:
+				for j in range(4, -1, -1):
+					e2 = cache[base + j] - oc
+					if (e2 < 0):
+						e2 = - e2
+						finbuc = True
+					if (e2 < emin):
+						hop_number = j
+						emin = e2
+						if (finbuc):
+							break
+					else:
+						break
+
+			result[pix] = cache[base + hop_number]
+			hops[pix] = hop_number
+
+			# H1 adaptation
+			small_hop = (hop_number <= 5 and hop_number >= 3)
+			if (small_hop and last_small_hop):
+				hop1 = hop1 - 1
+				if (hop1 < MIN_HOP1):
+					hop1 = MIN_HOP1
+			else:
+				hop1 = MAX_HOP1
+
+			last_small_hop = small_hop
+			pix = pix + 1
+
+			if (subsampled):
+				x = x + 2 # We check every 2 pixels
+				if (mode_420 and (x == img_width or x == img_width - 1)):
+					k = k + img_width + 2 # In 4:2:0 we also skip every other row
+				else:
+					k = k + 2
+			else:
+				x = x + 1
+				k = k + 1
+
+		if (mode_420 and subsampled):
+			h = h + 2
+		else:
+			h = h + 1
+
+	return pix
+
+
+#*******************************************************************************#
+#	Function reconstructKernel: This is the hopsToYUV loop, the inverse of      #
+#	quantizeKernel: the same prediction and hop1 adaptation, but the value of   #
+#	every pixel comes from its hop instead of the original color. It writes     #
+#	one value per hop (subsampled chrominance is not expanded here).            #
+#	Rows can be decoded a few at a time: hop1 starts again in every row, so we  #
+#	only need the values of the previous row, which are the first ones of the   #
+#	output (the value of hop pix is result[pix - base]).                        #
+#	Input: hops, flat cache (as in quantizeKernel), output values, first value  #
+#	of the component, image width, width of a row of hops, whether we check     #
+#	every 2 pixels of a row and every 2 rows, first and last row, first hop and #
+#	hop of the first value of the output                                        #
+#	Output: position of the next hop                                            #
+#*******************************************************************************#
+
+def reconstructKernel(hops, cache, result, oc, img_width, width, subsampled, mode_420, h, h_end, pix, base):
+	n_hops = len(hops)
+
+	hop1 = START_HOP1
+	hop0 = 0 # Predicted luminance signal
+	last_small_hop = False # Indicates if last hop is small. Used for h1 adaptation mechanism
+
+	# pix is the pixel position in the hops list and h the vertical counter
+
+	while (h < h_end):
+		x = 0 # Horizontal counter
+		while (x < img_width):
+
+			# 4:2:2 and 4:2:0 run out of hops before the end of the image
+			if (pix >= n_hops):
+				return pix
+			hop_number = hops[pix]
+
+			# HOP0 PREDICTION #
+			if (h > 0 and x > 0 and x != img_width - 1 and x != img_width):
+				hop0 = (4*result[pix - 1 - base] + 3*result[pix + 1 - width - base]) // 7
+			elif (x == 0 and h > 0):
+				hop0 = result[pix - width - base]
+				last_small_hop = False
+				hop1 = START_HOP1
+			elif ((x == img_width - 1 or x == img_width) and h > 0):
+				hop0 = (4*result[pix - 1 - base] + 2*result[pix - width - base]) // 6
+			elif (h == 0 and x > 0):
+				hop0 = result[pix - 1 - base]
+			else:
+				hop0 = oc # First pixel is always perfectly predicted
+
+			# Assignment of final value
+			result[pix - base] = cache[(hop1*256 + hop0) * 9 + hop_number]
+
+			# H1 adaptation
+			small_hop = (hop_number <= 5 and hop_number >= 3)
+			if (small_hop and last_small_hop):
+				hop1 = hop1 - 1
+				if (hop1 < MIN_HOP1):
+					hop1 = MIN_HOP1
+			else:
+				hop1 = MAX_HOP1
+
+			last_small_hop = small_hop
+			pix = pix + 1
+
+			if (subsampled):
+				x = x + 2 # We check every 2 pixels
+			else:
+				x = x + 1
+
+		if (mode_420 and subsampled):
+			h = h + 2
+		else:
+			h = h + 1
+
+	return pix
+
+
+# ---------#
+# BACKENDS #
+# ---------#
+
+# Flat caches, memoized per backend
+_flat_caches = {}
+
+
+def _pythonCache():
+	if "python" not in _flat_caches:
+		_flat_caches["python"] = getHopsCache(RMAX).ravel().tolist()
+	return _flat_caches["python"]
+
+
+def _numbaCache():
+	if "numba" not in _flat_caches:
+		_flat_caches["numba"] = getHopsCache(RMAX).ravel().astype(np.int32)
+	return _flat_caches["numba"]
+
+
+def _quantizePython(plane, n_out, img_width, img_height, width, subsampled, mode_420):
+	if not isinstance(plane, list):
+		plane = np.asarray(plane).ravel().tolist()
+	# Results start as 0, as in the Numba backend and the decoder: a row of 0 hops (1 pixel
+	# wide subsampled chrominance) predicts from the slot of the hop itself
+	hops = [-1] * n_out
+	result = [0] * n_out
+	count = quantizeKernel(plane, _pythonCache(), hops, result, img_width, img_height, width, subsampled, mode_420)
+	return hops, result, count
+
+
+def _quantizeNumba(plane, n_out, img_width, img_height, width, subsampled, mode_420):
+	plane = np.ascontiguousarray(plane, dtype=np.uint8).ravel()
+	hops = np.zeros(n_out, dtype=np.uint8)
+	result = np.zeros(n_out, dtype=np.uint8)
+	count = _compiled["quantize"](plane, _numbaCache(), hops, result, img_width, img_height, width, subsampled, mode_420)
+	return hops, result, count
+
+
+# Worst case of the range coder: 4 decisions of at most 7 bits each per hop
+def _rangeSize(n):
+	return 4 * n + 16
+
+
+def _rangeEncodePython(hops, width, plane_size):
+	if not isinstance(hops, list):
+		hops = np.asarray(hops).ravel().tolist()
+	out = [0] * _rangeSize(len(hops))
+	size = rangeEncodeKernel(hops, len(hops), width, plane_size, [PROB_INIT] * (CONTEXTS * TREE_SIZE), out)
+	return str(bytearray(out[:size]))
+
+
+def _rangeDecodePython(data, n, width, plane_size):
+	hops = [0] * n
+	rangeDecodeKernel(bytearray(data), n, width, plane_size, [PROB_INIT] * (CONTEXTS * TREE_SIZE), hops)
+	return hops
+
+
+def _rangeEncodeNumba(hops, width, plane_size):
+	hops = np.ascontiguousarray(hops, dtype=np.uint8).ravel()
+	out = np.zeros(_rangeSize(len(hops)), dtype=np.uint8)
+	probs = np.empty(CONTEXTS * TREE_SIZE, dtype=np.int32)
+	probs.fill(PROB_INIT)
+	size = _compiled["rangeEncode"](hops, len(hops), width, plane_size, probs, out)
+	return out[:size].tostring()
+
+
+def _rangeDecodeNumba(data, n, width, plane_size):
+	hops = np.zeros(n, dtype=np.uint8)
+	probs = np.empty(CONTEXTS * TREE_SIZE, dtype=np.int32)
+	probs.fill(PROB_INIT)
+	_compiled["rangeDecode"](np.frombuffer(data, dtype=np.uint8), n, width, plane_size, probs, hops)
+	return hops
+
+
+def _hopsList(hops):
+	if not isinstance(hops, list):
+		hops = np.asarray(hops).ravel().tolist()
+	return hops
+
+
+def _hopsArray(hops):
+	return np.ascontiguousarray(hops, dtype=np.uint8).ravel()
+
+
+# prev are the last values before hop pix, and n the most values we can get
+def _reconstructPython(hops, oc, img_width, width, subsampled, mode_420, h, h_end, pix, prev, n):
+	hops = _hopsList(hops)
+	result = list(prev) + [0] * n
+	count = reconstructKernel(hops, _pythonCache(), result, oc, img_width, width, subsampled, mode_420, h, h_end, pix, pix - len(prev))
+	return np.array(result[len(prev):count - pix + len(prev)], dtype=np.uint8)
+
+
+def _reconstructNumba(hops, oc, img_width, width, subsampled, mode_420, h, h_end, pix, prev, n):
+	hops = _hopsArray(hops)
+	result = np.zeros(len(prev) + n, dtype=np.uint8)
+	result[:len(prev)] = prev
+	count = _compiled["reconstruct"](hops, _numbaCache(), result, oc, img_width, width, subsampled, mode_420, h, h_end, pix, pix - len(prev))
+	return result[len(prev):count - pix + len(prev)]
+
+
+_backends = {"python": {"quantize": _quantizePython, "reconstruct": _reconstructPython, "hops": _hopsList,
+						"rangeEncode": _rangeEncodePython, "rangeDecode": _rangeDecodePython}}
+_compiled = {}
+
+try:
+	import numba
+	_compiled["quantize"] = numba.njit(nogil=True, cache=True)(quantizeKernel)
+	_compiled["reconstruct"] = numba.njit(nogil=True, cache=True)(reconstructKernel)
+	_compiled["rangeEncode"] = numba.njit(nogil=True, cache=True)(rangeEncodeKernel)
+	_compiled["rangeDecode"] = numba.njit(nogil=True, cache=True)(rangeDecodeKernel)
+	_backends["numba"] = {"quantize": _quantizeNumba, "reconstruct": _reconstructNumba, "hops": _hopsArray,
+						  "rangeEncode": _rangeEncodeNumba, "rangeDecode": _rangeDecodeNumba}
+except ImportError:
+	pass
+
+# Default backend: the one chosen with LHE_BACKEND, or the fastest we have
+_backend = os.environ.get("LHE_BACKEND") or ("numba" if "numba" in _backends else "python")
+
+
+#*******************************************************************#
+#	Function setBackend: This chooses the backend for the kernels.  #
+#	Input: backend name ("python" or "numba")                       #
+#	Output: None                                                    #
+#*******************************************************************#
+
+def setBackend(name):
+	"""Chooses the backend used by the LHE kernels.
+
+	Parameters: backend name (string, "python" or "numba").
+
+	Exceptions: This will throw an exception if the backend is not available.
+
+	"""
+	global _backend
+	if name not in _backends:
+		raise ValueError("LHE backend '%s' is not available (we have: %s)" % (name, ", ".join(sorted(_backends))))
+	_backend = name
+
+
+def getBackend():
+	"""Returns the name of the backend used by the LHE kernels."""
+	return _backend
+
+
+def availableBackends():
+	"""Returns the names of the available backends."""
+	return sorted(_backends)
+
+
+#*******************************************************************************#
+#	Function quantize: This gets the hops and the predicted values of a color   #
+#	component, using the current backend.                                       #
+#	Input: component (flat list or array of the whole image), image width and   #
+#	height, chrominance mode and whether the component is a chrominance         #
+#	Output: hops, result (lists or uint8 arrays, depending on the backend) and  #
+#	number of hops written                                                      #
+#*******************************************************************************#
+
+def quantize(plane, img_width, img_height, mode, chroma):
+	"""Returns the hops, the predicted values and the number of hops of a component.
+
+	Parameters: component values (list or array with values from 0 to 255),
+	width and height of the image (integers), chrominance mode (integer, 0 for
+	4:2:0, 1 for 4:2:2 or 2 for 4:4:4), True if the component is cb or cr.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	subsampled = (mode != 2 and chroma)
+	n_out, width = planeSize(img_width, img_height, mode, chroma)
+
+	return _backends[_backend]["quantize"](plane, n_out, img_width, img_height, width, subsampled, mode == 0)
+
+
+#*******************************************************************************#
+#	Function reconstruct: This gets the values of a color component given its   #
+#	hops, using the current backend. Subsampled chrominance is not expanded.    #
+#	Input: hops, first value of the component, image width and height,         #
+#	chrominance mode and whether the component is a chrominance                 #
+#	Output: values (uint8 array, one per hop)                                   #
+#*******************************************************************************#
+
+def reconstruct(hops, oc, img_width, img_height, mode, chroma):
+	"""Returns the values of a component given its hops, one per hop.
+
+	Parameters: hops (list or array of integers from 0 to 8), value of the
+	first pixel (integer from 0 to 255), width and height of the image
+	(integers), chrominance mode (integer, 0 for 4:2:0, 1 for 4:2:2 or 2 for
+	4:4:4), True if the component is cb or cr.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	subsampled = (mode != 2 and chroma)
+	n_out, width = planeSize(img_width, img_height, mode, chroma)
+
+	return _backends[_backend]["reconstruct"](hops, oc, img_width, width, subsampled, mode == 0, 0, img_height, 0, [], len(hops))
+
+
+#*******************************************************************************#
+#	Function reconstructRows: This gets the values of a color component given   #
+#	its hops, a few rows at a time. Only the values of the last row are kept    #
+#	between them, since they are all the prediction needs.                      #
+#	Input: hops, first value of the component, image width and height,         #
+#	chrominance mode, whether the component is a chrominance and number of rows #
+#	of the image every time (even in 4:2:0)                                     #
+#	Output: generator of values (uint8 arrays, one per hop of those rows)       #
+#*******************************************************************************#
+
+def reconstructRows(hops, oc, img_width, img_height, mode, chroma, rows):
+	"""Yields the values of a component given its hops, rows rows at a time.
+
+	Parameters: hops (list or array of integers from 0 to 8), value of the
+	first pixel (integer from 0 to 255), width and height of the image
+	(integers), chrominance mode (integer, 0 for 4:2:0, 1 for 4:2:2 or 2 for
+	4:4:4), True if the component is cb or cr, rows of the image every time
+	(integer, even in 4:2:0 for the chrominance).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	subsampled = (mode != 2 and chroma)
+	n_out, width = planeSize(img_width, img_height, mode, chroma)
+	backend = _backends[_backend]
+
+	hops = backend["hops"](hops) # Only once, not for every row
+	row_hops = (img_width + 1) // 2 if subsampled else img_width # Hops of a row of the image (at most)
+	step = 2 if (subsampled and mode == 0) else 1
+
+	prev = np.zeros(0, dtype=np.uint8)
+	pix = 0
+	for h in range(0, img_height, rows):
+		h_end = min(h + rows, img_height)
+		n = min(len(hops) - pix, -(-(h_end - h) // step) * row_hops)
+		values = backend["reconstruct"](hops, oc, img_width, width, subsampled, mode == 0, h, h_end, pix, prev, n)
+		pix += len(values)
+		prev = np.concatenate((prev, values))[-width:]
+		yield values
+
+
+#*******************************************************************************#
+#	Function planeSize: This gets the number of hops of a color component and   #
+#	the width of a row of them.                                                 #
+#	Input: image width and height, chrominance mode and whether the component   #
+#	is a chrominance                                                            #
+#	Output: number of hops, width of a row of hops                              #
+#*******************************************************************************#
+
+def planeSize(img_width, img_height, mode, chroma):
+	"""Returns the number of hops of a component and the width of a row of them.
+
+	Parameters: width and height of the image (integers), chrominance mode
+	(integer, 0 for 4:2:0, 1 for 4:2:2 or 2 for 4:4:4), True if the component
+	is cb or cr.
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	npix = img_width * img_height
+	subsampled = (mode != 2 and chroma)
+
+	# Depending on the mode, we get 1 chrominance for 4 (4:2:0) or 2 (4:2:2) values
+	if (subsampled and mode == 0):
+		n_out = npix // 4
+	elif (subsampled):
+		n_out = npix // 2
+	else:
+		n_out = npix
+
+	# In 4:2:2 and 4:2:0 every row of chrominance hops is half of the image width
+	width = img_width // 2 if subsampled else img_width
+
+	return n_out, width
+
+
+#*******************************************************************************#
+#	Function rangeEncode: This codifies hops with the adaptive range coder      #
+#	(Auxiliary/rangecoder.py), using the current backend.                       #
+#	Input: hops of one or more planes of the same size, one after the other,    #
+#	width of a row of hops, number of hops of each plane                        #
+#	Output: codified hops (string)                                              #
+#*******************************************************************************#
+
+def rangeEncode(hops, width, plane_size):
+	"""Returns the range codified bytes of some hops.
+
+	Parameters: hops (list or array of integers from 0 to 8) of one or more
+	planes, width of a row of hops and number of hops of every plane (integers).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	return _backends[_backend]["rangeEncode"](hops, width, plane_size)
+
+
+#*******************************************************************************#
+#	Function rangeDecode: This decodes hops codified with rangeEncode.          #
+#	Input: codified hops, number of hops, width of a row of hops, number of     #
+#	hops of each plane                                                          #
+#	Output: hops (list or uint8 array, depending on the backend)                #
+#*******************************************************************************#
+
+def rangeDecode(data, n, width, plane_size):
+	"""Returns the hops of some range codified bytes.
+
+	Parameters: codified hops (string), number of hops, width of a row of
+	hops and number of hops of every plane (integers).
+
+	Exceptions: This function does not throw an exception; damaged data
+	gives wrong hops.
+
+	"""
+	return _backends[_backend]["rangeDecode"](data, n, width, plane_size)
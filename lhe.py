@@ -0,0 +1,135 @@
+"""
+
+Command line of the codec, for encoding many images without asking anything
+and measuring their quality.
+
+Usage: python lhe.py encode input_img/ [more images, folders or manifests] --jobs 8
+       python lhe.py quality input_img/lena.bmp output_lhe/lena.lhe [more pairs]
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import argparse
+import json
+import os
+import sys
+import time
+from batch import BatchEncoder, readManifest
+from stream import compareImageFile
+from binary_enc import ENTROPY_HUFFMAN, ENTROPY_RANGE
+
+# -------------#
+# LHE COMMANDS #
+# -------------#
+
+MODES = {"420": 0, "422": 1, "444": 2}
+
+
+#*******************************************************************************#
+#	Function encodeCommand: This encodes every image of the arguments with a    #
+#	BatchEncoder and prints a line for every image, as soon as it is encoded.   #
+#	Input: parsed arguments                                                     #
+#	Output: exit status (0 if every image was encoded, 1 otherwise)             #
+#*******************************************************************************#
+
+def encodeCommand(args):
+	if args.output is not None and not os.path.isdir(args.output):
+		os.makedirs(args.output)
+
+	entropy = ENTROPY_RANGE if args.range else ENTROPY_HUFFMAN
+	blocks_x, blocks_y = [int(n) for n in args.blocks.split("x")]
+
+	images = failed = pixels = size = 0
+	start = time.time()
+
+	with BatchEncoder(args.jobs, MODES[args.mode], blocks_x, blocks_y, entropy, args.queue, args.backend, args.cache) as encoder:
+		for result in encoder.encode(readManifest(args.inputs, args.output)):
+			images += 1
+			if result.error is not None:
+				failed += 1
+			else:
+				pixels += result.pixels
+				size += result.size
+
+			if args.json:
+				print json.dumps(result._asdict())
+			elif result.error is not None:
+				print "FAILED %s: %s" % (result.input, result.error)
+			else:
+				print "ok     %s -> %s  %d bytes  %.3f bpp  %.1f ms" % (result.input, result.output, result.size,
+																		8.0 * result.size / result.pixels, 1000 * result.seconds)
+			sys.stdout.flush()
+
+	elapsed = time.time() - start
+	sys.stderr.write("%d images (%d failed) in %.1f s: %.1f images/s, %.2f Mpix/s, %.3f bpp\n" % (
+		images, failed, elapsed, images / elapsed, pixels / 1e6 / elapsed, 8.0 * size / pixels if pixels else 0))
+
+	return 1 if failed else 0
+
+
+#*******************************************************************************#
+#	Function qualityCommand: This measures every .lhe file of the arguments     #
+#	against its image (see stream.compareImageFile), band by band, and prints   #
+#	a line for every one.                                                       #
+#	Input: parsed arguments                                                     #
+#	Output: exit status (0 if every file was measured, 1 otherwise)             #
+#*******************************************************************************#
+
+def qualityCommand(args):
+	if len(args.files) % 2:
+		sys.stderr.write("Files must be pairs of an image and its .lhe file\n")
+		return 2
+
+	failed = 0
+	for image, lhe_file in zip(args.files[0::2], args.files[1::2]):
+		try:
+			quality = compareImageFile(image, lhe_file, args.rows, args.upsampling, not args.no_ssim)
+		except Exception as e:
+			failed += 1
+			print "FAILED %s %s: %s: %s" % (image, lhe_file, type(e).__name__, e)
+			continue
+
+		if args.json:
+			print json.dumps(dict(quality._asdict(), image=image, lhe_file=lhe_file))
+		else:
+			line = "%s  PSNR %.2f dB  Y %.2f  Cb %.2f  Cr %.2f dB" % (lhe_file, quality.psnr, quality.psnr_y, quality.psnr_cb, quality.psnr_cr)
+			if quality.ssim_y is not None:
+				line += "  SSIM Y %.4f  Cb %.4f  Cr %.4f" % (quality.ssim_y, quality.ssim_cb, quality.ssim_cr)
+			print line
+		sys.stdout.flush()
+
+	return 1 if failed else 0
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="lhe", description="LHE image codec")
+	commands = parser.add_subparsers(dest="command")
+
+	encode = commands.add_parser("encode", help="encode images, folders of images or manifests (.txt, an image and optionally its .lhe file per line)")
+	encode.add_argument("inputs", nargs="+", help="images, folders or manifest files")
+	encode.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (all the CPUs by default)")
+	encode.add_argument("-m", "--mode", choices=sorted(MODES), default="420", help="chrominance mode (420 by default)")
+	encode.add_argument("-o", "--output", default=None, help="folder for the .lhe files (next to every image by default)")
+	encode.add_argument("--range", action="store_true", help="use the range coder instead of Huffman")
+	encode.add_argument("--blocks", default="1x1", help="blocks in a row and in a column, as 4x4 (1x1 by default)")
+	encode.add_argument("--queue", type=int, default=None, help="most images waiting for a worker (2 per worker by default)")
+	encode.add_argument("--backend", default=None, help="kernels backend (python or numba)")
+	encode.add_argument("--cache", default=None, help=".npy file of the hops cache, shared by every worker")
+	encode.add_argument("--json", action="store_true", help="print a JSON line for every image")
+	encode.set_defaults(function=encodeCommand)
+
+	quality = commands.add_parser("quality", help="measure PSNR, MSE and SSIM of .lhe files against their images")
+	quality.add_argument("files", nargs="+", help="pairs of an image and its .lhe file")
+	quality.add_argument("--rows", type=int, default=64, help="rows decoded and measured at a time (64 by default)")
+	quality.add_argument("--upsampling", choices=("nearest", "bilinear"), default="nearest", help="chrominance upsampling (nearest by default)")
+	quality.add_argument("--no-ssim", action="store_true", help="do not compute the SSIM (faster)")
+	quality.add_argument("--json", action="store_true", help="print a JSON line for every file")
+	quality.set_defaults(function=qualityCommand)
+
+	args = parser.parse_args(argv)
+	return args.function(args)
+
+
+if __name__ == '__main__':
+	sys.exit(main())
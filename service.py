@@ -0,0 +1,297 @@
+"""
+
+This module runs encodes and decodes for a server without blocking it: every
+request is a CodecTask that runs in a pool of warm workers, and the server is
+told when it is done. Images and .lhe files are kept in memory, so requests
+never share a file.
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import collections
+import cPickle
+import multiprocessing
+import os
+import threading
+import time
+import Queue
+import Auxiliary.instrument as instrument
+import codec
+from batch import warmUp
+
+# -------------#
+# LHE SERVICE  #
+# -------------#
+
+# States of a task
+PENDING, RUNNING, FINISHED, CANCELLED = "pending", "running", "finished", "cancelled"
+
+WATCH_INTERVAL = 0.1 # Seconds between checks of the running tasks, if they have a time limit
+
+
+class CancelledError(Exception):
+	"""The result of a cancelled task was asked for."""
+
+
+#*******************************************************************************#
+#	Function _run: This runs a function in a worker. Python 2 pools have no     #
+#	error callback, so the exception is returned to be thrown in the server.    #
+#	If the worker is another process, what we return must be pickled: if it     #
+#	can not be, the pool never calls back and the task would run forever, so    #
+#	we return that error instead.                                               #
+#	Input: (function, arguments, process id of the service)                     #
+#	Output: (exception or None, result)                                         #
+#*******************************************************************************#
+
+def _run(args):
+	function, arguments, parent = args
+	try:
+		output = None, function(*arguments)
+	except Exception as e:
+		output = e, None
+
+	if (os.getpid() != parent):
+		try:
+			cPickle.loads(cPickle.dumps(output, cPickle.HIGHEST_PROTOCOL))
+		except Exception as e:
+			output = cPickle.PicklingError("The output of the task can not be sent to the service: %s" % e), None
+
+	return output
+
+
+#*******************************************************************************#
+#	Class CodecTask: This is an encode or a decode sent to a CodecService. It   #
+#	can be waited for, cancelled while it is waiting for a worker, and it calls #
+#	its callbacks (in a thread of the service) when it is done, so an event     #
+#	loop can be woken up from there.                                            #
+#*******************************************************************************#
+
+class CodecTask(object):
+	"""An encode or decode of a CodecService (see its encode and decode methods).
+
+	Attributes: state (string, PENDING, RUNNING, FINISHED or CANCELLED).
+
+	"""
+	def __init__(self, service, function, arguments):
+		self.state = PENDING
+		self._service = service
+		self._function = function
+		self._arguments = arguments
+		self._done = threading.Event()
+		self._callbacks = []
+		self._error = None
+		self._result = None
+
+	def cancel(self):
+		"""Cancels the task if no worker has it yet. Returns True if it is cancelled."""
+		return self._service._cancel(self)
+
+	def cancelled(self):
+		"""Returns True if the task was cancelled."""
+		return self.state == CANCELLED
+
+	def done(self):
+		"""Returns True if the task is finished or cancelled."""
+		return self._done.is_set()
+
+	def result(self, timeout=None):
+		"""Waits for the task (at most timeout seconds) and returns its result.
+
+		Exceptions: This will throw the exception of the task if it failed,
+		CancelledError if it was cancelled, or Queue.Empty on timeout.
+
+		"""
+		if not self._done.wait(timeout):
+			raise Queue.Empty("The task is not done yet")
+		if self.state == CANCELLED:
+			raise CancelledError()
+		if self._error is not None:
+			raise self._error
+		return self._result
+
+	def add_done_callback(self, callback):
+		"""Calls callback(task) when the task is done (now, if it is already done)."""
+		with self._service._lock:
+			if not self.done():
+				self._callbacks.append(callback)
+				return
+		callback(self)
+
+	def _finish(self, state, error=None, result=None):
+		with self._service._lock:
+			self.state = state
+			self._error = error
+			self._result = result
+			self._done.set()
+			callbacks, self._callbacks = self._callbacks, []
+		for callback in callbacks:
+			callback(self)
+
+
+#*******************************************************************************#
+#	Class CodecService: This keeps a pool of warm workers (see batch.py), or    #
+#	any other pool with apply_async (a ThreadPool, for example). Tasks wait in  #
+#	the service until a worker is free, so they can still be cancelled, and no  #
+#	more than max_pending tasks can be waiting or running: then new requests    #
+#	wait (or fail with Queue.Full), so the server can not be flooded.           #
+#	A worker which is killed never calls back, so running tasks can have a      #
+#	time limit: then they fail, and the next task waiting is sent to the pool.  #
+#	Input: number of processes, most tasks waiting or running, pool (optional), #
+#	number of tasks it runs at the same time and seconds a task can run         #
+#*******************************************************************************#
+
+class CodecService(object):
+	"""Runs encodes and decodes in a pool of workers, without blocking the caller.
+
+	Parameters: number of processes (integer, all the CPUs by default), most
+	tasks waiting or running (integer, 4 per worker by default), pool (an
+	object with apply_async, like multiprocessing.Pool; a pool of warm
+	workers by default), tasks it can run at the same time (integer, its
+	number of workers by default) and seconds a task can run before it fails
+	with multiprocessing.TimeoutError (number, no limit by default).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	def __init__(self, jobs=None, max_pending=None, executor=None, workers=None, task_timeout=None):
+		self.workers = workers or jobs or multiprocessing.cpu_count()
+		self.max_pending = max_pending or 4 * self.workers
+		self.task_timeout = task_timeout
+
+		self._owned = executor is None
+		self._executor = executor if executor is not None else multiprocessing.Pool(jobs, warmUp)
+		self._lock = threading.Lock()
+		self._slots = threading.BoundedSemaphore(self.max_pending)
+		self._waiting = collections.deque()
+		self._running = 0
+		self._started = {} # Running task: time it was given to a worker
+		self._lost = False # True if a task ran out of time, its worker may be gone
+		self._closed = False
+
+		self._stop = threading.Event()
+		self._watcher = None
+		if task_timeout is not None:
+			self._watcher = threading.Thread(target=self._watch)
+			self._watcher.daemon = True
+			self._watcher.start()
+
+	def encode(self, data, mode, blocks_x=1, blocks_y=1, entropy=codec.ENTROPY_HUFFMAN, block=True, timeout=None):
+		"""Returns a CodecTask that encodes an image file (string) into a .lhe file (string).
+
+		Parameters: as codec.encode_bytes, and whether we wait for room if
+		there are max_pending tasks (boolean, True by default) and for how
+		long (seconds, forever by default).
+
+		Exceptions: This will throw Queue.Full if there is no room.
+
+		"""
+		return self.submit(codec.encode_bytes, (data, mode, blocks_x, blocks_y, 1, entropy), block, timeout)
+
+	def decode(self, data, fmt="BMP", upsampling="nearest", ycbcr=False, region=None, block=True, timeout=None):
+		"""Returns a CodecTask that decodes a .lhe file (string) into an image file (string).
+
+		Parameters: as codec.decode_bytes, and whether we wait for room if
+		there are max_pending tasks (boolean, True by default) and for how
+		long (seconds, forever by default).
+
+		Exceptions: This will throw Queue.Full if there is no room.
+
+		"""
+		return self.submit(codec.decode_bytes, (data, fmt, 1, upsampling, ycbcr, region), block, timeout)
+
+	def submit(self, function, arguments, block=True, timeout=None):
+		"""Returns a CodecTask that runs function(*arguments) in a worker.
+
+		Exceptions: This will throw Queue.Full if there is no room, or
+		ValueError if the service is closed.
+
+		"""
+		if self._closed:
+			raise ValueError("The service is closed")
+		if not self._acquire(block, timeout):
+			raise Queue.Full("There are %d tasks waiting or running" % self.max_pending)
+
+		task = CodecTask(self, function, arguments)
+		with self._lock:
+			self._waiting.append(task)
+		self._dispatch()
+		return task
+
+	def _acquire(self, block, timeout):
+		# Python 2 semaphores have no timeout, so we try again every 10 ms
+		if not block or timeout is None:
+			return self._slots.acquire(block)
+		end = time.time() + timeout
+		while not self._slots.acquire(False):
+			if time.time() >= end:
+				return False
+			time.sleep(0.01)
+		return True
+
+	def _dispatch(self):
+		# Tasks go to the workers only when one of them is free
+		while True:
+			with self._lock:
+				if not self._waiting or self._running >= self.workers:
+					return
+				task = self._waiting.popleft()
+				task.state = RUNNING
+				self._running += 1
+				self._started[task] = time.time()
+			self._executor.apply_async(instrument.pooled(_run), ((task._function, task._arguments, os.getpid()),), callback=lambda output, task=task: self._finished(task, instrument.collect(output)))
+
+	def _finished(self, task, output):
+		with self._lock:
+			# A task which ran out of time can still be finished by its worker
+			if task.state != RUNNING or task not in self._started:
+				return
+			del self._started[task]
+			self._running -= 1
+		error, result = output
+		self._slots.release()
+		task._finish(FINISHED, error, result)
+		self._dispatch()
+
+	def _watch(self):
+		while not self._stop.wait(WATCH_INTERVAL):
+			now = time.time()
+			with self._lock:
+				late = [task for task, start in self._started.items() if now - start > self.task_timeout]
+			if late:
+				self._lost = True
+			for task in late:
+				self._finished(task, (multiprocessing.TimeoutError("The task did not finish in %g seconds" % self.task_timeout), None))
+
+	def _cancel(self, task):
+		with self._lock:
+			if task.state != PENDING:
+				return task.state == CANCELLED
+			self._waiting.remove(task)
+		self._slots.release()
+		task._finish(CANCELLED)
+		return True
+
+	def close(self):
+		"""Cancels the tasks still waiting and stops the workers we started, once their tasks are done (at once if a task ran out of time)."""
+		self._closed = True
+		with self._lock:
+			waiting = list(self._waiting)
+		for task in waiting:
+			task.cancel()
+		if self._watcher is not None:
+			self._stop.set()
+			self._watcher.join()
+		if self._owned:
+			# The pool would wait for the tasks that ran out of time forever
+			if self._lost:
+				self._executor.terminate()
+			else:
+				self._executor.close()
+			self._executor.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
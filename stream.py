@@ -0,0 +1,403 @@
+"""
+
+This module encodes images band by band, so the whole image never has to be
+in memory: only a band of rows and its codified data. Encoded images can be
+compared with the original ones the same way.
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import zlib
+import numpy as np
+from PIL import Image
+import Auxiliary.color as color
+import codec
+import workers
+from Auxiliary.quality import QualityMeter
+from blocks import getBlocksLimits, encodeBlock
+from binary_enc import writeHeader, getDataPosition, TOC_ENTRY, LHE_VERSION, ENTROPY_HUFFMAN
+
+# -------------#
+# LHE STREAM   #
+# -------------#
+
+DEFAULT_BAND_HEIGHT = 64 # Rows of every band, if the image is not too high for it
+BLOCK_PIXELS = 1 << 18 # Most pixels of a block by default, so a band of a wide image is split in blocks
+
+
+#*******************************************************************************#
+#	Class StreamEncoder: This encodes an image given its rows, a band at a      #
+#	time. Every band is a row of blocks of the .lhe file (see blocks.py), so    #
+#	it is encoded and written as soon as its rows arrive, and then forgotten.   #
+#	Only the table of contents is kept, and it is written with the header when  #
+#	the encoder is closed, so the output must be seekable. The file is the      #
+#	same one codec.encode_image writes with the same blocks.                    #
+#	A file has 255 rows of blocks at most, so bands of high images have more    #
+#	rows, and by default every band is split in blocks of BLOCK_PIXELS pixels   #
+#	at most (as far as 255 blocks in a row allow): a block is quantized and     #
+#	codified at once, so the memory we need does not grow with the image.       #
+#	Input: .lhe file, width and height of the image, chrominance mode, height   #
+#	of the bands, number of blocks in a band, number of processes and entropy   #
+#	coder                                                                       #
+#*******************************************************************************#
+
+class StreamEncoder(object):
+	"""Encodes an image in a .lhe file, band by band.
+
+	Parameters: .lhe file (path or seekable file-like object), width and
+	height of the image (integers), chrominance mode (integer, 0 for 4:2:0,
+	1 for 4:2:2 or 2 for 4:4:4), rows of every band (integer, even; by default
+	DEFAULT_BAND_HEIGHT or the least for 255 bands), number of blocks in a
+	band (integer; by default the least for blocks of BLOCK_PIXELS pixels),
+	number of processes for those blocks (integer; by default the pool of
+	workers.py for bands of workers.POOL_PIXELS pixels or more) and entropy coder
+	(ENTROPY_HUFFMAN by default or ENTROPY_RANGE).
+
+	Exceptions: This will throw an exception if the .lhe file can not be
+	written, or if there would be more than 255 bands.
+
+	"""
+	def __init__(self, lhe_file, width, height, mode, band_height=None, blocks_x=None, jobs=None, entropy=ENTROPY_HUFFMAN):
+		if band_height is None:
+			band_height = max(DEFAULT_BAND_HEIGHT, -(-height // 255))
+		if blocks_x is None:
+			blocks_x = min(255, max(1, -(-width * min(band_height, height) // BLOCK_PIXELS)))
+
+		self.width = width
+		self.height = height
+		self.mode = mode
+		self.entropy = entropy
+		self.rows = 0 # Rows received
+
+		# Bands are the rows of blocks, with the limits the decoder will compute
+		self._limits_x, self._limits_y = getBlocksLimits(width, height, blocks_x, -(-height // band_height))
+		self._band = 0
+		# Rows of the current band (the last band can have a row more than the others)
+		self._buffer = np.empty((3, max([y1 - y0 for (y0, y1) in self._limits_y]), width), dtype=np.uint8)
+		self._planes = self._buffer[:, :self._limits_y[0][1]]
+		self._filled = 0
+		self._toc = []
+		self._first = None
+
+		self._jobs = jobs
+
+		if hasattr(lhe_file, "write"):
+			self._file = lhe_file
+			self._owned = False
+		else:
+			self._file = open(lhe_file, "wb")
+			self._owned = True
+
+		# Room for the header and the table of contents, written when we are done
+		self._start = self._file.tell()
+		self._position = getDataPosition(len(self._limits_x) * len(self._limits_y))
+		self._file.write("\0" * self._position)
+
+	def write(self, rgb):
+		"""Encodes some rows given their RGB values (uint8 array of rows x width x 3)."""
+		rgb = np.asarray(rgb, dtype=np.uint8)
+		y, cb, cr = color.RGBtoYUV(rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2])
+		self.writeYUV(y, cb, cr)
+
+	def writeYUV(self, y, cb, cr):
+		"""Encodes some rows given their y, cb and cr values (uint8 arrays of rows x width)."""
+		rows = len(y)
+		if (self.rows + rows > self.height):
+			raise ValueError("The image has %d rows, but we got %d" % (self.height, self.rows + rows))
+
+		done = 0
+		while (done < rows):
+			# Rows we still need for the current band
+			band_rows = len(self._planes[0])
+			n = min(band_rows - self._filled, rows - done)
+			for plane, values in zip(self._planes, (y, cb, cr)):
+				plane[self._filled:self._filled + n] = values[done:done + n]
+			self._filled += n
+			done += n
+
+			if (self._filled == band_rows):
+				self._encodeBand()
+
+		self.rows += rows
+
+	def _encodeBand(self):
+		# Every block of the band is encoded as blocks.encodeBlocks does
+		tasks = [(self._planes[0][:, x0:x1], self._planes[1][:, x0:x1], self._planes[2][:, x0:x1], self.mode, self.entropy)
+				 for (x0, x1) in self._limits_x]
+		blocks = workers.run(encodeBlock, tasks, self._jobs, self._planes[0].size)
+
+		if self._first is None:
+			self._first = blocks[0][:3], len(blocks[0][3])
+
+		for block in blocks:
+			for first, data in zip(block[:3], block[3:]):
+				self._file.write(data)
+				self._toc.append(TOC_ENTRY.pack(first, self._position, len(data), zlib.crc32(data) & 0xFFFFFFFF))
+				self._position += len(data)
+
+		# Next band
+		self._band += 1
+		self._filled = 0
+		if (self._band < len(self._limits_y)):
+			y0, y1 = self._limits_y[self._band]
+			self._planes = self._buffer[:, :y1 - y0]
+
+	def close(self):
+		"""Writes the header and the table of contents, and closes the .lhe file if we opened it."""
+		try:
+			if (self.rows != self.height):
+				raise ValueError("The image has %d rows, but we only got %d" % (self.height, self.rows))
+
+			end = self._file.tell()
+			self._file.seek(self._start)
+			first, lum_len = self._first
+			writeHeader(self._file, self.mode, self.width, self.height, len(self._limits_x), len(self._limits_y),
+						first, lum_len, LHE_VERSION, self.entropy)
+			self._file.write(''.join(self._toc))
+			self._file.seek(end)
+		finally:
+			self._release()
+
+	def _release(self):
+		if self._owned:
+			self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		# If something went wrong, the file is left without header
+		if exc_type is None:
+			self.close()
+		else:
+			self._release()
+
+
+#*******************************************************************************#
+#	Function encodeYUVFile: This encodes a raw YUV file (the y, cb and cr       #
+#	planes one after the other, as image_dec.saveImage writes them) without     #
+#	loading it: the file is memory mapped and read band by band.                #
+#	Input: raw YUV file, .lhe file, width and height of the image, chrominance  #
+#	mode, height of the bands, number of blocks in a band, number of processes  #
+#	and entropy coder                                                           #
+#	Output: None, this just creates the file                                    #
+#*******************************************************************************#
+
+def encodeYUVFile(yuv_file, lhe_file, width, height, mode, band_height=None, blocks_x=None, jobs=None, entropy=ENTROPY_HUFFMAN):
+	"""Encodes a raw YUV file in a .lhe file, band by band.
+
+	Parameters: raw YUV file (path), .lhe file (path or seekable file-like
+	object), width and height of the image (integers), chrominance mode
+	(integer), rows of every band, number of blocks in a band and number of
+	processes (integers, see StreamEncoder), entropy coder.
+
+	Exceptions: This will throw an exception if the files can not be read or
+	written, or if the YUV file is too short.
+
+	"""
+	planes = np.memmap(yuv_file, dtype=np.uint8, mode="r", shape=(3, height, width))
+
+	with StreamEncoder(lhe_file, width, height, mode, band_height, blocks_x, jobs, entropy) as encoder:
+		for y0, y1 in encoder._limits_y:
+			encoder.writeYUV(planes[0, y0:y1], planes[1, y0:y1], planes[2, y0:y1])
+
+
+#*******************************************************************************#
+#	Function getTiles: This gets where the rows of an image are in its file,    #
+#	from the tiles PIL describes before loading it, so we can read a band of    #
+#	rows without decoding the whole image. Only uncompressed images (BMP,       #
+#	TIFF, PPM...) can be read this way, the rows of the others are not in a     #
+#	known place of the file.                                                    #
+#	Input: PIL image                                                            #
+#	Output: list of tiles (box, position, raw mode, bytes per row and 1 if the  #
+#	rows are saved from top to bottom or -1 if from bottom to top), None if     #
+#	the image is already loaded                                                 #
+#*******************************************************************************#
+
+def getTiles(image):
+	"""Returns where the rows of an image are in its file, as a list of tiles.
+
+	Parameters: PIL image (opened, so it is not decoded yet).
+
+	Exceptions: This will throw ValueError if the image is compressed, or
+	its rows can not be read band by band.
+
+	"""
+	if not getattr(image, "tile", None):
+		# It is in memory, we can just crop it
+		return None
+
+	tiles = []
+	for name, box, position, args in image.tile:
+		if (name != "raw"):
+			raise ValueError("%s images with %s data can not be read band by band, only uncompressed ones" % (image.format, name))
+		if not isinstance(args, tuple):
+			args = (args,)
+		rawmode, stride, orientation = (args + (0, 1))[:3]
+
+		if (stride <= 0):
+			try:
+				stride = len(Image.new(image.mode, (box[2] - box[0], 1)).tobytes("raw", rawmode))
+			except (ValueError, SystemError):
+				raise ValueError("%s images of %s pixels can not be read band by band" % (image.format, rawmode))
+		tiles.append((box, position, rawmode, stride, orientation))
+
+	# Every plane of the image in its own tiles
+	if (len(set([tile[0] for tile in tiles])) != len(tiles)):
+		raise ValueError("%s images with planes in their own tiles can not be read band by band" % image.format)
+
+	return tiles
+
+
+#*******************************************************************************#
+#	Function readRows: This reads some rows of an image file, only the bytes    #
+#	of the tiles (see getTiles) where they are.                                 #
+#	Input: PIL image, its tiles, first and last row (not included)              #
+#	Output: RGB values of the rows (uint8 array of rows x width x 3)            #
+#*******************************************************************************#
+
+def readRows(image, tiles, y0, y1):
+	"""Returns the RGB values of some rows of an image.
+
+	Parameters: PIL image, its tiles (as getTiles gives them), first and last
+	row (integers, the last one is not included).
+
+	Exceptions: This will throw an exception if the image file can not be
+	read or it is too short.
+
+	"""
+	width = image.size[0]
+
+	if tiles is None:
+		band = image.crop((0, y0, width, y1))
+	else:
+		band = Image.new(image.mode, (width, y1 - y0))
+		for (x0, top, x1, bottom), position, rawmode, stride, orientation in tiles:
+			r0, r1 = max(y0, top), min(y1, bottom)
+			if (r0 >= r1):
+				continue
+			# Rows saved from bottom to top start from the end of the tile
+			if (orientation < 0):
+				image.fp.seek(position + (bottom - r1) * stride)
+			else:
+				image.fp.seek(position + (r0 - top) * stride)
+			data = image.fp.read((r1 - r0) * stride)
+			if (len(data) != (r1 - r0) * stride):
+				raise IOError("The image file is too short")
+			band.paste(Image.frombytes(image.mode, (x1 - x0, r1 - r0), data, "raw", rawmode, stride, orientation), (x0, r0 - y0))
+		if image.palette:
+			band.palette = image.palette.copy()
+
+	if band.mode != 'RGB':
+		band = band.convert('RGB')
+	return np.asarray(band)
+
+
+#*******************************************************************************#
+#	Function encodeImageFile: This encodes an image file band by band, so we    #
+#	never have its planes (or its hops) for the whole image. Every band is      #
+#	read from the file alone (see readRows), so the image must be               #
+#	uncompressed (BMP, TIFF, PPM...) or already in memory.                      #
+#	Input: image (path, file object or PIL image), .lhe file, chrominance mode, #
+#	height of the bands, number of blocks in a band, number of processes and    #
+#	entropy coder                                                               #
+#	Output: None, this just creates the file                                    #
+#*******************************************************************************#
+
+def encodeImageFile(image, lhe_file, mode, band_height=None, blocks_x=None, jobs=None, entropy=ENTROPY_HUFFMAN):
+	"""Encodes an image in a .lhe file, band by band.
+
+	Parameters: image (path, file object or PIL image; an image file must be
+	uncompressed, such as BMP, TIFF or PPM, unless it is already loaded),
+	.lhe file (path or seekable file-like object), chrominance mode
+	(integer), rows of every band, number of blocks in a band and number of
+	processes (integers, see StreamEncoder), entropy coder.
+
+	Exceptions: This will throw an exception if the image can not be opened or
+	the .lhe file can not be written, or ValueError if the image is
+	compressed (use codec.encode_image for those).
+
+	"""
+	if not isinstance(image, Image.Image):
+		image = Image.open(image)
+	width, height = image.size
+	tiles = getTiles(image) # Before the .lhe file is created
+
+	with StreamEncoder(lhe_file, width, height, mode, band_height, blocks_x, jobs, entropy) as encoder:
+		for y0, y1 in encoder._limits_y:
+			encoder.write(readRows(image, tiles, y0, y1))
+
+
+#*******************************************************************************#
+#	Function compareImageFile: This measures the quality of a .lhe file against #
+#	its original image, band by band: every band of rows is decoded (see        #
+#	codec.decode_rows) and compared with the same rows of the image, converted  #
+#	to YCbCr as the encoder does, so only a band of both images is in memory    #
+#	(the image is read as encodeImageFile reads it).                            #
+#	Input: image (path, file object or PIL image), .lhe file, rows of every     #
+#	band, chroma upsampling method and True if we want the SSIM                 #
+#	Output: Quality (see Auxiliary/quality.py)                                  #
+#*******************************************************************************#
+
+def compareImageFile(image, lhe_file, rows=DEFAULT_BAND_HEIGHT, upsampling="nearest", ssim=True):
+	"""Returns the Quality (PSNR, MSE and SSIM of Y, Cb and Cr) of a .lhe file.
+
+	Parameters: original image (path, file object or PIL image), .lhe file
+	(path or file-like object), rows of every band (integer), upsampling of
+	subsampled chrominance (string, "nearest" by default or "bilinear"), True
+	if we want the SSIM (boolean, True by default).
+
+	Exceptions: This will throw an exception if the files can not be read,
+	or ValueError if the image and the .lhe file have not the same size or
+	the image is compressed (see encodeImageFile).
+
+	"""
+	if not isinstance(image, Image.Image):
+		image = Image.open(image)
+	width, height = image.size
+	tiles = getTiles(image)
+
+	meter = QualityMeter(width, ssim)
+	for decoded in codec.decode_rows(lhe_file, rows, upsampling, ycbcr=True):
+		if (meter.rows + len(decoded) > height):
+			raise ValueError("The .lhe file has more rows than the image")
+		band = readRows(image, tiles, meter.rows, meter.rows + len(decoded))
+		meter.update(color.RGBtoYUV(band[:, :, 0], band[:, :, 1], band[:, :, 2]), decoded.transpose(2, 0, 1))
+
+	if (meter.rows != height):
+		raise ValueError("The .lhe file has %d rows and the image %d" % (meter.rows, height))
+	return meter.result()
+
+
+#*******************************************************************************#
+#	Function compareYUVFile: This measures the quality of a .lhe file against   #
+#	its original raw YUV file, band by band. The YUV file is memory mapped.     #
+#	Input: raw YUV file, .lhe file, width and height of the image, rows of      #
+#	every band, chroma upsampling method and True if we want the SSIM           #
+#	Output: Quality (see Auxiliary/quality.py)                                  #
+#*******************************************************************************#
+
+def compareYUVFile(yuv_file, lhe_file, width, height, rows=DEFAULT_BAND_HEIGHT, upsampling="nearest", ssim=True):
+	"""Returns the Quality (PSNR, MSE and SSIM of Y, Cb and Cr) of a .lhe file.
+
+	Parameters: original raw YUV file (path), .lhe file (path or file-like
+	object), width and height of the image (integers), rows of every band
+	(integer), upsampling of subsampled chrominance (string), True if we want
+	the SSIM (boolean, True by default).
+
+	Exceptions: This will throw an exception if the files can not be read,
+	or ValueError if the YUV file and the .lhe file have not the same size.
+
+	"""
+	planes = np.memmap(yuv_file, dtype=np.uint8, mode="r", shape=(3, height, width))
+
+	meter = QualityMeter(width, ssim)
+	for decoded in codec.decode_rows(lhe_file, rows, upsampling, ycbcr=True):
+		if (meter.rows + len(decoded) > height):
+			raise ValueError("The .lhe file has more rows than the YUV file")
+		meter.update(planes[:, meter.rows:meter.rows + len(decoded)], decoded.transpose(2, 0, 1))
+
+	if (meter.rows != height):
+		raise ValueError("The .lhe file has %d rows and the YUV file %d" % (meter.rows, height))
+	return meter.result()
@@ -0,0 +1,77 @@
+"""
+
+Tests of the block mode: limits of the blocks and round trips of images whose
+last block used to be 1 pixel wide or high. Run them from the repository with
+python -m unittest discover -s tests
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import unittest
+from cStringIO import StringIO
+import numpy as np
+from PIL import Image
+import kernels
+import codec
+from blocks import getBlocksLimits
+from binary_enc import ENTROPY_HUFFMAN, ENTROPY_RANGE
+
+# Width, height and blocks in a row and in a column
+ODD_BLOCKS = ((101, 40, 11, 4), (13, 7, 4, 1), (17, 9, 8, 8), (33, 21, 8, 8), (5, 5, 3, 3))
+
+
+def randomImage(width, height, seed=0):
+	"""Returns a PIL image of random pixels."""
+	rgb = np.random.RandomState(seed).randint(0, 256, (height, width, 3)).astype(np.uint8)
+	return Image.fromarray(rgb)
+
+
+class BlocksLimitsTest(unittest.TestCase):
+
+	def testNoBlockOfOnePixel(self):
+		for size in range(2, 120):
+			for nblocks in range(1, 256):
+				limits = getBlocksLimits(size, size, nblocks, nblocks)[0]
+				self.assertEqual(limits[0][0], 0)
+				self.assertEqual(limits[-1][1], size)
+				for (x0, x1), (next0, next1) in zip(limits, limits[1:]):
+					self.assertEqual(x1, next0)
+				for x0, x1 in limits:
+					self.assertTrue(x1 - x0 >= 2 and x0 % 2 == 0, (size, nblocks, limits))
+
+	def testDecoderGetsTheSameLimits(self):
+		# The header only has the number of blocks, the decoder computes their limits again
+		for size in range(1, 120):
+			for nblocks in range(1, 256):
+				limits = getBlocksLimits(size, 1, nblocks, 1)[0]
+				self.assertEqual(getBlocksLimits(size, 1, len(limits), 1)[0], limits)
+
+	def testLastBlockIsMerged(self):
+		self.assertEqual(getBlocksLimits(101, 40, 11, 4)[0][-1], (90, 101))
+		self.assertEqual(getBlocksLimits(13, 7, 4, 1)[0], [(0, 4), (4, 8), (8, 13)])
+
+
+class BlocksRoundTripTest(unittest.TestCase):
+
+	def setUp(self):
+		self.backend = kernels.getBackend()
+
+	def tearDown(self):
+		kernels.setBackend(self.backend)
+
+	def testOddBlocks(self):
+		for backend in kernels.availableBackends():
+			kernels.setBackend(backend)
+			for width, height, blocks_x, blocks_y in ODD_BLOCKS:
+				image = randomImage(width, height)
+				for mode in (0, 1, 2):
+					for entropy in (ENTROPY_HUFFMAN, ENTROPY_RANGE):
+						lhe = StringIO()
+						codec.encode_image(image, lhe, mode, blocks_x, blocks_y, jobs=1, entropy=entropy)
+						rgb = codec.decode_image(StringIO(lhe.getvalue()), jobs=1)
+						self.assertEqual(rgb.shape, (height, width, 3), (backend, width, height, mode, entropy))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,164 @@
+"""
+
+Tests of the codec: round trips of images of odd sizes with both entropy
+coders, .lhe files of every version (older ones are written here as the codec
+used to write them) and decoding of some components or a region with the
+table of contents. Run them from the repository with
+python -m unittest discover -s tests
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import unittest
+from cStringIO import StringIO
+import numpy as np
+from PIL import Image
+import Auxiliary.color as color
+import kernels
+import codec
+from blocks import getBlocksLimits
+from binary_enc import getSymbols, symbolsString, getHuffman, getRange, writeBlocksFile
+from binary_enc import LHE_LEGACY, LHE_CANONICAL, LHE_ENTROPY, LHE_TOC, ENTROPY_HUFFMAN, ENTROPY_RANGE
+from binary_dec import LHEReader
+from LHEquantizer import ImagePlanes, getPlaneHops
+from test_blocks import randomImage
+
+# Width and height of the images, down to 1 pixel
+ODD_SIZES = ((1, 1), (1, 2), (2, 1), (1, 7), (3, 3), (5, 2), (37, 23))
+
+
+def encode(image, mode, blocks_x=1, blocks_y=1, entropy=ENTROPY_HUFFMAN):
+	"""Returns the .lhe file of an image (string)."""
+	lhe = StringIO()
+	codec.encode_image(image, lhe, mode, blocks_x, blocks_y, jobs=1, entropy=entropy)
+	return lhe.getvalue()
+
+
+def encodeOlder(image, mode, blocks_x, blocks_y, version, entropy=ENTROPY_HUFFMAN):
+	"""Returns the .lhe file of an image (string) with the layout of a version older than LHE_TOC."""
+	planes = ImagePlanes(image)
+	y, cb, cr = color.RGBtoYUV(planes.r, planes.g, planes.b)
+	limits_x, limits_y = getBlocksLimits(planes.width, planes.height, blocks_x, blocks_y)
+
+	data = []
+	for (y0, y1) in limits_y:
+		for (x0, x1) in limits_x:
+			width, height = x1 - x0, y1 - y0
+			block = [plane[y0:y1, x0:x1] for plane in (y, cb, cr)]
+			hops = [getPlaneHops(plane, width, height, component, mode)[0] for plane, component in zip(block, codec.COMPONENTS)]
+			first = tuple([int(plane[0, 0]) for plane in block])
+
+			# Luminance alone and both chrominances together
+			if (entropy == ENTROPY_RANGE):
+				data.append(first + (getRange(hops[:1], width, height, mode, False), getRange(hops[1:], width, height, mode, True)))
+			else:
+				sym = [symbolsString(getSymbols(h, width, height, width * height)[0]) for h in hops]
+				data.append(first + (getHuffman(sym[0], version), getHuffman(sym[1] + '0' + sym[2], version)))
+
+	lhe = StringIO()
+	writeBlocksFile(data, mode, planes.width, planes.height, len(limits_x), len(limits_y), lhe, version, entropy)
+	return lhe.getvalue()
+
+
+def decode(lhe, **kwargs):
+	"""Returns the RGB values of a .lhe file (string)."""
+	return codec.decode_image(StringIO(lhe), jobs=1, **kwargs)
+
+
+class CodecTest(unittest.TestCase):
+
+	def setUp(self):
+		self.backend = kernels.getBackend()
+
+	def tearDown(self):
+		kernels.setBackend(self.backend)
+
+
+class RoundTripTest(CodecTest):
+
+	def testOddSizes(self):
+		for backend in kernels.availableBackends():
+			kernels.setBackend(backend)
+			for width, height in ODD_SIZES:
+				image = randomImage(width, height)
+				for mode in (0, 1, 2):
+					for entropy in (ENTROPY_HUFFMAN, ENTROPY_RANGE):
+						lhe = encode(image, mode, entropy=entropy)
+						self.assertEqual(decode(lhe).shape, (height, width, 3), (backend, width, height, mode, entropy))
+
+	def testBackendsGiveTheSameFile(self):
+		image = randomImage(37, 23)
+		for entropy in (ENTROPY_HUFFMAN, ENTROPY_RANGE):
+			files = set()
+			for backend in kernels.availableBackends():
+				kernels.setBackend(backend)
+				files.add(encode(image, 0, 3, 2, entropy))
+			self.assertEqual(len(files), 1)
+
+	def testQuality(self):
+		# A smooth image should be close to the original
+		xx, yy = np.meshgrid(np.arange(64), np.arange(48))
+		rgb = np.dstack([xx * 3, yy * 4, (xx + yy) * 2]).astype(np.uint8)
+		for entropy in (ENTROPY_HUFFMAN, ENTROPY_RANGE):
+			decoded = decode(encode(Image.fromarray(rgb), 2, entropy=entropy))
+			self.assertTrue(np.abs(decoded.astype(int) - rgb).mean() < 8)
+
+
+class OlderVersionsTest(CodecTest):
+
+	def testOlderVersions(self):
+		image = randomImage(37, 23)
+		for mode in (0, 1, 2):
+			for blocks_x, blocks_y in ((1, 1), (3, 2)):
+				for entropy in (ENTROPY_HUFFMAN, ENTROPY_RANGE):
+					expected = decode(encode(image, mode, blocks_x, blocks_y, entropy))
+					versions = (LHE_ENTROPY,) if (entropy == ENTROPY_RANGE) else (LHE_LEGACY, LHE_CANONICAL, LHE_ENTROPY)
+					for version in versions:
+						lhe = encodeOlder(image, mode, blocks_x, blocks_y, version, entropy)
+						with LHEReader(StringIO(lhe)) as reader:
+							self.assertEqual(reader.version, version)
+						self.assertTrue(np.array_equal(decode(lhe), expected), (mode, blocks_x, blocks_y, entropy, version))
+
+	def testOldestVersionHasNoMagic(self):
+		lhe = encodeOlder(randomImage(8, 8), 0, 1, 1, LHE_LEGACY)
+		self.assertEqual(lhe[0], '\0')
+
+	def testRangeNeedsVersion3(self):
+		self.assertRaises(ValueError, encodeOlder, randomImage(8, 8), 0, 1, 1, LHE_CANONICAL, ENTROPY_RANGE)
+
+
+class PartialDecodeTest(CodecTest):
+
+	def testComponents(self):
+		image = randomImage(37, 23)
+		for blocks_x, blocks_y in ((1, 1), (3, 2)):
+			for entropy in (ENTROPY_HUFFMAN, ENTROPY_RANGE):
+				lhe = encode(image, 0, blocks_x, blocks_y, entropy)
+				y, cb, cr = codec.decodePlanes(StringIO(lhe), jobs=1)
+				luma, = codec.decodePlanes(StringIO(lhe), jobs=1, components=("y",))
+				self.assertTrue(np.array_equal(luma, y))
+
+	def testRegion(self):
+		image = randomImage(37, 23)
+		for version in (LHE_ENTROPY, LHE_TOC):
+			for blocks_x, blocks_y in ((1, 1), (3, 2)):
+				if (version == LHE_TOC):
+					lhe = encode(image, 1, blocks_x, blocks_y)
+				else:
+					lhe = encodeOlder(image, 1, blocks_x, blocks_y, version)
+				whole = decode(lhe)
+				for region in ((0, 0, 37, 23), (5, 3, 20, 17), (30, 20, 37, 23)):
+					x0, y0, x1, y1 = region
+					self.assertTrue(np.array_equal(decode(lhe, region=region), whole[y0:y1, x0:x1]), (version, blocks_x, region))
+
+	def testCorruptedPlane(self):
+		lhe = encode(randomImage(37, 23), 0)
+		with LHEReader(StringIO(lhe)) as reader:
+			position = reader.toc()[2][0][0][1] # Luminance of the first block
+		broken = lhe[:position] + chr(ord(lhe[position]) ^ 0xff) + lhe[position + 1:]
+		self.assertRaises(ValueError, decode, broken)
+
+
+if __name__ == '__main__':
+	unittest.main()
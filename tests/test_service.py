@@ -0,0 +1,40 @@
+"""
+
+Tests of the service module: tasks whose workers can not answer must fail
+instead of running forever. Run them from the repository with
+python -m unittest discover -s tests
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import cPickle
+import multiprocessing
+import os
+import signal
+import threading
+import unittest
+import service
+
+
+def kill():
+	"""Kills the worker that runs it."""
+	os.kill(os.getpid(), signal.SIGKILL)
+
+
+class ServiceTest(unittest.TestCase):
+
+	def testUnpicklableResult(self):
+		with service.CodecService(1) as codecs:
+			self.assertRaises(cPickle.PicklingError, codecs.submit(threading.Lock, ()).result, 10)
+			# The worker is free again
+			self.assertEqual(codecs.submit(pow, (2, 10)).result(10), 1024)
+
+	def testKilledWorker(self):
+		with service.CodecService(1, task_timeout=1) as codecs:
+			self.assertRaises(multiprocessing.TimeoutError, codecs.submit(kill, ()).result, 10)
+			self.assertEqual(codecs.submit(pow, (3, 3)).result(10), 27)
+
+
+if __name__ == '__main__':
+	unittest.main()
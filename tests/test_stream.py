@@ -0,0 +1,82 @@
+"""
+
+Tests of the stream module: bands of rows read from uncompressed image files
+without loading them, and files encoded band by band. Run them from the
+repository with python -m unittest discover -s tests
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+import numpy as np
+from PIL import Image
+import codec
+import stream
+from test_blocks import randomImage
+
+# File name and mode of the images read band by band
+FORMATS = (("rgb.bmp", "RGB"), ("p.bmp", "P"), ("l.bmp", "L"), ("one.bmp", "1"), ("rgb.tif", "RGB"),
+		   ("rgba.tif", "RGBA"), ("rgb.ppm", "RGB"), ("rgb.tga", "RGB"))
+
+# First row and rows of every band we read
+BANDS = ((0, 37), (0, 5), (5, 7), (30, 7), (36, 1))
+
+
+class ReadRowsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.image = randomImage(23, 37)
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def save(self, name, mode):
+		path = os.path.join(self.folder, name)
+		self.image.convert(mode).save(path)
+		return path
+
+	def testFormats(self):
+		for name, mode in FORMATS:
+			path = self.save(name, mode)
+			expected = np.asarray(Image.open(path).convert("RGB"))
+			image = Image.open(path)
+			tiles = stream.getTiles(image)
+			for y0, rows in BANDS:
+				self.assertTrue(np.array_equal(stream.readRows(image, tiles, y0, y0 + rows), expected[y0:y0 + rows]), (name, y0))
+			# Bands are read from the file, the image is never loaded
+			self.assertTrue(image.tile, name)
+
+	def testCompressedImage(self):
+		path = self.save("rgb.png", "RGB")
+		self.assertRaises(ValueError, stream.encodeImageFile, path, StringIO(), 0)
+
+	def testImageInMemory(self):
+		self.assertEqual(stream.getTiles(self.image), None)
+		self.assertTrue(np.array_equal(stream.readRows(self.image, None, 5, 12), np.asarray(self.image)[5:12]))
+
+
+class StreamEncoderTest(unittest.TestCase):
+
+	def testSameFileAsBlocks(self):
+		folder = tempfile.mkdtemp()
+		try:
+			path = os.path.join(folder, "image.bmp")
+			randomImage(40, 50).save(path)
+			for mode in (0, 1, 2):
+				streamed = StringIO()
+				stream.encodeImageFile(path, streamed, mode, band_height=16, blocks_x=3, jobs=1)
+				lhe = StringIO()
+				codec.encode_image(path, lhe, mode, 3, 4, jobs=1)
+				self.assertEqual(streamed.getvalue(), lhe.getvalue())
+		finally:
+			shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,100 @@
+"""
+
+This module keeps the pool of worker processes of the codec. It is created the
+first time a process needs it and then reused, so encoding or decoding an image
+does not start new processes every time. Small images are not worth sending to
+other processes, so by default they are coded in the calling one.
+
+"""
+# LHE Codec
+# Author: Eduardo Rodes Pastor
+
+import multiprocessing
+import os
+import threading
+import kernels
+import Auxiliary.instrument as instrument
+
+# -------------#
+# LHE WORKERS  #
+# -------------#
+
+POOL_PIXELS = 1 << 20 # Pixels an image needs to be coded in the pool, when the number of processes is not given
+
+_lock = threading.Lock()
+_pools = {} # Number of processes: pool of this process
+
+
+#*******************************************************************************#
+#	Function getPool: This returns the pool of worker processes of this process #
+#	with that many processes, creating it the first time. A child process       #
+#	never uses the pool of its parent, it gets its own.                         #
+#	Input: number of processes (all the CPUs by default)                        #
+#	Output: multiprocessing.Pool                                                #
+#*******************************************************************************#
+
+def getPool(jobs=None):
+	"""Returns the pool of worker processes of this process, created when it is first needed.
+
+	Parameters: number of processes (integer, all the CPUs by default).
+
+	Exceptions: This function does not throw an exception.
+
+	"""
+	key = (os.getpid(), jobs or multiprocessing.cpu_count())
+	with _lock:
+		if key not in _pools:
+			_pools[key] = multiprocessing.Pool(key[1])
+		return _pools[key]
+
+
+def useProcesses(jobs, pixels):
+	"""Returns True if pixels should be coded in worker processes, given the number of processes asked (None by default)."""
+	if (jobs is None):
+		# Workers of other pools (daemons) can not start processes
+		return pixels >= POOL_PIXELS and multiprocessing.cpu_count() > 1 and not multiprocessing.current_process().daemon
+	return jobs != 1
+
+
+#*******************************************************************************#
+#	Class _task: This runs a function of a task in a worker with the kernels    #
+#	backend of the parent, since the pool may have been started before the     #
+#	parent changed it.                                                          #
+#	Input: function (of the module level, so it can be pickled)                 #
+#*******************************************************************************#
+
+class _task(object):
+	def __init__(self, function):
+		self.function = function
+		self.backend = kernels.getBackend()
+
+	def __call__(self, args):
+		if (kernels.getBackend() != self.backend):
+			kernels.setBackend(self.backend)
+		return self.function(args)
+
+
+#*******************************************************************************#
+#	Function run: This runs a function for every task, in the pool of worker    #
+#	processes or in this process (see useProcesses). Whatever the workers       #
+#	measure is added to this process (see instrument.pooled).                   #
+#	Input: function, tasks, number of processes and pixels of the image         #
+#	Output: results, in the same order as the tasks                             #
+#*******************************************************************************#
+
+def run(function, tasks, jobs=None, pixels=0):
+	"""Returns the result of function for every task, running them in the pool if they are worth it.
+
+	Parameters: function (of the module level), tasks (list of arguments),
+	number of processes (integer, 1 runs everything in this process; by
+	default the pool is used for POOL_PIXELS pixels or more) and pixels of the
+	image (integer).
+
+	Exceptions: This will throw the exception of any task that fails.
+
+	"""
+	if (len(tasks) < 2 or not useProcesses(jobs, pixels)):
+		return [function(task) for task in tasks]
+
+	pool = getPool(jobs)
+	return [instrument.collect(output) for output in pool.map(instrument.pooled(_task(function)), tasks)]